@@ -0,0 +1,93 @@
+# api/authentication.py
+"""
+Autenticação com cache para o caminho quente das requisições.
+
+- CachedTokenAuthentication: token DRF -> usuário sem consultar o banco
+  em regime (authtoken_token + auth_user).
+- CachedModelBackend: usuário da sessão (AuthenticationMiddleware e
+  SessionAuthentication) lido do cache.
+
+As entradas são removidas quando o Token ou o User é salvo ou excluído
+(ver api/signals.py) e expiram após AUTH_CACHE_TIMEOUT segundos, limite
+de defasagem quando o cache não é compartilhado entre processos.
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+
+def token_cache_key(key):
+    # O token não vai em claro para o cache
+    return f'auth:token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def get_cached_user(user_id):
+    """Usuário pelo ID, do cache ou do banco (None se não existir)"""
+    key = user_cache_key(user_id)
+    user = cache.get(key)
+    if user is None:
+        User = get_user_model()
+        try:
+            user = User._default_manager.get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        cache.set(key, user, timeout=settings.AUTH_CACHE_TIMEOUT)
+    return user
+
+
+def _delete_now_and_on_commit(key):
+    # De novo após o commit: uma leitura concorrente pode ter recolocado o
+    # valor antigo no cache antes de a alteração ficar visível
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def invalidate_user(user_id):
+    _delete_now_and_on_commit(user_cache_key(user_id))
+
+
+def invalidate_token(key):
+    _delete_now_and_on_commit(token_cache_key(key))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        user_id = cache.get(cache_key)
+        if user_id is None:
+            try:
+                token = self.get_model().objects.select_related('user').get(key=key)
+            except self.get_model().DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            user_id = token.user_id
+            cache.set(cache_key, user_id, timeout=settings.AUTH_CACHE_TIMEOUT)
+            cache.set(user_cache_key(user_id), token.user, timeout=settings.AUTH_CACHE_TIMEOUT)
+            user = token.user
+        else:
+            user = get_cached_user(user_id)
+            if user is None:
+                cache.delete(cache_key)
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        # Token montado sem consulta; request.auth.key continua disponível
+        return (user, self.get_model()(key=key, user=user))
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        user = get_cached_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
@@ -0,0 +1,12 @@
+from rest_framework.pagination import CursorPagination
+
+
+class PaymentCursorPagination(CursorPagination):
+    """
+    Paginação por cursor (keyset) em (-created_at, -id): o custo de cada
+    página não depende do tamanho do histórico, ao contrário de COUNT/OFFSET.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
@@ -0,0 +1,18 @@
+# api/signals.py
+"""Invalidação do cache de autenticação (ver api/authentication.py)"""
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_token, invalidate_user
+
+
+@receiver([post_save, post_delete], sender=get_user_model())
+def user_changed(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Token)
+def token_changed(sender, instance, **kwargs):
+    invalidate_token(instance.key)
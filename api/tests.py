@@ -1,3 +1,368 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+from unittest import mock
 
-# Create your tests here.
+import stripe
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from payments.catalog import get_catalog, get_catalog_state
+from payments.models import Payment, Product, StripeCustomer
+from payments.stripe_client import reset_client
+
+
+class ProductCatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = Product.objects.create(
+                name='Curso', description='Curso', price='100.00', stripe_product_id='prod_x'
+            )
+
+    def test_lista_em_regime_nao_consulta_o_banco(self):
+        url = reverse('api:product_list')
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json()['results'][0]['name'], 'Curso')
+
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(second.json(), first.json())
+
+    def test_revalidacao_responde_304(self):
+        url = reverse('api:product_detail', kwargs={'pk': self.product.pk})
+        response = self.client.get(url)
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+        revalidation = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidation.status_code, 304)
+
+    def test_alteracao_de_produto_invalida_cache(self):
+        url = reverse('api:product_list')
+        etag = self.client.get(url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Curso Novo'
+            self.product.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['name'], 'Curso Novo')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_detalhe_usa_entrada_propria_sem_montar_o_catalogo(self):
+        url = reverse('api:product_detail', kwargs={'pk': self.product.pk})
+        self.assertEqual(self.client.get(url).json()['name'], 'Curso')
+
+        version, _ = get_catalog_state()
+        self.assertIsNone(cache.get(f'catalog:v{version}'))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).json()['name'], 'Curso')
+
+    def test_com_o_lock_ocupado_aguarda_a_remontagem_em_vez_do_banco(self):
+        version, _ = get_catalog_state()
+        key = f'catalog:v{version}'
+        cache.add(f'{key}:lock', 1)
+
+        def other_worker_finishes(seconds):
+            cache.set(key, {'products': [], 'list': [{'name': 'Montado por outro worker'}]})
+
+        with mock.patch('payments.catalog.time.sleep', side_effect=other_worker_finishes), \
+                self.assertNumQueries(0):
+            catalog = get_catalog()
+        self.assertEqual(catalog['list'][0]['name'], 'Montado por outro worker')
+
+    def test_produto_inexistente_retorna_404(self):
+        response = self.client.get(reverse('api:product_detail', kwargs={'pk': 999}))
+        self.assertEqual(response.status_code, 404)
+
+
+# Roteamento para a réplica é coberto em payments.tests.ReplicaRoutingTests;
+# aqui as leituras ficam no primário mesmo com DATABASE_REPLICA_URL definido
+@override_settings(DATABASE_READ_REPLICA=None)
+class PaymentListPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('cliente', email='cliente@example.com')
+        self.client.force_login(self.user)
+        product = Product.objects.create(
+            name='Curso', description='Curso', price='100.00', stripe_product_id='prod_x'
+        )
+        for i in range(5):
+            Payment.objects.create(
+                user=self.user, product=product, stripe_payment_intent_id=f'pi_{i}',
+                amount=product.price, status='succeeded' if i % 2 else 'pending'
+            )
+
+    def test_paginacao_por_cursor_percorre_tudo_sem_repetir(self):
+        url = reverse('api:payment_list') + '?page_size=2'
+        seen = []
+        while url:
+            data = self.client.get(url).json()
+            self.assertNotIn('count', data)
+            seen.extend(item['stripe_payment_intent_id'] for item in data['results'])
+            url = data['next']
+
+        self.assertEqual(seen, [f'pi_{i}' for i in reversed(range(5))])
+
+    def test_quantidade_de_queries_nao_depende_do_numero_de_linhas(self):
+        url = reverse('api:payment_list')
+        # sessão + usuário + página (usuário e produto via select_related)
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(len(response.json()['results']), 5)
+
+    def test_filtro_por_status(self):
+        data = self.client.get(reverse('api:payment_list') + '?status=succeeded').json()
+        self.assertEqual({item['status'] for item in data['results']}, {'succeeded'})
+
+
+class CreatePaymentIntentIdempotencyTests(TestCase):
+    @mock.patch('stripe.PaymentIntent')
+    def test_retry_com_a_mesma_chave_nao_cria_outro_pagamento(self, intent_api):
+        intent_api.create.return_value = mock.Mock(id='pi_1', client_secret='s', status='requires_payment_method')
+        user = User.objects.create_user('cliente', email='cliente@example.com')
+        StripeCustomer.objects.create(user=user, stripe_customer_id='cus_1')
+        product = Product.objects.create(
+            name='Curso', description='Curso', price='100.00', stripe_product_id='prod_x'
+        )
+        self.client.force_login(user)
+        url = reverse('api:create_payment_intent')
+        body = {'product_id': product.id, 'payment_method': 'card'}
+
+        responses = [
+            self.client.post(url, body, content_type='application/json', HTTP_IDEMPOTENCY_KEY='k1')
+            for _ in range(3)
+        ]
+
+        self.assertEqual({response.json()['payment_id'] for response in responses}, {Payment.objects.get().id})
+        self.assertEqual(intent_api.create.call_count, 1)
+        self.assertEqual(responses[-1]['Idempotent-Replayed'], 'true')
+
+
+
+@override_settings(STRIPE_RATE_LIMIT_RETRIES=0, STRIPE_RATE_LIMITS={
+    'payment_intent': {'user': '2/min', 'global': '3/min'}, 'customer': {'global': '1/min'},
+})
+@mock.patch('stripe.PaymentIntent')
+class PaymentIntentRateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_client()
+        self.addCleanup(reset_client)
+        # Relógio no início de uma janela de um minuto
+        clock = mock.patch('payments.throttling.time').start()
+        clock.time.return_value = 1_000_020.0
+        self.addCleanup(mock.patch.stopall)
+        self.product = Product.objects.create(
+            name='Curso', description='Curso', price='100.00', stripe_product_id='prod_x'
+        )
+        self.url = reverse('api:create_payment_intent')
+        self.body = {'product_id': self.product.id, 'payment_method': 'card'}
+
+    def login(self, username, customer_id='cus_1'):
+        user = User.objects.create_user(username, email=f'{username}@example.com')
+        if customer_id:
+            StripeCustomer.objects.create(user=user, stripe_customer_id=customer_id)
+        self.client.force_login(user)
+        return user
+
+    def post(self):
+        return self.client.post(self.url, self.body, content_type='application/json')
+
+    def test_limite_por_usuario_e_global_com_retry_after(self, intent_api):
+        intent_api.create.return_value = mock.Mock(id='pi_1', client_secret='s', status='requires_payment_method')
+        self.login('ana')
+        statuses = [self.post().status_code for _ in range(3)]
+
+        self.assertEqual(statuses, [200, 200, 429])
+        # A recusa pelo limite da Ana não consumiu a cota global
+        self.login('bia', customer_id='cus_2')
+        self.assertEqual(self.post().status_code, 200)
+        response = self.post()
+
+        self.assertEqual(response.status_code, 429)
+        # 4 na janela para 3/min: na próxima, as 3 aceitas pesam 2/3 após 20s
+        self.assertEqual(response['Retry-After'], '80')
+        self.assertEqual(intent_api.create.call_count, 3)
+
+    @mock.patch('stripe.Customer')
+    def test_criacao_de_customer_tem_limite_global(self, customer_api, intent_api):
+        customer_api.list.return_value = mock.Mock(data=[])
+        customer_api.create.return_value = mock.Mock(id='cus_novo')
+        intent_api.create.return_value = mock.Mock(id='pi_1', client_secret='s', status='requires_payment_method')
+
+        self.login('ana', customer_id=None)
+        self.assertEqual(self.post().status_code, 200)
+        self.login('bia', customer_id=None)
+        response = self.post()
+
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(customer_api.create.call_count, 1)
+
+    def test_repeticao_idempotente_nao_consome_a_cota(self, intent_api):
+        intent_api.create.return_value = mock.Mock(id='pi_1', client_secret='s', status='requires_payment_method')
+        self.login('ana')
+        statuses = [
+            self.client.post(self.url, self.body, content_type='application/json', HTTP_IDEMPOTENCY_KEY='k1').status_code
+            for _ in range(3)
+        ]
+
+        self.assertEqual(statuses, [200, 200, 200])
+        self.assertEqual(self.post().status_code, 200)
+        self.assertEqual(intent_api.create.call_count, 2)
+
+    def test_429_do_stripe_vira_429_para_o_cliente(self, intent_api):
+        intent_api.create.side_effect = stripe.error.RateLimitError('limite', headers={'Retry-After': '3'})
+        self.login('ana')
+        response = self.post()
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '3')
+
+
+
+@override_settings(
+    STRIPE_RATE_LIMIT_RETRIES=0, STRIPE_RATE_LIMITS={},
+    STRIPE_CIRCUIT_BREAKER={'default': {'failures': 1, 'reset_timeout': 30}},
+)
+class StripeCircuitBreakerApiTests(TestCase):
+    def setUp(self):
+        reset_client()
+        self.addCleanup(reset_client)
+
+    @mock.patch('stripe.PaymentIntent')
+    def test_checkout_falha_rapido_e_health_mostra_o_circuito(self, intent_api):
+        intent_api.create.side_effect = stripe.error.APIConnectionError('timeout')
+        user = User.objects.create_user('cliente', email='cliente@example.com')
+        StripeCustomer.objects.create(user=user, stripe_customer_id='cus_1')
+        product = Product.objects.create(name='Curso', description='Curso', price='100.00', stripe_product_id='prod_x')
+        self.client.force_login(user)
+        url = reverse('payments:checkout', kwargs={'product_id': product.id})
+
+        body = {'payment_method': 'card'}
+        self.assertEqual(self.client.post(url, body, content_type='application/json').status_code, 400)
+        response = self.client.post(url, body, content_type='application/json')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(intent_api.create.call_count, 1)
+
+        health = self.client.get(reverse('api:health_check'))
+        self.assertEqual(health.status_code, 200)
+        self.assertEqual(health.json()['status'], 'degraded')
+        self.assertEqual(health.json()['stripe']['circuits']['PaymentIntent.create']['state'], 'open')
+
+
+@override_settings(DATABASE_READ_REPLICA=None)
+class CachedAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('cliente', email='cliente@example.com')
+        self.token = Token.objects.create(user=self.user)
+        self.url = reverse('api:payment_list')
+
+    def get_with_token(self):
+        return self.client.get(self.url, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_token_em_regime_nao_consulta_o_banco(self):
+        self.assertEqual(self.get_with_token().status_code, 200)
+
+        # apenas a página de pagamentos
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_with_token().status_code, 200)
+
+    def test_sessao_em_regime_nao_busca_o_usuario(self):
+        self.client.force_login(self.user)
+        self.client.get(self.url)
+
+        # sessão + página
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_token_excluido_ou_usuario_inativo_invalida_o_cache(self):
+        self.get_with_token()
+        self.user.is_active = False
+        self.user.save()
+        # 403 e não 401: SessionAuthentication é o primeiro autenticador
+        self.assertEqual(self.get_with_token().status_code, 403)
+
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(self.get_with_token().status_code, 200)
+        self.token.delete()
+        self.assertEqual(self.get_with_token().status_code, 403)
+
+
+@override_settings(DATABASE_READ_REPLICA=None)
+class PaymentExportTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('financeiro', email='fin@example.com', is_staff=True)
+        self.client.force_login(self.staff)
+        product = Product.objects.create(name='Curso', description='Curso', price='100.00')
+        for i in range(5):
+            Payment.objects.create(
+                user=self.staff, product=product, stripe_payment_intent_id=f'pi_{i}', amount='100.00',
+                status='succeeded' if i % 2 else 'pending', payment_method_type='boleto' if i == 3 else 'card',
+            )
+
+    def content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_csv_em_streaming_com_filtros(self):
+        response = self.client.get(reverse('api:payment_export') + '?status=succeeded&payment_method=card')
+
+        self.assertTrue(response.streaming)
+        rows = list(csv.DictReader(io.StringIO(self.content(response).decode())))
+        self.assertEqual([row['stripe_payment_intent_id'] for row in rows], ['pi_1'])
+        self.assertEqual((rows[0]['amount'], rows[0]['product'], rows[0]['username']), ('100.00', 'Curso', 'financeiro'))
+
+    def test_ndjson_com_gzip(self):
+        response = self.client.get(reverse('api:payment_export') + '?output=ndjson&gzip=1&since=2000-01-01')
+
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        lines = gzip.decompress(self.content(response)).decode().splitlines()
+        self.assertEqual([json.loads(line)['stripe_payment_intent_id'] for line in lines], [f'pi_{i}' for i in range(5)])
+
+    def test_apenas_staff(self):
+        self.client.force_login(User.objects.create_user('cliente'))
+        self.assertEqual(self.client.get(reverse('api:payment_export')).status_code, 403)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(reverse('api:payment_export') + '?since=ontem').status_code, 400)
+
+
+@override_settings(DATABASE_READ_REPLICA=None)
+class RevenueAnalyticsTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('financeiro', is_staff=True))
+        user = User.objects.create_user('cliente')
+        curso = Product.objects.create(name='Curso', description='Curso', price='100.00')
+        ebook = Product.objects.create(name='E-book', description='E-book', price='50.00')
+        for i, (product, method, payment_status) in enumerate([
+            (curso, 'card', 'succeeded'), (curso, 'pix', 'succeeded'), (ebook, 'card', 'succeeded'),
+            (ebook, 'boleto', 'pending'),
+        ]):
+            Payment.objects.create(user=user, product=product, stripe_payment_intent_id=f'pi_{i}',
+                                   amount=product.price, payment_method_type=method, status=payment_status)
+
+    def test_resumo_a_partir_dos_totais_diarios(self):
+        with self.assertNumQueries(7):
+            data = self.client.get(reverse('api:analytics')).json()
+
+        self.assertEqual(data['totals'], {'count': 3, 'gross': '250.00', 'fees': '0.00', 'net': '250.00'})
+        self.assertEqual([item['name'] for item in data['top_products']], ['Curso', 'E-book'])
+        self.assertEqual({item['payment_method']: item['share'] for item in data['payment_methods']},
+                         {'card': 0.6, 'pix': 0.4})
+        self.assertEqual(data['by_status'], {'succeeded': 3, 'pending': 1})
+        self.assertEqual(len(data['daily']), 1)
+
+    def test_apenas_staff(self):
+        self.client.force_login(User.objects.create_user('cliente2'))
+        self.assertEqual(self.client.get(reverse('api:analytics')).status_code, 403)
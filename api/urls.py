@@ -22,6 +22,10 @@ urlpatterns = [
     
     # Payments
     path('payments/', views.PaymentListView.as_view(), name='payment_list'),
+    path('payments/export/', views.export_payments, name='payment_export'),
     path('payments/<int:pk>/', views.PaymentDetailView.as_view(), name='payment_detail'),
     path('payments/create-intent/', views.create_payment_intent, name='create_payment_intent'),
+    
+    # Analytics
+    path('analytics/', views.revenue_analytics, name='analytics'),
 ]
\ No newline at end of file
@@ -1,25 +1,43 @@
 from rest_framework import generics, status
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.exceptions import Throttled
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
 from django_filters.rest_framework import DjangoFilterBackend
 from django.conf import settings
+from django.utils import timezone
+from django.db import router
+from django.http import Http404, StreamingHttpResponse
+from datetime import datetime, timedelta
 from decimal import Decimal
 import stripe
 import json
 import logging
+import math
+import time
 
 from payments.models import Product, Payment, WebhookEvent
+from payments.customers import get_or_create_customer_id
+from payments.export import FORMATS as EXPORT_FORMATS, export_filename, export_queryset, export_stream, parse_day
+from payments.idempotency import IdempotencyError, run_idempotent
+from payments.rollups import revenue_summary
+from payments.stripe_client import get_client, retry_after
+from payments.throttling import RateLimited, check_rate
+from payments.circuit_breaker import CircuitOpenError
+from payments.catalog import (
+    add_catalog_headers, catalog_etag, conditional_response, get_catalog, get_catalog_product
+)
+from api.pagination import PaymentCursorPagination
+from stripe_sandbox.db_router import use_read_replica
 from payments.serializers import (
     ProductSerializer, PaymentSerializer, 
     PaymentCreateSerializer, UserSerializer
 )
 
 logger = logging.getLogger(__name__)
-stripe.api_key = settings.STRIPE_SECRET_KEY
 
 # Authentication Views
 @api_view(['POST'])
@@ -79,75 +97,100 @@ def sandbox_login(request):
 
 # Product Views
 class ProductListView(generics.ListAPIView):
+    """Lista servida do cache versionado do catálogo, com ETag/Last-Modified"""
     queryset = Product.objects.filter(active=True)
     serializer_class = ProductSerializer
+    use_read_replica = True
     permission_classes = [AllowAny]
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['active']
     ordering = ['-created_at']
 
+    def list(self, request, *args, **kwargs):
+        etag, last_modified = catalog_etag()
+        not_modified = conditional_response(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        # O catálogo em cache contém apenas produtos ativos
+        products = get_catalog()['list']
+        if request.query_params.get('active', '').lower() in ('false', '0'):
+            products = []
+
+        page = self.paginate_queryset(products)
+        if page is not None:
+            response = self.get_paginated_response(page)
+        else:
+            response = Response(products)
+        return add_catalog_headers(response, etag, last_modified)
+
 class ProductDetailView(generics.RetrieveAPIView):
+    """Detalhe servido do cache versionado do catálogo, com ETag/Last-Modified"""
     queryset = Product.objects.filter(active=True)
     serializer_class = ProductSerializer
+    use_read_replica = True
     permission_classes = [AllowAny]
 
+    def retrieve(self, request, *args, **kwargs):
+        etag, last_modified = catalog_etag()
+        not_modified = conditional_response(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        entry = get_catalog_product(kwargs['pk'])
+        if entry is None:
+            raise Http404
+        return add_catalog_headers(Response(entry['detail']), etag, last_modified)
+
 # Payment Views
 class PaymentListView(generics.ListAPIView):
     serializer_class = PaymentSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = PaymentCursorPagination
+    use_read_replica = True
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['status', 'payment_method_type']
     ordering = ['-created_at']
 
     def get_queryset(self):
-        return Payment.objects.filter(user=self.request.user)
+        return Payment.objects.filter(user=self.request.user).select_related('user', 'product')
 
 class PaymentDetailView(generics.RetrieveAPIView):
     serializer_class = PaymentSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Payment.objects.filter(user=self.request.user)
-
-@api_view(['POST'])
-@permission_classes([IsAuthenticated])
-def create_payment_intent(request):
-    """Cria Payment Intent no Stripe"""
-    serializer = PaymentCreateSerializer(data=request.data)
-    if not serializer.is_valid():
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return Payment.objects.filter(user=self.request.user).select_related('user', 'product')
 
+def _create_payment_intent(request, data, stripe_idempotency_key=None):
+    """Cria o PaymentIntent e o Payment; retorna (status, payload)"""
+    started = time.perf_counter()
     try:
+        # Só quando um intent vai ser criado: repetições idempotentes não chegam aqui
+        check_rate('payment_intent', request.user)
         product = Product.objects.get(
-            id=serializer.validated_data['product_id'], 
+            id=data['product_id'], 
             active=True
         )
-        payment_method = serializer.validated_data['payment_method']
-        billing_details = serializer.validated_data.get('billing_details', {})
+        payment_method = data['payment_method']
+        billing_details = data.get('billing_details', {})
 
-        logger.info(f"Criando Payment Intent para {payment_method}, produto: {product.name}")
+        logger.debug("Criando Payment Intent para %s, produto: %s", payment_method, product.id)
         
-        # Criar ou obter customer do Stripe
-        customer = None
+        # Obter customer do Stripe (mapeamento local, criado sob demanda)
         try:
-            customers = stripe.Customer.list(email=request.user.email, limit=1)
-            if customers.data:
-                customer = customers.data[0]
-            else:
-                customer = stripe.Customer.create(
-                    email=request.user.email,
-                    name=request.user.get_full_name() or request.user.username,
-                    metadata={'django_user_id': request.user.id}
-                )
+            customer_id = get_or_create_customer_id(request.user)
+        except (stripe.error.RateLimitError, CircuitOpenError):
+            raise
         except stripe.error.StripeError as e:
-            logger.error(f"Erro ao criar customer: {e}")
-            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            logger.error("Erro ao criar customer: %s", e)
+            return status.HTTP_400_BAD_REQUEST, {'error': str(e)}
 
         # Configuração específica para cada método de pagamento
         intent_data = {
             'amount': int(product.price * 100),  # Em centavos
             'currency': 'brl',
-            'customer': customer.id if customer else None,
+            'customer': customer_id,
             'confirmation_method': 'automatic',
             'metadata': {
                 'product_id': str(product.id),
@@ -180,34 +223,74 @@ def create_payment_intent(request):
             })
 
         # Criar Payment Intent
-        intent = stripe.PaymentIntent.create(**intent_data)
-        logger.info(f"Payment Intent criado: {intent.id}")
+        intent = get_client().PaymentIntent.create(**intent_data, idempotency_key=stripe_idempotency_key)
 
         # Salvar pagamento no banco
-        payment = Payment.objects.create(
-            user=request.user,
-            product=product,
+        payment, _ = Payment.objects.get_or_create(
             stripe_payment_intent_id=intent.id,
-            stripe_customer_id=customer.id if customer else '',
-            amount=product.price,
-            payment_method_type=payment_method,
-            status='pending'
+            defaults={
+                'user': request.user,
+                'product': product,
+                'stripe_customer_id': customer_id,
+                'amount': product.price,
+                'payment_method_type': payment_method,
+                'status': 'pending',
+            },
         )
 
-        return Response({
+        # Uma linha de resumo por criação de intent
+        logger.info(
+            "Payment Intent %s criado via API: pagamento %s (%s) em %.0f ms",
+            intent.id, payment.id, payment_method, (time.perf_counter() - started) * 1000,
+            extra={
+                'event': 'api_create_payment_intent', 'payment_id': payment.id, 'intent_id': intent.id,
+                'payment_method': payment_method, 'user_id': request.user.id,
+            },
+        )
+        return status.HTTP_200_OK, {
             'client_secret': intent.client_secret,
             'payment_id': payment.id,
             'payment_method': payment_method,
             'status': intent.status
-        })
+        }
 
+    except (RateLimited, CircuitOpenError):
+        raise
+    except stripe.error.RateLimitError as e:
+        raise RateLimited('stripe', retry_after(e) or 1) from e
     except Exception as e:
-        logger.error(f"Erro ao criar Payment Intent: {e}")
+        logger.error("Erro ao criar Payment Intent: %s", e, exc_info=not isinstance(e, stripe.error.StripeError))
+        return status.HTTP_500_INTERNAL_SERVER_ERROR, {'error': str(e)}
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_payment_intent(request):
+    """Cria Payment Intent no Stripe (aceita o header Idempotency-Key)"""
+    serializer = PaymentCreateSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    data = serializer.validated_data
+    try:
+        response_status, payload, replayed = run_idempotent(
+            request.user, 'api.create_payment_intent', request.headers.get('Idempotency-Key'), data,
+            lambda stripe_key: _create_payment_intent(request, data, stripe_key),
+        )
+    except IdempotencyError as e:
+        return Response({'error': str(e)}, status=e.status)
+    except RateLimited as e:
+        # Throttled vira 429 com Retry-After pelo tratamento de exceções do DRF
+        raise Throttled(wait=e.retry_after, detail=str(e))
+    except CircuitOpenError as e:
         return Response(
-            {'error': str(e)}, 
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            {'error': 'Pagamentos temporariamente indisponíveis. Tente novamente em instantes.'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={'Retry-After': str(math.ceil(e.retry_after))},
         )
 
+    headers = {'Idempotent-Replayed': 'true'} if replayed else None
+    return Response(payload, status=response_status, headers=headers)
+
 # Config View
 @api_view(['GET'])
 @permission_classes([AllowAny])
@@ -217,12 +300,84 @@ def stripe_config(request):
         'publishable_key': settings.STRIPE_PUBLISHABLE_KEY
     })
 
+# Exportação para o financeiro (streaming, sem paginação)
+@use_read_replica
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def export_payments(request):
+    """
+    Exporta pagamentos em CSV ou NDJSON.
+    Parâmetros: since/until (YYYY-MM-DD, until exclusivo), status e
+    payment_method (separados por vírgula), output (csv|ndjson), gzip=1.
+    """
+    params = request.query_params
+    fmt = params.get('output', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return Response({'error': 'output deve ser csv ou ndjson'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        since = parse_day(params['since']) if params.get('since') else None
+        until = parse_day(params['until']) if params.get('until') else None
+    except ValueError:
+        return Response({'error': 'Datas no formato YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+    compress = params.get('gzip', '').lower() in ('1', 'true')
+
+    queryset = export_queryset(
+        since, until,
+        statuses=[value for value in params.get('status', '').split(',') if value],
+        methods=[value for value in params.get('payment_method', '').split(',') if value],
+    )
+    # O alias é fixado aqui: o streaming roda depois de o middleware de réplica terminar
+    queryset = queryset.using(router.db_for_read(Payment))
+
+    response = StreamingHttpResponse(
+        export_stream(queryset, fmt, gzip=compress),
+        content_type='application/gzip' if compress else EXPORT_FORMATS[fmt],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(fmt, compress)}"'
+    return response
+
+# Analytics de receita a partir dos totais diários (PaymentDailyRollup)
+@use_read_replica
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def revenue_analytics(request):
+    """
+    Receita por dia, método e produto (bruto, taxas e líquido).
+    Parâmetros: since/until (YYYY-MM-DD, until exclusivo; padrão: últimos
+    30 dias), status (separados por vírgula; padrão succeeded), top.
+    """
+    params = request.query_params
+    try:
+        until = (
+            datetime.strptime(params['until'], '%Y-%m-%d').date() if params.get('until')
+            else timezone.localdate() + timedelta(days=1)
+        )
+        since = (
+            datetime.strptime(params['since'], '%Y-%m-%d').date() if params.get('since')
+            else until - timedelta(days=30)
+        )
+        top = min(int(params.get('top', 5)), 50)
+    except ValueError:
+        return Response({'error': 'Datas no formato YYYY-MM-DD e top inteiro'}, status=status.HTTP_400_BAD_REQUEST)
+    statuses = [value for value in params.get('status', 'succeeded').split(',') if value]
+    return Response(revenue_summary(since, until, statuses=statuses, top=top))
+
 # Health Check
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def health_check(request):
-    """Health check para Railway"""
-    return Response({'status': 'healthy'})
+    """
+    Health check para Railway. Circuitos do Stripe abertos deixam o status
+    'degraded', mas a resposta continua 200: catálogo e histórico seguem no
+    ar e reiniciar o worker não traz o Stripe de volta.
+    """
+    breakers = get_client().breakers
+    circuits = breakers.snapshot() if breakers else {}
+    degraded = any(circuit['state'] != 'closed' for circuit in circuits.values())
+    return Response({
+        'status': 'degraded' if degraded else 'healthy',
+        'stripe': {'circuits': circuits},
+    })
 
 # NOVO: Endpoint para criar produtos de exemplo
 @api_view(['POST'])
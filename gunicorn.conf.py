@@ -0,0 +1,73 @@
+# gunicorn.conf.py
+"""
+Configuração do gunicorn (carregada automaticamente a partir da raiz do projeto).
+
+- Workers gthread: WEB_CONCURRENCY processos (padrão: 2 por CPU + 1, até
+  GUNICORN_MAX_WORKERS) com GUNICORN_THREADS threads cada; as chamadas ao
+  Stripe são I/O, então threads rendem mais que processos extras.
+- preload_app: Django, stripe e URLs são importados uma única vez no
+  master e herdados pelos workers no fork (ver stripe_sandbox/warmup.py);
+  cada worker só abre o pool do Stripe e carrega o catálogo antes de
+  aceitar requisições.
+- max_requests com jitter recicla os workers aos poucos, sem reinícios
+  simultâneos.
+- Métricas: cada worker grava os valores do prometheus_client em
+  PROMETHEUS_MULTIPROC_DIR e /metrics agrega todos os processos. O
+  diretório precisa existir (vazio) antes de os workers importarem
+  prometheus_client.
+"""
+import multiprocessing
+import os
+import shutil
+
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus_multiproc')
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+workers = int(os.getenv('WEB_CONCURRENCY', min(
+    multiprocessing.cpu_count() * 2 + 1, int(os.getenv('GUNICORN_MAX_WORKERS', '8'))
+)))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True').lower() == 'true'
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '100'))
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+
+
+def on_starting(server):
+    # Valores de uma execução anterior não podem ser somados aos novos
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def when_ready(server):
+    # Com preload_app a aplicação já foi carregada no master: aquece os
+    # imports antes do fork para que todos os workers os herdem
+    if server.cfg.preload_app:
+        from stripe_sandbox.warmup import warmup_imports
+
+        warmup_imports()
+
+
+def post_worker_init(worker):
+    # O worker só passa a aceitar conexões depois deste hook
+    from stripe_sandbox.warmup import warmup_connections, warmup_imports
+
+    if not worker.cfg.preload_app:
+        warmup_imports()
+    warmup_connections()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -2,23 +2,27 @@
 
 # Register your models here.
 # payments/admin.py
+import json
+
 from django.contrib import admin
+from django.db.models import Min
 from django.utils.html import format_html
-from .models import Product, Payment, WebhookEvent
+from .models import Product, Payment, PaymentDailyRollup, WebhookEvent, StripeCustomer, ProductSyncTask, IdempotencyKey
+from .replay import REPLAY_OVERLAP, backfill_events, requeue_events
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'price', 'active', 'stripe_product_id', 'created_at')
+    list_display = ('name', 'sku', 'price', 'active', 'stripe_product_id', 'stripe_synced_price', 'created_at')
     list_filter = ('active', 'created_at')
-    search_fields = ('name', 'description')
-    readonly_fields = ('stripe_product_id', 'stripe_price_id')
+    search_fields = ('name', 'sku', 'description')
+    readonly_fields = ('stripe_product_id', 'stripe_price_id', 'stripe_synced_price')
     
     fieldsets = (
         ('Informações Básicas', {
-            'fields': ('name', 'description', 'price', 'active')
+            'fields': ('name', 'sku', 'description', 'price', 'active')
         }),
         ('Stripe Integration', {
-            'fields': ('stripe_product_id', 'stripe_price_id'),
+            'fields': ('stripe_product_id', 'stripe_price_id', 'stripe_synced_price'),
             'classes': ('collapse',)
         }),
     )
@@ -27,8 +31,9 @@ class ProductAdmin(admin.ModelAdmin):
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'product', 'amount', 'payment_method_type', 'status_badge', 'created_at')
     list_filter = ('status', 'payment_method_type', 'created_at')
+    list_select_related = ('user', 'product')
     search_fields = ('user__username', 'product__name', 'stripe_payment_intent_id')
-    readonly_fields = ('stripe_payment_intent_id', 'stripe_customer_id', 'stripe_fee', 'net_amount', 'paid_at')
+    readonly_fields = ('stripe_payment_intent_id', 'stripe_customer_id', 'stripe_charge_id', 'stripe_fee', 'net_amount', 'paid_at')
     
     def status_badge(self, obj):
         colors = {
@@ -52,7 +57,7 @@ class PaymentAdmin(admin.ModelAdmin):
             'fields': ('user', 'product', 'amount', 'currency', 'payment_method_type', 'status')
         }),
         ('Stripe Data', {
-            'fields': ('stripe_payment_intent_id', 'stripe_customer_id'),
+            'fields': ('stripe_payment_intent_id', 'stripe_customer_id', 'stripe_charge_id'),
             'classes': ('collapse',)
         }),
         ('Financeiro', {
@@ -63,10 +68,83 @@ class PaymentAdmin(admin.ModelAdmin):
 
 @admin.register(WebhookEvent)
 class WebhookEventAdmin(admin.ModelAdmin):
-    list_display = ('stripe_event_id', 'event_type', 'processed', 'created_at')
-    list_filter = ('event_type', 'processed', 'created_at')
+    list_display = ('stripe_event_id', 'event_type', 'status', 'attempts', 'processed', 'created_at')
+    list_filter = ('status', 'event_type', 'processed', 'created_at')
     search_fields = ('stripe_event_id', 'event_type')
-    readonly_fields = ('stripe_event_id', 'event_type', 'data')
+    readonly_fields = ('stripe_event_id', 'event_type', 'data_preview', 'attempts', 'last_error', 'processed_at')
+    exclude = ('data',)
+    # Tabela grande: sem COUNT(*) completo a cada página
+    show_full_result_count = False
+    
+    DATA_PREVIEW_CHARS = 5000
+    
+    def get_queryset(self, request):
+        # O payload só é carregado na página do evento (data_preview)
+        return super().get_queryset(request).defer('data')
+    
+    def data_preview(self, obj):
+        data = json.dumps(obj.data, indent=2, ensure_ascii=False)
+        if len(data) > self.DATA_PREVIEW_CHARS:
+            data = data[:self.DATA_PREVIEW_CHARS] + '\n...'
+        return format_html('<pre style="max-height: 400px; overflow: auto;">{}</pre>', data)
+    data_preview.short_description = 'Data'
+    
+    actions = ('reprocess_events', 'backfill_from_stripe')
+    # As ações só enfileiram: processar dentro da requisição do admin
+    # estouraria o timeout do gunicorn. O processamento fica com o worker
+    # process_webhooks ou com o comando replay_stripe_events.
+    QUEUE_HINT = 'Processe com process_webhooks ou replay_stripe_events.'
+    
+    @admin.action(description='Reprocessar eventos selecionados')
+    def reprocess_events(self, request, queryset):
+        requeued = requeue_events(queryset)
+        self.message_user(request, f'{requeued} evento(s) devolvido(s) à fila. {self.QUEUE_HINT}')
+    
+    @admin.action(description='Buscar no Stripe eventos perdidos desde o mais antigo selecionado')
+    def backfill_from_stripe(self, request, queryset):
+        oldest = queryset.aggregate(stripe=Min('stripe_created_at'), local=Min('created_at'))
+        since = (oldest['stripe'] or oldest['local']) - REPLAY_OVERLAP
+        fetched, imported, _ = backfill_events(since, process=False)
+        self.message_user(
+            request, f'{fetched} evento(s) lido(s) do Stripe, {imported} novo(s) na fila. {self.QUEUE_HINT}'
+        )
     
     def has_add_permission(self, request):
-        return False  # Apenas leitura via webhook
\ No newline at end of file
+        return False  # Apenas leitura via webhook
+
+@admin.register(StripeCustomer)
+class StripeCustomerAdmin(admin.ModelAdmin):
+    list_display = ('user', 'stripe_customer_id', 'created_at')
+    search_fields = ('user__username', 'user__email', 'stripe_customer_id')
+    raw_id_fields = ('user',)
+
+@admin.register(ProductSyncTask)
+class ProductSyncTaskAdmin(admin.ModelAdmin):
+    list_display = ('product', 'status', 'attempts', 'next_attempt_at', 'created_at', 'processed_at')
+    list_filter = ('status',)
+    readonly_fields = ('product', 'attempts', 'last_error', 'processed_at')
+    list_select_related = ('product',)
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ('key', 'scope', 'user', 'status', 'response_status', 'created_at')
+    list_filter = ('scope', 'status')
+    search_fields = ('key', 'user__username')
+    readonly_fields = ('user', 'scope', 'key', 'request_hash', 'response_status', 'response_body', 'locked_at', 'completed_at')
+    list_select_related = ('user',)
+    
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(PaymentDailyRollup)
+class PaymentDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ('date', 'product', 'payment_method_type', 'status', 'count', 'gross', 'fees', 'net')
+    list_filter = ('status', 'payment_method_type')
+    date_hierarchy = 'date'
+    list_select_related = ('product',)
+    
+    def has_add_permission(self, request):
+        return False  # Mantido pelos pagamentos (ver payments/rollups.py)
+    
+    def has_change_permission(self, request, obj=None):
+        return False
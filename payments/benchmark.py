@@ -0,0 +1,190 @@
+# payments/benchmark.py
+"""
+Benchmark dos fluxos de pagamento contra o servidor fake do Stripe
+(payments/fake_stripe.py), usado pelo comando `bench_stripe`.
+
+As requisições passam pela pilha Django completa (middlewares, sessão,
+views) via django.test.Client, uma instância por thread.
+"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from django.contrib.auth.models import User
+from django.db import close_old_connections
+from django.test import Client
+from django.urls import reverse
+
+from .customers import get_or_create_customer_id
+from .models import Payment, Product
+
+BENCH_USER_PREFIX = 'bench_user_'
+BENCH_PRODUCT_NAME = '[bench] Produto de benchmark'
+
+
+def percentile(values, pct):
+    """Percentil por vizinho mais próximo de uma lista já ordenada"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    latencies: list = field(default_factory=list)
+    errors: int = 0
+    elapsed: float = 0.0
+    status_codes: dict = field(default_factory=dict)
+
+    @property
+    def requests(self):
+        return len(self.latencies)
+
+    @property
+    def throughput(self):
+        return self.requests / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        return {
+            'scenario': self.name,
+            'requests': self.requests,
+            'errors': self.errors,
+            'throughput': round(self.throughput, 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+            'status_codes': dict(sorted(self.status_codes.items())),
+        }
+
+
+def prepare_fixtures(concurrency):
+    """
+    Cria (ou reaproveita) um usuário por thread e um produto já sincronizado.
+    Os customers são criados antes da medição para que o benchmark reflita
+    o checkout recorrente, não o primeiro acesso de cada usuário.
+    """
+    users = []
+    for index in range(concurrency):
+        user, created = User.objects.get_or_create(
+            username=f'{BENCH_USER_PREFIX}{index}',
+            defaults={'email': f'{BENCH_USER_PREFIX}{index}@example.com'},
+        )
+        get_or_create_customer_id(user)
+        users.append(user)
+
+    product = Product.objects.filter(name=BENCH_PRODUCT_NAME).first()
+    if product is None:
+        # IDs preenchidos para não gerar tarefa de sincronização com o Stripe
+        product = Product.objects.create(
+            name=BENCH_PRODUCT_NAME,
+            description='Produto criado pelo comando bench_stripe',
+            price='49.90',
+            stripe_product_id='prod_bench',
+            stripe_price_id='price_bench',
+            stripe_synced_price='49.90',
+        )
+    return users, product
+
+
+class Scenario:
+    """Um fluxo medido; `request(client, state, index)` faz uma requisição e retorna a resposta"""
+
+    def __init__(self, name, request):
+        self.name = name
+        self.request = request
+
+
+def checkout_scenario(product, payment_method):
+    url = reverse('payments:checkout', kwargs={'product_id': product.id})
+    body = json.dumps({'payment_method': payment_method})
+
+    def request(client, state, index):
+        response = client.post(url, body, content_type='application/json')
+        if response.status_code == 200:
+            state['payment_ids'].append(response.json()['payment_id'])
+        return response
+    return Scenario('checkout', request)
+
+
+def api_create_intent_scenario(product, payment_method):
+    url = reverse('api:create_payment_intent')
+    body = json.dumps({'product_id': product.id, 'payment_method': payment_method})
+
+    def request(client, state, index):
+        response = client.post(url, body, content_type='application/json')
+        if response.status_code == 200:
+            state['payment_ids'].append(response.json()['payment_id'])
+        return response
+    return Scenario('create_payment_intent', request)
+
+
+def success_page_scenario():
+    def request(client, state, index):
+        payment_ids = state['payment_ids']
+        if not payment_ids:
+            return None
+        payment_id = payment_ids[index % len(payment_ids)]
+        return client.get(reverse('payments:payment_success', kwargs={'payment_id': payment_id}))
+    return Scenario('success', request)
+
+
+def run_scenario(scenario, users, states, requests_per_worker):
+    """Executa o cenário com uma thread por usuário e agrega as latências"""
+    result = ScenarioResult(scenario.name)
+    lock = threading.Lock()
+
+    def worker(user, state):
+        client = Client(raise_request_exception=False, HTTP_HOST='localhost')
+        client.force_login(user)
+        latencies, errors, codes = [], 0, {}
+        try:
+            for index in range(requests_per_worker):
+                started = time.perf_counter()
+                response = scenario.request(client, state, index)
+                if response is None:
+                    break
+                latencies.append(time.perf_counter() - started)
+                codes[response.status_code] = codes.get(response.status_code, 0) + 1
+                if response.status_code >= 300:
+                    errors += 1
+        finally:
+            close_old_connections()
+        with lock:
+            result.latencies.extend(latencies)
+            result.errors += errors
+            for code, count in codes.items():
+                result.status_codes[code] = result.status_codes.get(code, 0) + count
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(users), thread_name_prefix='bench') as executor:
+        for future in [executor.submit(worker, user, state) for user, state in zip(users, states)]:
+            future.result()
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def run_benchmark(requests_per_worker, concurrency, payment_method='card', scenarios=None):
+    """
+    Roda checkout, create_payment_intent e página de sucesso em sequência.
+    A página de sucesso reutiliza os pagamentos criados pelos cenários
+    anteriores (ou de execuções passadas, quando rodada sozinha).
+    """
+    users, product = prepare_fixtures(concurrency)
+    states = [
+        {'payment_ids': list(Payment.objects.filter(user=user).values_list('id', flat=True)[:100])}
+        for user in users
+    ]
+    available = {
+        'checkout': checkout_scenario(product, payment_method),
+        'create_payment_intent': api_create_intent_scenario(product, payment_method),
+        'success': success_page_scenario(),
+    }
+    results = []
+    for name in scenarios or list(available):
+        results.append(run_scenario(available[name], users, states, requests_per_worker))
+    return results
@@ -0,0 +1,155 @@
+# payments/catalog.py
+"""
+Cache versionado do catálogo de produtos.
+
+Entradas indexadas pela versão atual:
+- catalog:v{n}: lista dos produtos ativos (instâncias e payload da API),
+  usada pelas páginas de listagem;
+- catalog:v{n}:product:{pk}: um produto (instância e payload de detalhe),
+  usado pelo detalhe, sem desserializar o catálogo inteiro.
+
+Product.save/delete incrementam a versão, o que invalida todas as
+entradas antigas de uma vez, sem precisar apagá-las. Após um incremento,
+só um processo remonta a lista (lock com cache.add); os demais aguardam
+a entrada nova em vez de consultar o banco ao mesmo tempo.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import Http404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+VERSION_KEY = 'catalog:version'
+UPDATED_AT_KEY = 'catalog:updated_at'
+BUILD_LOCK_TIMEOUT = 30
+BUILD_WAIT_SECONDS = 2.0
+
+
+def get_catalog_state():
+    """Retorna (versão, timestamp da última alteração) do catálogo"""
+    state = cache.get_many([VERSION_KEY, UPDATED_AT_KEY])
+    if VERSION_KEY in state and UPDATED_AT_KEY in state:
+        return state[VERSION_KEY], state[UPDATED_AT_KEY]
+
+    # Cache vazio (primeiro acesso ou despejo): começa de uma versão baseada
+    # no relógio para não reaproveitar ETags emitidas antes do despejo
+    now = int(time.time())
+    cache.add(VERSION_KEY, now * 1000, timeout=None)
+    cache.add(UPDATED_AT_KEY, now, timeout=None)
+    state = cache.get_many([VERSION_KEY, UPDATED_AT_KEY])
+    return state.get(VERSION_KEY, now * 1000), state.get(UPDATED_AT_KEY, now)
+
+
+def bump_catalog_version():
+    """Invalida o catálogo em cache"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, int(time.time()) * 1000, timeout=None)
+    cache.set(UPDATED_AT_KEY, int(time.time()), timeout=None)
+
+
+def bump_catalog_version_on_commit():
+    """Invalida o catálogo somente após o commit, para não recachear dados antigos"""
+    transaction.on_commit(bump_catalog_version)
+
+
+def _build_catalog():
+    from .models import Product
+    from .serializers import ProductSerializer
+
+    # Sempre do primário: o cache fica valendo para toda a versão e não
+    # pode ser montado a partir de uma réplica atrasada
+    products = list(Product.objects.using('default').filter(active=True).order_by('-created_at'))
+    return {
+        'products': products,
+        'list': [dict(item) for item in ProductSerializer(products, many=True).data],
+    }
+
+
+def _cached_or_build(key, build):
+    """Valor de `key`; no miss, um único processo o monta (lock) e os demais aguardam"""
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock = f'{key}:lock'
+    if cache.add(lock, 1, timeout=BUILD_LOCK_TIMEOUT):
+        try:
+            value = build()
+            cache.set(key, value, timeout=settings.CATALOG_CACHE_TIMEOUT)
+        finally:
+            cache.delete(lock)
+        return value
+
+    deadline = time.monotonic() + BUILD_WAIT_SECONDS
+    delay = 0.02
+    while time.monotonic() < deadline:
+        time.sleep(delay)
+        delay = min(delay * 2, 0.2)
+        value = cache.get(key)
+        if value is not None:
+            return value
+    # Quem detém o lock não terminou a tempo: monta sem gravar
+    return build()
+
+
+def get_catalog():
+    """Retorna o catálogo da versão atual, montando-o a partir do banco se necessário"""
+    version, _ = get_catalog_state()
+    return _cached_or_build(f'catalog:v{version}', _build_catalog)
+
+
+def get_active_products():
+    return get_catalog()['products']
+
+
+def get_catalog_product(pk):
+    """{'product': instância, 'detail': payload} de um produto ativo, ou None"""
+    from .models import Product
+    from .serializers import ProductSerializer
+
+    try:
+        pk = int(pk)
+    except (TypeError, ValueError):
+        return None
+    version, _ = get_catalog_state()
+    key = f'catalog:v{version}:product:{pk}'
+    entry = cache.get(key)
+    if entry is None:
+        product = Product.objects.using('default').filter(pk=pk, active=True).first()
+        if product is None:
+            return None
+        entry = {'product': product, 'detail': dict(ProductSerializer(product).data)}
+        cache.set(key, entry, timeout=settings.CATALOG_CACHE_TIMEOUT)
+    return entry
+
+
+def get_product_or_404(pk):
+    """Equivalente a get_object_or_404(Product, pk=pk, active=True), lido do cache"""
+    entry = get_catalog_product(pk)
+    if entry is None:
+        raise Http404('Produto não encontrado')
+    return entry['product']
+
+
+def catalog_etag():
+    """Retorna (ETag, Last-Modified) da versão atual do catálogo"""
+    version, updated_at = get_catalog_state()
+    return f'"catalog-{version}"', updated_at
+
+
+def conditional_response(request, etag, last_modified):
+    """Retorna um 304 se o cliente já tem a versão atual do catálogo, senão None"""
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def add_catalog_headers(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # O cliente pode guardar a resposta, mas deve revalidar a cada uso
+    patch_cache_control(response, public=True, max_age=0, must_revalidate=True)
+    return response
@@ -0,0 +1,213 @@
+# payments/checkout.py
+"""
+Pipeline do checkout (payments.views.checkout).
+
+1. Preparação, em paralelo: a resolução do customer roda em outra thread
+   quando precisa do Stripe, enquanto o Payment é reservado no banco. A
+   reserva fixa o id usado na return_url e nos metadados do intent.
+2. Uma única chamada ao Stripe cria o PaymentIntent, já confirmado no PIX.
+3. O id do intent é gravado na reserva.
+
+Chamadas ao Stripe por checkout: uma com o customer já mapeado; no
+primeiro checkout do usuário, mais uma para criar o customer (duas com
+STRIPE_CUSTOMER_EMAIL_LOOKUP), sobreposta à reserva. Antes o PIX fazia até
+quatro, em sequência: busca e criação do customer, criação do intent com
+uma return_url provisória e o modify para corrigi-la.
+
+Com Idempotency-Key a reserva é localizada pela chave enviada ao Stripe
+(Payment.stripe_idempotency_key): uma retomada envia exatamente os mesmos
+parâmetros e recebe o mesmo intent; com outro produto ou método a chave é
+recusada (422). Se o checkout falha, a reserva é excluída, para não virar
+um pagamento 'failed' nos totais, no histórico e nas exportações. A
+exceção é um erro de conexão com chave: o Stripe pode ter criado o intent,
+e a reserva fica pendente para a retomada com a mesma chave. Reservas sem
+intent mais antigas que a chave (IDEMPOTENCY_KEY_TTL_HOURS) não podem mais
+ser retomadas e são excluídas por prune_stale_reservations (comando
+prune_idempotency_keys).
+"""
+import contextvars
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.urls import reverse
+from django.utils import timezone
+
+from .circuit_breaker import CircuitOpenError
+from .customers import get_cached_customer_id, get_or_create_customer_id
+from .idempotency import IdempotencyError
+from .models import Payment
+from .rollups import ROLLUP_FIELDS, apply_deltas, payment_deltas
+from .stripe_client import get_client
+
+_executor_lock = threading.Lock()
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.CHECKOUT_PREPARE_THREADS, thread_name_prefix='checkout',
+                )
+    return _executor
+
+
+def _reset_executor():
+    # As threads do pool não sobrevivem ao fork
+    global _executor, _executor_lock
+    _executor_lock = threading.Lock()
+    _executor = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_executor)
+
+
+def _run_in_thread(func, *args):
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+def _submit(func, *args):
+    """
+    Executa `func` em paralelo e retorna um Future. A thread roda com uma
+    cópia do contexto da requisição, para que o tempo do Stripe entre no
+    Server-Timing. Dentro de uma transação roda na hora: outra thread usa
+    outra conexão e não veria as linhas ainda não commitadas.
+    """
+    if not connection.in_atomic_block:
+        context = contextvars.copy_context()
+        return _get_executor().submit(context.run, _run_in_thread, func, *args)
+    future = Future()
+    try:
+        future.set_result(func(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def resolve_customer(user):
+    """Future com o customer do usuário; só usa outra thread quando é preciso ir ao Stripe"""
+    customer_id = get_cached_customer_id(user)
+    if customer_id:
+        future = Future()
+        future.set_result(customer_id)
+        return future
+    return _submit(get_or_create_customer_id, user)
+
+
+def reserve_payment(user, product, payment_method, stripe_idempotency_key=None):
+    """Cria o Payment (ainda sem intent) ou reaproveita a reserva da mesma chave"""
+    defaults = {
+        'user': user,
+        'product': product,
+        'amount': product.price,
+        'payment_method_type': payment_method,
+        'status': 'pending',
+    }
+    if not stripe_idempotency_key:
+        return Payment.objects.create(**defaults)
+
+    payment, created = Payment.objects.get_or_create(stripe_idempotency_key=stripe_idempotency_key, defaults=defaults)
+    if not created and (payment.product_id, payment.payment_method_type) != (product.id, payment_method):
+        raise IdempotencyError('Idempotency-Key já usada com parâmetros diferentes', status=422)
+    return payment
+
+
+def may_have_reached_stripe(error):
+    """Erro de conexão após o envio: o Stripe pode ter criado o intent"""
+    return isinstance(error, stripe.error.APIConnectionError) and not isinstance(error, CircuitOpenError)
+
+
+def intent_params(payment, customer_id, return_url):
+    """Parâmetros do PaymentIntent de cada método de pagamento"""
+    method = payment.payment_method_type
+    params = {
+        'amount': int(payment.amount * 100),  # Em centavos
+        'currency': 'brl',
+        'payment_method_types': [method],
+        'customer': customer_id,
+        # Confirmação pelo frontend (cartão e boleto) ou já na criação (PIX)
+        'confirmation_method': 'automatic',
+        'metadata': {
+            'payment_id': str(payment.id),
+            'product_id': str(payment.product_id),
+            'user_id': str(payment.user_id),
+            'django_payment_method': method,
+        },
+    }
+    if method == 'pix':
+        params.update({
+            'payment_method_options': {
+                'pix': {
+                    'expires_after_seconds': 86400  # 24 horas para expirar
+                }
+            },
+            # Cria e confirma na mesma chamada; o QR code vem em next_action
+            'payment_method_data': {'type': 'pix'},
+            'confirm': True,
+            'return_url': return_url,
+        })
+    elif method == 'boleto':
+        params['payment_method_options'] = {
+            'boleto': {
+                'expires_after_days': 3
+            }
+        }
+        params['metadata']['user_email'] = payment.user.email
+    return params
+
+
+def create_checkout(user, product, payment_method, build_absolute_uri, stripe_idempotency_key=None):
+    """
+    Reserva o pagamento e cria o PaymentIntent; retorna (payment, intent).
+    `build_absolute_uri` monta a return_url (request.build_absolute_uri).
+    """
+    customer = resolve_customer(user)
+    payment = reserve_payment(user, product, payment_method, stripe_idempotency_key)
+    return_url = build_absolute_uri(reverse('payments:payment_success', kwargs={'payment_id': payment.id}))
+
+    try:
+        customer_id = customer.result()
+        intent = get_client().PaymentIntent.create(
+            **intent_params(payment, customer_id, return_url), idempotency_key=stripe_idempotency_key,
+        )
+    except Exception as e:
+        if not (stripe_idempotency_key and may_have_reached_stripe(e)):
+            payment.delete()
+        raise
+
+    Payment.objects.filter(pk=payment.pk).update(stripe_payment_intent_id=intent.id, stripe_customer_id=customer_id)
+    payment.stripe_payment_intent_id = intent.id
+    payment.stripe_customer_id = customer_id
+    return payment, intent
+
+
+def prune_stale_reservations():
+    """
+    Exclui as reservas pendentes sem intent mais antigas que
+    IDEMPOTENCY_KEY_TTL_HOURS (a chave já expirou, nenhuma retomada as
+    encontra) e as tira dos totais diários. Retorna quantas foram excluídas.
+    """
+    threshold = timezone.now() - timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS)
+    stale = Payment.objects.filter(
+        Q(stripe_payment_intent_id__isnull=True) | Q(stripe_payment_intent_id=''),
+        status='pending', created_at__lt=threshold,
+    )
+    with transaction.atomic():
+        payments = list(stale.select_for_update().values('id', *ROLLUP_FIELDS))
+        if payments:
+            # Em massa, sem Payment.delete: os totais saem em um único delta
+            Payment.objects.filter(id__in=[payment['id'] for payment in payments]).delete()
+            apply_deltas(payment_deltas((payment, None) for payment in payments))
+    return len(payments)
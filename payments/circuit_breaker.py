@@ -0,0 +1,147 @@
+# payments/circuit_breaker.py
+"""
+Circuit breaker por operação do Stripe (PaymentIntent.create,
+PaymentIntent.retrieve, ...), aplicado em StripeClient.call.
+
+- fechado: as chamadas passam; `failures` falhas seguidas abrem o circuito.
+  Contam como falha erros de conexão/timeout, respostas 5xx e chamadas mais
+  lentas que `slow_call_seconds`; erros de negócio (cartão recusado, 4xx,
+  429) mostram que o Stripe está respondendo e contam como sucesso.
+- aberto: as chamadas falham na hora com CircuitOpenError (um StripeError,
+  tratado pelos mesmos `except` de antes) por `reset_timeout` segundos, sem
+  prender o worker até o timeout HTTP.
+- meio aberto: uma única chamada de teste passa; sucesso fecha o circuito,
+  falha o reabre.
+
+O estado é do processo (cada worker aprende sozinho) e é recriado junto com
+o cliente após um fork. Limites em STRIPE_CIRCUIT_BREAKER ('default' mais
+ajustes por operação).
+"""
+import logging
+import math
+import threading
+import time
+
+import stripe
+from django.http import JsonResponse
+
+from stripe_sandbox.metrics import STRIPE_CIRCUIT_EVENTS
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class CircuitOpenError(stripe.error.APIConnectionError):
+    """Chamada recusada sem ir ao Stripe porque o circuito da operação está aberto"""
+
+    def __init__(self, operation, retry_after):
+        super().__init__(f'Stripe indisponível para {operation}; nova tentativa em {math.ceil(retry_after)}s')
+        self.operation = operation
+        self.retry_after = retry_after
+
+
+def is_failure(error):
+    """Erros que indicam o Stripe fora do ar ou degradado (não erros de negócio)"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, stripe.error.APIConnectionError):
+        return True
+    if isinstance(error, stripe.error.APIError):
+        return error.http_status is None or error.http_status >= 500
+    return False
+
+
+class CircuitBreaker:
+    def __init__(self, operation, failures=5, reset_timeout=30, slow_call_seconds=None):
+        self.operation = operation
+        self.failure_threshold = failures
+        self.reset_timeout = reset_timeout
+        self.slow_call_seconds = slow_call_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        self.state = state
+        STRIPE_CIRCUIT_EVENTS.labels(self.operation, state).inc()
+
+    def before_call(self):
+        """Libera a chamada ou levanta CircuitOpenError"""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == OPEN and remaining <= 0:
+                self._transition(HALF_OPEN)
+                logger.info("Circuito %s meio aberto: testando o Stripe", self.operation)
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+        STRIPE_CIRCUIT_EVENTS.labels(self.operation, 'rejected').inc()
+        raise CircuitOpenError(self.operation, max(remaining, 1))
+
+    def record(self, error=None, duration=0.0):
+        """Registra o resultado de uma chamada liberada por before_call"""
+        slow = self.slow_call_seconds is not None and duration > self.slow_call_seconds
+        failed = slow or (error is not None and is_failure(error))
+        with self._lock:
+            probe, self._probing = self._probing, False
+            if not failed:
+                self.failures = 0
+                if self.state != CLOSED:
+                    self._transition(CLOSED)
+                    logger.info("Circuito %s fechado: Stripe respondendo", self.operation)
+                return
+            self.failures += 1
+            if probe or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                if self.state != OPEN:
+                    self._transition(OPEN)
+                    logger.warning(
+                        "Circuito %s aberto por %ss após %s falha(s): %s", self.operation, self.reset_timeout,
+                        self.failures, 'chamada lenta' if slow else error,
+                    )
+
+    def snapshot(self):
+        with self._lock:
+            data = {'state': self.state, 'failures': self.failures}
+            if self.state != CLOSED:
+                data['retry_in'] = round(max(self.opened_at + self.reset_timeout - time.monotonic(), 0), 1)
+            return data
+
+
+class CircuitBreakerRegistry:
+    """Um CircuitBreaker por operação, criado no primeiro uso"""
+
+    def __init__(self, config):
+        self.config = config
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, operation):
+        breaker = self._breakers.get(operation)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(operation)
+                if breaker is None:
+                    options = {**self.config.get('default', {}), **self.config.get(operation, {})}
+                    breaker = self._breakers[operation] = CircuitBreaker(operation, **options)
+        return breaker
+
+    def snapshot(self):
+        """Estado dos circuitos já usados neste processo, por operação"""
+        return {operation: breaker.snapshot() for operation, breaker in sorted(self._breakers.items())}
+
+
+def circuit_open_response(error):
+    """Resposta 503 com Retry-After para views que não usam o DRF"""
+    retry_after = math.ceil(error.retry_after)
+    response = JsonResponse({
+        'error': 'Pagamentos temporariamente indisponíveis. Tente novamente em instantes.',
+        'retry_after': retry_after,
+    }, status=503)
+    response['Retry-After'] = str(retry_after)
+    return response
@@ -0,0 +1,70 @@
+# payments/customers.py
+import logging
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import StripeCustomer
+from .stripe_client import get_client
+from .throttling import check_rate
+
+logger = logging.getLogger(__name__)
+
+
+def get_cached_customer_id(user):
+    """Retorna o customer já mapeado localmente, sem chamar o Stripe"""
+    return (
+        StripeCustomer.objects
+        .filter(user=user)
+        .exclude(stripe_customer_id='')
+        .values_list('stripe_customer_id', flat=True)
+        .first()
+    )
+
+
+def get_or_create_customer_id(user):
+    """
+    Retorna o ID do customer do Stripe para o usuário.
+
+    Checkouts repetidos usam apenas o mapeamento local. Na primeira vez, o
+    registro do usuário é travado (select_for_update) para que checkouts
+    simultâneos não criem customers duplicados. A ida ao Stripe consome o
+    limite global 'customer' (levanta RateLimited quando esgotado).
+    """
+    customer_id = get_cached_customer_id(user)
+    if customer_id:
+        return customer_id
+
+    check_rate('customer')
+
+    with transaction.atomic():
+        mapping, _ = StripeCustomer.objects.get_or_create(user=user)
+        mapping = StripeCustomer.objects.select_for_update().get(pk=mapping.pk)
+        if mapping.stripe_customer_id:
+            return mapping.stripe_customer_id
+
+        mapping.stripe_customer_id = _find_or_create_remote_customer(user)
+        mapping.save(update_fields=['stripe_customer_id', 'updated_at'])
+
+    return mapping.stripe_customer_id
+
+
+def _find_or_create_remote_customer(user):
+    """
+    Cria o customer. Com STRIPE_CUSTOMER_EMAIL_LOOKUP, antes procura um
+    customer legado pelo email (criado antes do mapeamento local e ainda não
+    importado por `python manage.py sync_stripe_customers`).
+    """
+    if settings.STRIPE_CUSTOMER_EMAIL_LOOKUP and user.email:
+        customers = get_client().Customer.list(email=user.email, limit=1)
+        if customers.data:
+            return customers.data[0].id
+
+    customer = get_client().Customer.create(
+        email=user.email,
+        name=user.get_full_name() or user.username,
+        metadata={'django_user_id': user.id},
+        idempotency_key=f'customer-create-{user.pk}',
+    )
+    logger.info(f"Customer criado: {customer.id}")
+    return customer.id
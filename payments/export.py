@@ -0,0 +1,122 @@
+# payments/export.py
+"""
+Exportação de pagamentos em CSV ou NDJSON, em streaming.
+
+As linhas são lidas com `.iterator(chunk_size=...)` (cursor no servidor
+no PostgreSQL) direto em tuplas, com usuário e produto no mesmo JOIN, e
+escritas em blocos; com gzip, cada bloco passa por um compressor
+incremental. A memória usada não depende do número de pagamentos.
+Usado pelo endpoint /api/v1/payments/export/ e pelo comando
+export_payments.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime, time
+
+from django.utils import timezone
+
+from .models import Payment
+
+EXPORT_FIELDS = (
+    ('id', 'id'),
+    ('created_at', 'created_at'),
+    ('paid_at', 'paid_at'),
+    ('status', 'status'),
+    ('payment_method', 'payment_method_type'),
+    ('amount', 'amount'),
+    ('currency', 'currency'),
+    ('stripe_fee', 'stripe_fee'),
+    ('net_amount', 'net_amount'),
+    ('stripe_payment_intent_id', 'stripe_payment_intent_id'),
+    ('stripe_charge_id', 'stripe_charge_id'),
+    ('user_id', 'user_id'),
+    ('username', 'user__username'),
+    ('email', 'user__email'),
+    ('product_id', 'product_id'),
+    ('product', 'product__name'),
+)
+HEADER = [name for name, _ in EXPORT_FIELDS]
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def parse_day(value):
+    """YYYY-MM-DD -> início do dia no fuso do projeto (ValueError se inválida)"""
+    return timezone.make_aware(datetime.combine(datetime.strptime(value, '%Y-%m-%d').date(), time.min))
+
+
+def export_queryset(since=None, until=None, statuses=None, methods=None):
+    """Pagamentos com created_at em [since, until), filtrados por status e método"""
+    queryset = Payment.objects.all()
+    if since:
+        queryset = queryset.filter(created_at__gte=since)
+    if until:
+        queryset = queryset.filter(created_at__lt=until)
+    if statuses:
+        queryset = queryset.filter(status__in=statuses)
+    if methods:
+        queryset = queryset.filter(payment_method_type__in=methods)
+    return queryset.order_by('created_at', 'id')
+
+
+def _value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if value is None:
+        return None
+    return value if isinstance(value, (int, str)) else str(value)
+
+
+def _rows(queryset, chunk_size):
+    lookups = [lookup for _, lookup in EXPORT_FIELDS]
+    for row in queryset.values_list(*lookups).iterator(chunk_size=chunk_size):
+        yield [_value(value) for value in row]
+
+
+def iter_csv(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(HEADER)
+    for count, row in enumerate(_rows(queryset, chunk_size), 1):
+        writer.writerow(['' if value is None else value for value in row])
+        if count % chunk_size == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def iter_ndjson(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    lines = []
+    for row in _rows(queryset, chunk_size):
+        lines.append(json.dumps(dict(zip(HEADER, row)), ensure_ascii=False))
+        if len(lines) >= chunk_size:
+            yield ('\n'.join(lines) + '\n').encode()
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode()
+
+
+def gzip_stream(chunks):
+    """Comprime um iterável de bytes em gzip, bloco a bloco"""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_stream(queryset, fmt='csv', gzip=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Iterável de bytes com os pagamentos no formato pedido"""
+    chunks = iter_csv(queryset, chunk_size) if fmt == 'csv' else iter_ndjson(queryset, chunk_size)
+    return gzip_stream(chunks) if gzip else chunks
+
+
+def export_filename(fmt, gzip=False):
+    return f"payments-{datetime.now():%Y%m%d-%H%M%S}.{fmt}{'.gz' if gzip else ''}"
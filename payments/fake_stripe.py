@@ -0,0 +1,315 @@
+# payments/fake_stripe.py
+"""
+Servidor HTTP local que imita o subconjunto da API do Stripe usado por
+este projeto, para testes de carga e integração sem rede.
+
+Aponte o cliente compartilhado para ele com STRIPE_API_BASE:
+
+    server = FakeStripeServer(latency_ms=80, error_rate=0.01).start()
+    # STRIPE_API_BASE = server.url
+    ...
+    server.stop()
+
+Latência, taxa de erros 500 e taxa de respostas 429 são configuráveis;
+com o mesmo `seed` a sequência de falhas é reproduzível.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+def parse_form(body):
+    """Converte o form-encoding do Stripe (a[b][0]=x) em dicts/listas aninhados"""
+    result = {}
+    for key, value in parse_qsl(body, keep_blank_values=True):
+        parts = re.findall(r'[^\[\]]+', key)
+        node = result
+        for part, next_part in zip(parts, parts[1:]):
+            node = node.setdefault(part, [] if next_part.isdigit() else {})
+            if isinstance(node, list):
+                index = int(next_part)
+                while len(node) <= index:
+                    node.append({})
+        last = parts[-1]
+        if isinstance(node, list):
+            node[int(last)] = value
+        else:
+            node[last] = value
+    return result
+
+
+def is_true(value):
+    return str(value).lower() == 'true'
+
+
+class FakeStripeState:
+    """Objetos criados durante a execução, indexados por ID"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.objects = {}
+        self.idempotent_responses = {}
+        self.request_counts = {}
+
+    def new_id(self, prefix):
+        return f'{prefix}_{uuid.uuid4().hex[:24]}'
+
+    def add(self, obj):
+        with self.lock:
+            self.objects[obj['id']] = obj
+        return obj
+
+    def get(self, object_id):
+        return self.objects.get(object_id)
+
+    def of_type(self, object_type):
+        return [obj for obj in list(self.objects.values()) if obj['object'] == object_type]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    # Roteamento -----------------------------------------------------------
+
+    ROUTES = [
+        ('GET', r'^/v1/customers$', 'list_customers'),
+        ('POST', r'^/v1/customers$', 'create_customer'),
+        ('POST', r'^/v1/payment_intents$', 'create_payment_intent'),
+        ('GET', r'^/v1/payment_intents/(?P<id>[^/]+)$', 'retrieve'),
+        ('POST', r'^/v1/payment_intents/(?P<id>[^/]+)$', 'modify_payment_intent'),
+        ('POST', r'^/v1/products$', 'create_product'),
+        ('POST', r'^/v1/prices$', 'create_price'),
+        ('POST', r'^/v1/prices/(?P<id>[^/]+)$', 'modify'),
+        ('GET', r'^/v1/balance_transactions$', 'list_balance_transactions'),
+        ('GET', r'^/v1/balance_transactions/(?P<id>[^/]+)$', 'retrieve'),
+    ]
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method):
+        server = self.server
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode() if length else ''
+        params = parse_form(url.query if method == 'GET' else body)
+
+        for route_method, pattern, action in self.ROUTES:
+            match = re.match(pattern, url.path)
+            if route_method == method and match:
+                break
+        else:
+            return self._error(404, 'invalid_request_error', f'Unrecognized request URL ({method}: {url.path})')
+
+        with server.state.lock:
+            server.state.request_counts[action] = server.state.request_counts.get(action, 0) + 1
+
+        server.simulate_latency()
+        failure = server.roll_failure()
+        if failure == 429:
+            return self._error(429, 'invalid_request_error', 'Too many requests', code='rate_limit',
+                               headers={'Retry-After': '1', 'Stripe-Should-Retry': 'true'})
+        if failure == 500:
+            return self._error(500, 'api_error', 'Simulated internal error')
+
+        idempotency_key = self.headers.get('Idempotency-Key')
+        if method == 'POST' and idempotency_key:
+            cached = server.state.idempotent_responses.get(idempotency_key)
+            if cached is not None:
+                return self._send(200, cached, headers={'Idempotent-Replayed': 'true'})
+
+        status, payload = getattr(self, action)(params, **match.groupdict())
+        if method == 'POST' and idempotency_key and status == 200:
+            server.state.idempotent_responses[idempotency_key] = payload
+        self._send(status, payload)
+
+    # Respostas ------------------------------------------------------------
+
+    def _send(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Request-Id', f'req_{uuid.uuid4().hex[:14]}')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, error_type, message, code=None, headers=None):
+        error = {'type': error_type, 'message': message}
+        if code:
+            error['code'] = code
+        self._send(status, {'error': error}, headers=headers)
+
+    def _list(self, url, data, limit):
+        limit = int(limit or 10)
+        return 200, {'object': 'list', 'url': url, 'has_more': len(data) > limit, 'data': data[:limit]}
+
+    def _not_found(self, object_id):
+        return 404, {'error': {'type': 'invalid_request_error', 'code': 'resource_missing',
+                               'message': f"No such object: '{object_id}'"}}
+
+    # Recursos -------------------------------------------------------------
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def retrieve(self, params, id):
+        obj = self.state.get(id)
+        return (200, obj) if obj else self._not_found(id)
+
+    def modify(self, params, id):
+        obj = self.state.get(id)
+        if not obj:
+            return self._not_found(id)
+        with self.state.lock:
+            obj.update({key: value for key, value in params.items() if key != 'expand'})
+            if 'active' in params:
+                obj['active'] = is_true(params['active'])
+        return 200, obj
+
+    def list_customers(self, params):
+        customers = self.state.of_type('customer')
+        if params.get('email'):
+            customers = [c for c in customers if c.get('email') == params['email']]
+        return self._list('/v1/customers', customers, params.get('limit'))
+
+    def create_customer(self, params):
+        return 200, self.state.add({
+            'id': self.state.new_id('cus'),
+            'object': 'customer',
+            'email': params.get('email'),
+            'name': params.get('name'),
+            'metadata': params.get('metadata', {}),
+            'created': int(time.time()),
+        })
+
+    def create_payment_intent(self, params):
+        intent_id = self.state.new_id('pi')
+        methods = params.get('payment_method_types') or ['card']
+        confirm = is_true(params.get('confirm'))
+        intent = {
+            'id': intent_id,
+            'object': 'payment_intent',
+            'amount': int(params.get('amount', 0)),
+            'currency': params.get('currency', 'brl'),
+            'customer': params.get('customer'),
+            'payment_method_types': methods,
+            'confirmation_method': params.get('confirmation_method', 'automatic'),
+            'client_secret': f'{intent_id}_secret_{uuid.uuid4().hex[:16]}',
+            'status': 'requires_payment_method',
+            'next_action': None,
+            'latest_charge': None,
+            'metadata': params.get('metadata', {}),
+            'created': int(time.time()),
+        }
+        if params.get('return_url'):
+            intent['return_url'] = params['return_url']
+        if confirm and 'pix' in methods:
+            intent['status'] = 'requires_action'
+            intent['next_action'] = {
+                'type': 'pix_display_qr_code',
+                'pix_display_qr_code': {'data': f'00020126fake{intent_id}', 'expires_at': int(time.time()) + 86400},
+            }
+        return 200, self.state.add(intent)
+
+    def modify_payment_intent(self, params, id):
+        return self.modify(params, id)
+
+    def create_product(self, params):
+        return 200, self.state.add({
+            'id': self.state.new_id('prod'),
+            'object': 'product',
+            'name': params.get('name'),
+            'description': params.get('description'),
+            'metadata': params.get('metadata', {}),
+            'active': True,
+        })
+
+    def create_price(self, params):
+        return 200, self.state.add({
+            'id': self.state.new_id('price'),
+            'object': 'price',
+            'product': params.get('product'),
+            'unit_amount': int(params.get('unit_amount', 0)),
+            'currency': params.get('currency', 'brl'),
+            'active': True,
+        })
+
+    def list_balance_transactions(self, params):
+        return self._list('/v1/balance_transactions', self.state.of_type('balance_transaction'), params.get('limit'))
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0, jitter_ms=0,
+                 error_rate=0.0, rate_limit_rate=0.0, seed=None):
+        super().__init__((host, port), _Handler)
+        self.state = FakeStripeState()
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def simulate_latency(self):
+        if not self.latency_ms and not self.jitter_ms:
+            return
+        with self._random_lock:
+            jitter = self._random.uniform(0, self.jitter_ms)
+        time.sleep((self.latency_ms + jitter) / 1000)
+
+    def roll_failure(self):
+        """Sorteia 429, 500 ou None conforme as taxas configuradas"""
+        with self._random_lock:
+            roll = self._random.random()
+        if roll < self.rate_limit_rate:
+            return 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500
+        return None
+
+    def add_balance_transaction(self, charge_id, payment_intent_id, amount, fee):
+        """Registra uma balance transaction para cenários de reconciliação"""
+        return self.state.add({
+            'id': self.state.new_id('txn'),
+            'object': 'balance_transaction',
+            'type': 'charge',
+            'amount': amount,
+            'fee': fee,
+            'net': amount - fee,
+            'source': {'id': charge_id, 'object': 'charge', 'payment_intent': payment_intent_id},
+            'created': int(time.time()),
+        })
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-stripe', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
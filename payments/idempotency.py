@@ -0,0 +1,162 @@
+# payments/idempotency.py
+"""
+Contrato de Idempotency-Key para a criação de pagamentos.
+
+O cliente envia um header `Idempotency-Key` único por tentativa lógica
+de pagamento. A primeira requisição com a chave executa a criação e
+grava a resposta; repetições com a mesma chave (duplo clique, retry do
+app, replay do proxy) recebem a resposta gravada sem chamar o Stripe.
+Uma repetição que chega enquanto a primeira ainda está em andamento
+aguarda o resultado dela.
+
+A mesma chave é repassada ao Stripe (derivada do usuário e do escopo),
+de modo que uma retomada após falha não cria um segundo PaymentIntent.
+Apenas respostas 2xx são gravadas; após um erro a chave é liberada para
+que o cliente possa tentar novamente.
+"""
+import hashlib
+import json
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyError(Exception):
+    """Requisição que não pode ser atendida com a chave informada"""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def request_fingerprint(data):
+    """Hash canônico do corpo da requisição (ordem das chaves não importa)"""
+    payload = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def stripe_idempotency_key(user, scope, key):
+    digest = hashlib.sha256(f'{user.pk}:{scope}:{key}'.encode()).hexdigest()[:40]
+    return f'{scope}-{digest}'
+
+
+def _expired(record):
+    return record.created_at < timezone.now() - timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS)
+
+
+def _acquire(user, scope, key, fingerprint):
+    """
+    Registra a chave como em andamento. Retorna (registro, dono): dono=False
+    quando outra requisição já registrou a chave.
+    """
+    try:
+        with transaction.atomic():
+            record = IdempotencyKey.objects.create(
+                user=user, scope=scope, key=key, request_hash=fingerprint, locked_at=timezone.now()
+            )
+        return record, True
+    except IntegrityError:
+        record = IdempotencyKey.objects.filter(user=user, scope=scope, key=key).first()
+        if record is None:
+            # Liberada entre o INSERT e a leitura: tenta de novo
+            return _acquire(user, scope, key, fingerprint)
+        if _expired(record):
+            IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).delete()
+            return _acquire(user, scope, key, fingerprint)
+        return record, False
+
+
+def _take_over_if_stale(record):
+    """Assume uma chave cuja requisição original morreu sem concluir"""
+    threshold = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT_SECONDS)
+    if record.status != 'processing' or record.locked_at >= threshold:
+        return False
+    now = timezone.now()
+    taken = IdempotencyKey.objects.filter(
+        pk=record.pk, status='processing', locked_at=record.locked_at
+    ).update(locked_at=now)
+    if taken:
+        record.locked_at = now
+        logger.warning(f"Chave de idempotência {record.key} retomada após timeout")
+    return bool(taken)
+
+
+def _wait_for_completion(record):
+    """
+    Aguarda a requisição em andamento concluir. Retorna (registro, assumiu);
+    registro None indica que a original falhou e liberou a chave.
+    """
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+    delay = 0.05
+    while time.monotonic() < deadline:
+        time.sleep(delay)
+        delay = min(delay * 2, 0.5)
+        record = IdempotencyKey.objects.filter(pk=record.pk).first()
+        if record is None or record.status == 'completed':
+            return record, False
+        if _take_over_if_stale(record):
+            return record, True
+    raise IdempotencyError('Requisição com esta Idempotency-Key ainda em andamento', status=409)
+
+
+def run_idempotent(user, scope, key, data, func):
+    """
+    Executa `func(stripe_key)` no máximo uma vez por (usuário, escopo, chave).
+
+    `func` retorna (status, payload). Sem chave, apenas executa a função.
+    Retorna (status, payload, replayed). Levanta IdempotencyError quando a
+    chave é reutilizada com outro corpo ou a requisição original não
+    termina dentro de IDEMPOTENCY_WAIT_TIMEOUT.
+    """
+    if not key:
+        status, payload = func(None)
+        return status, payload, False
+    if len(key) > MAX_KEY_LENGTH:
+        raise IdempotencyError(f'Idempotency-Key deve ter no máximo {MAX_KEY_LENGTH} caracteres', status=400)
+
+    fingerprint = request_fingerprint(data)
+    record, owner = _acquire(user, scope, key, fingerprint)
+
+    if not owner:
+        if record.request_hash != fingerprint:
+            raise IdempotencyError('Idempotency-Key já usada com parâmetros diferentes', status=422)
+        if record.status == 'processing':
+            owner = _take_over_if_stale(record)
+            if not owner:
+                logger.info(f"Aguardando requisição em andamento com a chave {key}")
+                record, owner = _wait_for_completion(record)
+                if record is None:
+                    return run_idempotent(user, scope, key, data, func)
+        if not owner:
+            return record.response_status, record.response_body, True
+
+    try:
+        status, payload = func(stripe_idempotency_key(user, scope, key))
+    except Exception:
+        IdempotencyKey.objects.filter(pk=record.pk).delete()
+        raise
+
+    if 200 <= status < 300:
+        IdempotencyKey.objects.filter(pk=record.pk).update(
+            status='completed', response_status=status, response_body=payload, completed_at=timezone.now()
+        )
+    else:
+        IdempotencyKey.objects.filter(pk=record.pk).delete()
+    return status, payload, False
+
+
+def prune_expired_keys():
+    """Remove chaves mais antigas que IDEMPOTENCY_KEY_TTL_HOURS"""
+    threshold = timezone.now() - timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS)
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=threshold).delete()
+    return deleted
@@ -0,0 +1,125 @@
+# payments/intents.py
+"""
+Cache de leitura dos PaymentIntents exibidos nas páginas de pagamento.
+
+As páginas usam o status local do Payment e só consultam o Stripe quando
+o pagamento ainda não está em um status final e não é atualizado há mais
+de PAYMENT_STATUS_REFRESH_AFTER segundos. As consultas passam por um
+cache de TTL curto, invalidado pelos webhooks, e requisições simultâneas
+para o mesmo intent compartilham uma única chamada ao Stripe.
+"""
+import logging
+import threading
+import time
+import weakref
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .stripe_client import get_client
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ('succeeded', 'canceled')
+
+_locks_guard = threading.Lock()
+_locks = weakref.WeakValueDictionary()
+
+
+def intent_cache_key(intent_id):
+    return f'payment_intent:{intent_id}'
+
+
+def _local_lock(intent_id):
+    with _locks_guard:
+        lock = _locks.get(intent_id)
+        if lock is None:
+            lock = _locks[intent_id] = threading.Lock()
+        return lock
+
+
+def _wait_for_other_process(key, timeout):
+    """Aguarda o processo que está buscando o mesmo intent preencher o cache"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        data = cache.get(key)
+        if data is not None:
+            return data
+    return None
+
+
+def get_payment_intent(intent_id):
+    """Read-through: retorna o intent do cache ou busca uma única vez no Stripe"""
+    key = intent_cache_key(intent_id)
+    data = cache.get(key)
+    if data is not None:
+        return data
+
+    # Coalescing entre threads do processo...
+    with _local_lock(intent_id):
+        data = cache.get(key)
+        if data is not None:
+            return data
+
+        # ...e entre processos, via lock no cache compartilhado
+        lock_key = f'{key}:lock'
+        lock_timeout = settings.STRIPE_READ_TIMEOUT
+        owns_lock = cache.add(lock_key, 1, timeout=lock_timeout)
+        if not owns_lock:
+            data = _wait_for_other_process(key, timeout=min(lock_timeout, 5))
+            if data is not None:
+                return data
+
+        try:
+            data = get_client().PaymentIntent.retrieve(intent_id).to_dict_recursive()
+            cache.set(key, data, timeout=settings.PAYMENT_INTENT_CACHE_TTL)
+        finally:
+            if owns_lock:
+                cache.delete(lock_key)
+    return data
+
+
+def invalidate_payment_intents(intent_ids):
+    """Remove intents do cache após o commit da alteração local"""
+    keys = [intent_cache_key(intent_id) for intent_id in intent_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def needs_refresh(payment):
+    """Só vale a pena consultar o Stripe para pagamentos não finais e desatualizados"""
+    if not payment.stripe_payment_intent_id or payment.status in TERMINAL_STATUSES:
+        return False
+    threshold = timedelta(seconds=settings.PAYMENT_STATUS_REFRESH_AFTER)
+    return payment.updated_at < timezone.now() - threshold
+
+
+def sync_local_status(payment, status):
+    """Aplica ao Payment o status visto no Stripe, respeitando as transições permitidas"""
+    from .webhooks import ALLOWED_TRANSITIONS, transition_payments
+
+    if status == payment.status or status not in ALLOWED_TRANSITIONS:
+        return
+    extra_fields = {'paid_at': timezone.now()} if status == 'succeeded' else {}
+    if transition_payments([payment.stripe_payment_intent_id], status, **extra_fields):
+        payment.refresh_from_db(fields=['status', 'paid_at', 'updated_at'])
+        logger.info(f"Status do pagamento {payment.id} atualizado para {status}")
+
+
+def get_stripe_data(payment):
+    """
+    Dados do PaymentIntent para exibição, seguindo a política de frescor.
+    Quando o status local é suficiente, usa apenas o que já estiver em cache.
+    """
+    if not payment.stripe_payment_intent_id:
+        return None  # Reserva de checkout sem intent (ver payments/checkout.py)
+    if not needs_refresh(payment):
+        return cache.get(intent_cache_key(payment.stripe_payment_intent_id))
+
+    intent = get_payment_intent(payment.stripe_payment_intent_id)
+    sync_local_status(payment, intent['status'])
+    return intent
@@ -0,0 +1,34 @@
+# payments/management/commands/archive_webhook_events.py
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.webhook_archive import archive_events
+
+
+class Command(BaseCommand):
+    help = 'Move eventos de webhook processados antigos para arquivos NDJSON comprimidos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.STRIPE_WEBHOOK_RETENTION_DAYS,
+                            help='Arquiva eventos processados há mais de N dias')
+        parser.add_argument('--output-dir', default=settings.STRIPE_WEBHOOK_ARCHIVE_DIR,
+                            help='Diretório dos segmentos .ndjson.gz')
+        parser.add_argument('--segment-size', type=int, default=10000, help='Eventos por segmento')
+        parser.add_argument('--dry-run', action='store_true', help='Apenas conta os eventos elegíveis')
+
+    def handle(self, *args, **options):
+        if options['days'] < 0 or options['segment_size'] < 1:
+            raise CommandError('--days deve ser >= 0 e --segment-size >= 1')
+
+        archived, segments = archive_events(
+            options['days'], options['output_dir'],
+            segment_size=options['segment_size'],
+            dry_run=options['dry_run'],
+            on_segment=lambda path, count: self.stdout.write(f'  {count} eventos -> {path}'),
+        )
+        if options['dry_run']:
+            self.stdout.write(f'{archived} eventos seriam arquivados (mais de {options["days"]} dias).')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'{archived} eventos arquivados em {segments} segmento(s) em {options["output_dir"]}.'
+        ))
@@ -0,0 +1,89 @@
+# payments/management/commands/bench_stripe.py
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from payments.benchmark import run_benchmark
+from payments.fake_stripe import FakeStripeServer
+from payments.stripe_client import reset_client
+
+SCENARIOS = ('checkout', 'create_payment_intent', 'success')
+
+
+class Command(BaseCommand):
+    help = 'Mede throughput e latência (p50/p95/p99) dos fluxos de pagamento contra o Stripe fake'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Requisições por thread em cada cenário')
+        parser.add_argument('--concurrency', type=int, default=4, help='Threads simultâneas (um usuário por thread)')
+        parser.add_argument('--payment-method', default='card', choices=('card', 'pix', 'boleto'))
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                            help='Cenário a executar (pode repetir); padrão: todos')
+        parser.add_argument('--stripe-url', help='Usa um fake_stripe já em execução em vez de subir um local')
+        parser.add_argument('--latency-ms', type=float, default=50)
+        parser.add_argument('--jitter-ms', type=float, default=20)
+        parser.add_argument('--error-rate', type=float, default=0.0)
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--rate-limits', action='store_true',
+                            help='Mantém os limites de STRIPE_RATE_LIMITS (por padrão desligados no benchmark)')
+        parser.add_argument('--json', action='store_true', help='Imprime o resultado em JSON')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('--concurrency e --requests devem ser positivos')
+
+        server = None
+        api_base = options['stripe_url']
+        if not api_base:
+            server = FakeStripeServer(
+                latency_ms=options['latency_ms'],
+                jitter_ms=options['jitter_ms'],
+                error_rate=options['error_rate'],
+                rate_limit_rate=options['rate_limit_rate'],
+                seed=options['seed'],
+            ).start()
+            api_base = server.url
+        self.stdout.write(f'Stripe fake em {api_base}')
+
+        # Nunca apontar o benchmark para o Stripe real
+        overrides = {
+            'STRIPE_API_BASE': api_base,
+            'STRIPE_SECRET_KEY': 'sk_test_bench',
+            'ALLOWED_HOSTS': list(settings.ALLOWED_HOSTS) + ['localhost'],
+        }
+        if not options['rate_limits']:
+            overrides['STRIPE_RATE_LIMITS'] = {}
+        try:
+            with override_settings(**overrides):
+                reset_client()
+                results = run_benchmark(
+                    requests_per_worker=options['requests'],
+                    concurrency=options['concurrency'],
+                    payment_method=options['payment_method'],
+                    scenarios=options['scenario'],
+                )
+        finally:
+            reset_client()
+            if server:
+                server.stop()
+
+        summaries = [result.summary() for result in results]
+        if any(summary['status_codes'].get(500) for summary in summaries):
+            self.stdout.write(self.style.WARNING(
+                'Respostas 500: verifique os logs (a página de sucesso depende dos templates em templates/).'
+            ))
+        if options['json']:
+            self.stdout.write(json.dumps(summaries, indent=2))
+            return
+
+        self.stdout.write(f"{'cenário':<24}{'req':>7}{'erros':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        for summary in summaries:
+            self.stdout.write(
+                f"{summary['scenario']:<24}{summary['requests']:>7}{summary['errors']:>7}"
+                f"{summary['throughput']:>9}{summary['p50_ms']:>9}{summary['p95_ms']:>9}{summary['p99_ms']:>9}"
+            )
+            if summary['errors']:
+                self.stdout.write(self.style.WARNING(f"  status: {summary['status_codes']}"))
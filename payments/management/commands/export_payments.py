@@ -0,0 +1,41 @@
+# payments/management/commands/export_payments.py
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.export import DEFAULT_CHUNK_SIZE, FORMATS, export_queryset, export_stream, parse_day
+
+
+class Command(BaseCommand):
+    help = 'Exporta pagamentos em CSV ou NDJSON (streaming, memória constante)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Início (YYYY-MM-DD)')
+        parser.add_argument('--until', help='Fim, exclusivo (YYYY-MM-DD)')
+        parser.add_argument('--status', action='append', help='Status (repetível)')
+        parser.add_argument('--method', action='append', help='Método de pagamento (repetível)')
+        parser.add_argument('--format', dest='fmt', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--gzip', action='store_true', help='Comprime a saída em gzip')
+        parser.add_argument('--output', '-o', help='Arquivo de saída; padrão: stdout')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Linhas lidas por bloco')
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_day(options['since']) if options['since'] else None
+            until = parse_day(options['until']) if options['until'] else None
+        except ValueError:
+            raise CommandError('Datas no formato YYYY-MM-DD')
+
+        queryset = export_queryset(since, until, statuses=options['status'], methods=options['method'])
+        chunks = export_stream(queryset, options['fmt'], gzip=options['gzip'], chunk_size=options['chunk_size'])
+
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+            self.stderr.write(self.style.SUCCESS(f'Exportação gravada em {options["output"]}.'))
+        else:
+            output = getattr(self.stdout, 'buffer', None) or sys.stdout.buffer
+            for chunk in chunks:
+                output.write(chunk)
+            output.flush()
@@ -0,0 +1,36 @@
+# payments/management/commands/fake_stripe.py
+from django.core.management.base import BaseCommand
+
+from payments.fake_stripe import FakeStripeServer
+
+
+class Command(BaseCommand):
+    help = 'Sobe um servidor local que imita a API do Stripe (use STRIPE_API_BASE para apontar para ele)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=12111)
+        parser.add_argument('--latency-ms', type=float, default=0, help='Latência fixa por requisição')
+        parser.add_argument('--jitter-ms', type=float, default=0, help='Latência extra aleatória (0 a N ms)')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fração de respostas 500')
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Fração de respostas 429')
+        parser.add_argument('--seed', type=int, help='Semente para tornar as falhas reproduzíveis')
+
+    def handle(self, *args, **options):
+        server = FakeStripeServer(
+            host=options['host'],
+            port=options['port'],
+            latency_ms=options['latency_ms'],
+            jitter_ms=options['jitter_ms'],
+            error_rate=options['error_rate'],
+            rate_limit_rate=options['rate_limit_rate'],
+            seed=options['seed'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Fake Stripe ouvindo em {server.url}'))
+        self.stdout.write(f'Use STRIPE_API_BASE={server.url} na aplicação. Ctrl+C para encerrar.')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
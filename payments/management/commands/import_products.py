@@ -0,0 +1,90 @@
+# payments/management/commands/import_products.py
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.models import ProductSyncTask
+from payments.product_import import (
+    DEFAULT_CHUNK_SIZE, FORMATS, detect_format, import_products, open_source, source_fingerprint,
+    sync_pending_products,
+)
+
+
+class Command(BaseCommand):
+    help = 'Importa o catálogo de um CSV ou NDJSON (upsert por sku) e sincroniza os produtos com o Stripe'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Arquivo .csv, .ndjson/.jsonl (opcionalmente .gz) ou '-' para stdin")
+        parser.add_argument('--format', choices=FORMATS, help='Formato do arquivo; padrão: pela extensão')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Linhas por bloco gravado')
+        parser.add_argument('--no-resume', action='store_true', help='Ignora a posição salva e recomeça o arquivo')
+        parser.add_argument('--no-sync', action='store_true',
+                            help='Só enfileira a sincronização (para o worker sync_stripe_products)')
+        parser.add_argument('--concurrency', type=int, default=settings.STRIPE_SYNC_WORKERS,
+                            help='Chamadas simultâneas ao Stripe na sincronização')
+        parser.add_argument('--batch-size', type=int, default=settings.STRIPE_SYNC_BATCH_SIZE,
+                            help='Tarefas de sincronização reservadas por lote')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size deve ser positivo')
+
+        if path == '-':
+            stream, source = sys.stdin, None
+            fmt = options['format'] or 'csv'
+        else:
+            try:
+                stream, source = open_source(path), source_fingerprint(path)
+            except OSError as e:
+                raise CommandError(f'Não foi possível abrir {path}: {e}')
+            fmt = options['format'] or detect_format(path)
+
+        self.stdout.write(f'Importando produtos de {path} ({fmt})...')
+        try:
+            result = import_products(
+                stream, fmt,
+                source=source,
+                chunk_size=options['chunk_size'],
+                resume=not options['no_resume'],
+                on_chunk=lambda result: self.stdout.write(
+                    f'  {result.rows} linhas: {result.created} criados, {result.updated} atualizados, '
+                    f'{result.invalid} inválidas'
+                ),
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        if result.skipped:
+            self.stdout.write(f'{result.skipped} linhas já importadas puladas (use --no-resume para reimportar).')
+        for line, message in result.errors:
+            self.stderr.write(f'  linha {line}: {message}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{result.rows} linhas lidas: {result.created} criados, {result.updated} atualizados, '
+            f'{result.unchanged} inalterados, {result.invalid} inválidas; '
+            f'{result.enqueued} produtos enfileirados para o Stripe.'
+        ))
+
+        if options['no_sync']:
+            return
+
+        self.stdout.write('Sincronizando com o Stripe...')
+        reported = [0]
+
+        def on_progress(done):
+            # Uma linha a cada ~100 tarefas (chamado pelas threads da sincronização)
+            if done - reported[0] >= 100:
+                reported[0] = done
+                self.stdout.write(f'  {done} tarefas processadas')
+
+        total = sync_pending_products(options['concurrency'], batch_size=options['batch_size'], on_progress=on_progress)
+        waiting = ProductSyncTask.objects.filter(status__in=('pending', 'failed')).count()
+        self.stdout.write(self.style.SUCCESS(f'{total} tarefas de sincronização processadas.'))
+        if waiting:
+            self.stdout.write(self.style.WARNING(
+                f'{waiting} tarefas aguardando nova tentativa (worker sync_stripe_products).'
+            ))
@@ -0,0 +1,42 @@
+# payments/management/commands/process_webhooks.py
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from payments.queue import run_pool
+from payments.webhooks import claim_events, process_events
+from stripe_sandbox.metrics import start_metrics_server
+
+
+class Command(BaseCommand):
+    help = 'Processa a fila de eventos de webhook gravados no modo assíncrono'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.STRIPE_WEBHOOK_WORKERS,
+                            help='Número de threads de processamento')
+        parser.add_argument('--batch-size', type=int, default=settings.STRIPE_WEBHOOK_BATCH_SIZE,
+                            help='Eventos reservados por lote')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Segundos de espera quando a fila está vazia')
+        parser.add_argument('--once', action='store_true',
+                            help='Esvazia a fila e termina, em vez de rodar continuamente')
+        parser.add_argument('--metrics-port', type=int, default=settings.WEBHOOK_METRICS_PORT,
+                            help='Porta das métricas do Prometheus deste worker (0 desliga)')
+
+    def handle(self, *args, **options):
+        # O processamento acontece aqui, não no gunicorn: as métricas de
+        # webhooks (atraso e resultado) só são coletadas por esta porta
+        if options['metrics_port']:
+            start_metrics_server(options['metrics_port'])
+            self.stdout.write(f"Métricas em :{options['metrics_port']}/metrics")
+        self.stdout.write(
+            f"Worker de webhooks iniciado (concurrency={options['concurrency']}, "
+            f"batch_size={options['batch_size']})"
+        )
+        total = run_pool(
+            claim=lambda: claim_events(options['batch_size']),
+            process=process_events,
+            concurrency=options['concurrency'],
+            poll_interval=options['poll_interval'],
+            once=options['once'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'{total} eventos processados.'))
@@ -0,0 +1,20 @@
+# payments/management/commands/prune_idempotency_keys.py
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from payments.checkout import prune_stale_reservations
+from payments.idempotency import prune_expired_keys
+
+
+class Command(BaseCommand):
+    help = (
+        'Remove chaves de idempotência e reservas de checkout sem intent mais antigas '
+        'que IDEMPOTENCY_KEY_TTL_HOURS'
+    )
+
+    def handle(self, *args, **options):
+        deleted = prune_expired_keys()
+        reservations = prune_stale_reservations()
+        self.stdout.write(self.style.SUCCESS(
+            f'{deleted} chaves e {reservations} reservas removidas (TTL de {settings.IDEMPOTENCY_KEY_TTL_HOURS}h).'
+        ))
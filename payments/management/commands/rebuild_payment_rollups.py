@@ -0,0 +1,26 @@
+# payments/management/commands/rebuild_payment_rollups.py
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recalcula os totais diários de pagamentos (PaymentDailyRollup) a partir de Payment'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Primeiro dia (YYYY-MM-DD); padrão: todo o histórico')
+        parser.add_argument('--until', help='Dia final, exclusivo (YYYY-MM-DD)')
+
+    def _parse_date(self, value):
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'Data inválida: {value} (use YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        since = self._parse_date(options['since']) if options['since'] else None
+        until = self._parse_date(options['until']) if options['until'] else None
+        rows = rebuild_rollups(since, until)
+        self.stdout.write(self.style.SUCCESS(f'{rows} linhas de totais diários recalculadas.'))
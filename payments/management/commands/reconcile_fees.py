@@ -0,0 +1,43 @@
+# payments/management/commands/reconcile_fees.py
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from payments.reconciliation import reconcile_fees
+
+
+class Command(BaseCommand):
+    help = 'Preenche stripe_fee/net_amount em lote a partir das balance transactions do Stripe'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Início da janela (YYYY-MM-DD); padrão: --days atrás')
+        parser.add_argument('--until', help='Fim da janela, exclusivo (YYYY-MM-DD); padrão: agora')
+        parser.add_argument('--days', type=int, default=7, help='Tamanho da janela quando --since não é informado')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Balance transactions por bloco gravado')
+        parser.add_argument('--no-resume', action='store_true', help='Ignora a posição salva e recomeça a janela')
+
+    def _parse_date(self, value):
+        try:
+            return timezone.make_aware(datetime.combine(datetime.strptime(value, '%Y-%m-%d').date(), time.min))
+        except ValueError:
+            raise CommandError(f'Data inválida: {value} (use YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        until = self._parse_date(options['until']) if options['until'] else timezone.now()
+        since = self._parse_date(options['since']) if options['since'] else until - timedelta(days=options['days'])
+        if since >= until:
+            raise CommandError('--since deve ser anterior a --until')
+
+        self.stdout.write(f'Reconciliando taxas de {since:%Y-%m-%d %H:%M} até {until:%Y-%m-%d %H:%M}...')
+        scanned, updated = reconcile_fees(
+            since, until,
+            chunk_size=options['chunk_size'],
+            resume=not options['no_resume'],
+            on_chunk=lambda scanned, updated: self.stdout.write(
+                f'  {scanned} balance transactions lidas, {updated} pagamentos atualizados'
+            ),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'{scanned} balance transactions lidas, {updated} pagamentos atualizados.'
+        ))
@@ -0,0 +1,59 @@
+# payments/management/commands/replay_stripe_events.py
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from payments.replay import backfill_events, default_since, drain_queue, requeue_failed_events
+
+
+class Command(BaseCommand):
+    help = 'Recupera eventos do Stripe perdidos (Event.list) e reprocessa eventos com falha'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Início (YYYY-MM-DD ou YYYY-MM-DDTHH:MM); padrão: último evento processado')
+        parser.add_argument('--type', action='append', dest='types',
+                            help='Tipo de evento a buscar (repetível); padrão: tipos com handler')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Devolve à fila os eventos failed/dead antes de processar')
+        parser.add_argument('--no-fetch', action='store_true', help='Não consulta o Stripe; só processa a fila')
+        parser.add_argument('--enqueue-only', action='store_true',
+                            help='Apenas grava os eventos na fila (o worker process_webhooks processa)')
+        parser.add_argument('--concurrency', type=int, default=settings.STRIPE_WEBHOOK_WORKERS,
+                            help='Número de threads de processamento')
+        parser.add_argument('--batch-size', type=int, default=settings.STRIPE_WEBHOOK_BATCH_SIZE,
+                            help='Eventos reservados por lote')
+
+    def _parse_since(self, value):
+        for fmt in ('%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+            try:
+                return timezone.make_aware(datetime.strptime(value, fmt))
+            except ValueError:
+                continue
+        raise CommandError(f'Data inválida: {value} (use YYYY-MM-DD ou YYYY-MM-DDTHH:MM)')
+
+    def handle(self, *args, **options):
+        process = not options['enqueue_only']
+        if options['retry_failed']:
+            requeued = requeue_failed_events(options['types'])
+            self.stdout.write(f'{requeued} eventos com falha devolvidos à fila.')
+
+        if not options['no_fetch']:
+            since = self._parse_since(options['since']) if options['since'] else default_since()
+            if since is None:
+                raise CommandError('Nenhum evento processado ainda: informe --since')
+            self.stdout.write(f'Buscando eventos do Stripe desde {since:%Y-%m-%d %H:%M}...')
+            # A fila é drenada uma única vez abaixo, junto com os eventos devolvidos
+            fetched, imported, _ = backfill_events(
+                since, options['types'],
+                process=False,
+                on_page=lambda fetched, imported: self.stdout.write(
+                    f'  {fetched} eventos lidos, {imported} novos'
+                ),
+            )
+            self.stdout.write(f'{fetched} eventos lidos, {imported} novos enfileirados.')
+
+        if process:
+            processed = drain_queue(options['concurrency'], options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'{processed} eventos processados.'))
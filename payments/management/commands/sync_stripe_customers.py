@@ -0,0 +1,59 @@
+# payments/management/commands/sync_stripe_customers.py
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from payments.models import StripeCustomer
+from payments.stripe_client import get_client
+
+
+class Command(BaseCommand):
+    help = 'Preenche o mapeamento local User -> Customer paginando os customers do Stripe'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=100, help='Customers por página (máx. 100)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Mapeamentos gravados por lote')
+        parser.add_argument('--dry-run', action='store_true', help='Apenas mostra o que seria gravado')
+
+    def handle(self, *args, **options):
+        # Usuários ainda sem customer mapeado
+        mapped = set(
+            StripeCustomer.objects.exclude(stripe_customer_id='').values_list('user_id', flat=True)
+        )
+        users_by_id = {}
+        users_by_email = {}
+        for user_id, email in User.objects.exclude(id__in=mapped).values_list('id', 'email'):
+            users_by_id[str(user_id)] = user_id
+            if email:
+                users_by_email.setdefault(email.lower(), user_id)
+
+        if not users_by_id:
+            self.stdout.write('Nenhum usuário pendente de mapeamento.')
+            return
+
+        pending = {}
+        scanned = 0
+        customers = get_client().Customer.list(limit=min(options['page_size'], 100))
+        for customer in customers.auto_paging_iter():
+            scanned += 1
+            metadata = customer.get('metadata') or {}
+            user_id = users_by_id.get(str(metadata.get('django_user_id', '')))
+            if user_id is None and customer.get('email'):
+                user_id = users_by_email.get(customer['email'].lower())
+            # Mantém o primeiro customer encontrado (o mais recente) por usuário
+            if user_id is not None and user_id not in pending:
+                pending[user_id] = customer['id']
+
+        self.stdout.write(f'{scanned} customers lidos, {len(pending)} usuários encontrados.')
+        if options['dry_run'] or not pending:
+            return
+
+        # Remove placeholders vazios criados por checkouts que falharam
+        StripeCustomer.objects.filter(user_id__in=pending.keys(), stripe_customer_id='').delete()
+        mappings = [
+            StripeCustomer(user_id=user_id, stripe_customer_id=customer_id)
+            for user_id, customer_id in pending.items()
+        ]
+        StripeCustomer.objects.bulk_create(
+            mappings, batch_size=options['batch_size'], ignore_conflicts=True
+        )
+        self.stdout.write(self.style.SUCCESS(f'{len(mappings)} mapeamentos gravados.'))
@@ -0,0 +1,41 @@
+# payments/management/commands/sync_stripe_products.py
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from payments.models import Product, ProductSyncTask
+from payments.product_sync import claim_sync_tasks, process_sync_tasks
+from payments.queue import run_pool
+
+
+class Command(BaseCommand):
+    help = 'Sincroniza produtos e preços pendentes com o Stripe (outbox ProductSyncTask)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.STRIPE_SYNC_WORKERS,
+                            help='Chamadas simultâneas ao Stripe')
+        parser.add_argument('--batch-size', type=int, default=settings.STRIPE_SYNC_BATCH_SIZE,
+                            help='Tarefas reservadas por lote')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Segundos de espera quando o outbox está vazio')
+        parser.add_argument('--once', action='store_true',
+                            help='Esvazia o outbox e termina, em vez de rodar continuamente')
+        parser.add_argument('--enqueue-missing', action='store_true',
+                            help='Enfileira antes todos os produtos ainda sem produto/preço no Stripe')
+
+    def handle(self, *args, **options):
+        if options['enqueue_missing']:
+            enqueued = 0
+            for product in Product.objects.iterator():
+                if product.needs_stripe_sync():
+                    ProductSyncTask.enqueue(product)
+                    enqueued += 1
+            self.stdout.write(f'{enqueued} produtos enfileirados.')
+
+        total = run_pool(
+            claim=lambda: claim_sync_tasks(options['batch_size']),
+            process=process_sync_tasks,
+            concurrency=options['concurrency'],
+            poll_interval=options['poll_interval'],
+            once=options['once'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'{total} tarefas de sincronização processadas.'))
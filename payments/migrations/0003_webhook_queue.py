@@ -0,0 +1,64 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:45
+
+from django.db import migrations, models
+
+
+def mark_processed_events(apps, schema_editor):
+    """Eventos já processados não devem voltar para a fila"""
+    WebhookEvent = apps.get_model('payments', 'WebhookEvent')
+    WebhookEvent.objects.filter(processed=True).update(status='processed')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_stripecustomer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookevent',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='webhookevent',
+            name='last_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='webhookevent',
+            name='locked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='webhookevent',
+            name='locked_by',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='webhookevent',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='webhookevent',
+            name='priority',
+            field=models.SmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='webhookevent',
+            name='processed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='webhookevent',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pendente'), ('processing', 'Processando'), ('processed', 'Processado'), ('failed', 'Falhou (nova tentativa agendada)'), ('dead', 'Dead-letter')], default='pending', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(fields=['status', '-priority', 'created_at'], name='webhook_queue_idx'),
+        ),
+        migrations.RunPython(mark_processed_events, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def mark_existing_prices_synced(apps, schema_editor):
+    """Produtos já criados no Stripe não devem ganhar um novo preço"""
+    Product = apps.get_model('payments', 'Product')
+    Product.objects.exclude(stripe_price_id='').update(stripe_synced_price=models.F('price'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_webhook_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='stripe_synced_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.CreateModel(
+            name='ProductSyncTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pendente'), ('processing', 'Processando'), ('processed', 'Processado'), ('failed', 'Falhou (nova tentativa agendada)'), ('dead', 'Dead-letter')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(blank=True, null=True)),
+                ('locked_by', models.CharField(blank=True, max_length=64)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_tasks', to='payments.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='product_sync_queue_idx')],
+            },
+        ),
+        migrations.RunPython(mark_existing_prices_synced, migrations.RunPython.noop),
+    ]
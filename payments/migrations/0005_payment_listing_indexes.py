@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_product_sync_outbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='payment_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['user', 'status', '-created_at'], name='payment_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['user', 'payment_method_type', '-created_at'], name='payment_user_method_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0005_payment_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('state', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='stripe_charge_id',
+            field=models.CharField(blank=True, db_index=True, max_length=200),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0007_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookevent',
+            name='stripe_created_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0008_webhook_stripe_created_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(fields=['processed', 'created_at'], name='webhook_processed_created_idx'),
+        ),
+    ]
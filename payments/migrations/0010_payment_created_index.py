@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0009_webhook_retention_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['created_at', 'id'], name='payment_created_idx'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:15
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+import django.db.models.deletion
+
+
+def build_rollups(apps, schema_editor):
+    """Totais iniciais a partir dos pagamentos existentes"""
+    Payment = apps.get_model('payments', 'Payment')
+    PaymentDailyRollup = apps.get_model('payments', 'PaymentDailyRollup')
+    money = models.DecimalField(max_digits=14, decimal_places=2)
+    rows = (
+        Payment.objects.annotate(day=TruncDate('created_at')).order_by()
+        .values('day', 'product_id', 'payment_method_type', 'status')
+        .annotate(
+            total=Count('id'),
+            gross_sum=Sum('amount'),
+            fees_sum=Coalesce(Sum('stripe_fee'), Value(Decimal('0')), output_field=money),
+            net_sum=Sum(Coalesce('net_amount', 'amount'), output_field=money),
+        )
+    )
+    PaymentDailyRollup.objects.bulk_create(
+        [PaymentDailyRollup(
+            date=row['day'], product_id=row['product_id'], payment_method_type=row['payment_method_type'],
+            status=row['status'], count=row['total'], gross=row['gross_sum'], fees=row['fees_sum'],
+            net=row['net_sum'],
+        ) for row in rows],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0010_payment_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('payment_method_type', models.CharField(choices=[('card', 'Cartão'), ('pix', 'PIX'), ('boleto', 'Boleto')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pendente'), ('processing', 'Processando'), ('succeeded', 'Aprovado'), ('failed', 'Falhou'), ('canceled', 'Cancelado'), ('requires_action', 'Requer Ação')], max_length=20)),
+                ('count', models.IntegerField(default=0)),
+                ('gross', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('fees', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('net', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='payments.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'date'], name='payment_rollup_status_date_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='paymentdailyrollup',
+            constraint=models.UniqueConstraint(fields=('date', 'product', 'payment_method_type', 'status'), name='payment_rollup_unique'),
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
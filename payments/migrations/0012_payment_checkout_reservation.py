@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0011_payment_daily_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='stripe_idempotency_key',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='stripe_payment_intent_id',
+            field=models.CharField(blank=True, max_length=200, null=True, unique=True),
+        ),
+    ]
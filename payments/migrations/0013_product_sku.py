@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0012_payment_checkout_reservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
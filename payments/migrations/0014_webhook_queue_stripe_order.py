@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:43
+
+from django.db import migrations, models
+import django.db.models.functions.comparison
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0013_product_sku'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='webhookevent',
+            name='webhook_queue_idx',
+        ),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(models.F('status'), models.OrderBy(models.F('priority'), descending=True), django.db.models.functions.comparison.Coalesce('stripe_created_at', 'created_at'), name='webhook_queue_stripe_order_idx'),
+        ),
+    ]
@@ -1,20 +1,24 @@
 # payments/models.py
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.urls import reverse
-import stripe
-from django.conf import settings
+from decimal import Decimal
 import logging
+from .catalog import bump_catalog_version_on_commit
 
 logger = logging.getLogger(__name__)
-stripe.api_key = settings.STRIPE_SECRET_KEY
 
 class Product(models.Model):
+    # Chave natural da importação do catálogo (payments/product_import.py)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=200)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stripe_product_id = models.CharField(max_length=200, blank=True)
     stripe_price_id = models.CharField(max_length=200, blank=True)
+    stripe_synced_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -24,30 +28,25 @@ class Product(models.Model):
     def get_absolute_url(self):
         return reverse('payments:product_detail', kwargs={'pk': self.pk})
     
+    def needs_stripe_sync(self):
+        """Produto ainda não criado no Stripe ou com preço diferente do sincronizado"""
+        if not self.stripe_product_id or not self.stripe_price_id:
+            return True
+        return self.stripe_synced_price is None or Decimal(str(self.price)) != Decimal(str(self.stripe_synced_price))
+    
     def save(self, *args, **kwargs):
-        # Cria produto no Stripe automaticamente
-        if not self.stripe_product_id:
-            try:
-                stripe_product = stripe.Product.create(
-                    name=self.name,
-                    description=self.description,
-                    metadata={'django_id': str(self.id) if self.id else 'new'}
-                )
-                self.stripe_product_id = stripe_product.id
-                
-                stripe_price = stripe.Price.create(
-                    product=stripe_product.id,
-                    unit_amount=int(self.price * 100),  # Em centavos
-                    currency='brl',
-                )
-                self.stripe_price_id = stripe_price.id
-                
-                logger.info(f"Produto criado no Stripe: {stripe_product.id}")
-                
-            except stripe.error.StripeError as e:
-                logger.error(f"Erro ao criar produto no Stripe: {e}")
-        
-        super().save(*args, **kwargs)
+        # A criação no Stripe fica com o worker sync_stripe_products (outbox);
+        # produto e tarefa gravados juntos, ou nenhum dos dois
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if self.needs_stripe_sync():
+                ProductSyncTask.enqueue(self)
+            bump_catalog_version_on_commit()
+    
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        bump_catalog_version_on_commit()
+        return result
 
 class Payment(models.Model):
     STATUS_CHOICES = [
@@ -68,9 +67,14 @@ class Payment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     
-    # Stripe IDs
-    stripe_payment_intent_id = models.CharField(max_length=200, unique=True)
+    # Stripe IDs (o intent fica vazio enquanto o checkout reserva o pagamento,
+    # ver payments/checkout.py)
+    stripe_payment_intent_id = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    # Chave de idempotência enviada ao Stripe na criação do intent: uma
+    # retomada do mesmo checkout reaproveita esta reserva
+    stripe_idempotency_key = models.CharField(max_length=100, unique=True, null=True, blank=True, editable=False)
     stripe_customer_id = models.CharField(max_length=200, blank=True)
+    stripe_charge_id = models.CharField(max_length=200, blank=True, db_index=True)
     
     # Payment details
     amount = models.DecimalField(max_digits=10, decimal_places=2)
@@ -89,6 +93,35 @@ class Payment(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Listagens e histórico por usuário com paginação keyset
+            models.Index(fields=['user', '-created_at', '-id'], name='payment_user_created_idx'),
+            models.Index(fields=['user', 'status', '-created_at'], name='payment_user_status_idx'),
+            models.Index(fields=['user', 'payment_method_type', '-created_at'], name='payment_user_method_idx'),
+            # Exportação e relatórios por período
+            models.Index(fields=['created_at', 'id'], name='payment_created_idx'),
+        ]
+    
+    def save(self, *args, **kwargs):
+        from .rollups import ROLLUP_FIELDS, record_payment_change
+        
+        # Mantém PaymentDailyRollup em dia com criação e edições (ex.: admin)
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                previous = Payment.objects.filter(pk=self.pk).values(*ROLLUP_FIELDS).first()
+            super().save(*args, **kwargs)
+            record_payment_change(previous, {field: getattr(self, field) for field in ROLLUP_FIELDS})
+    
+    def delete(self, *args, **kwargs):
+        from .rollups import ROLLUP_FIELDS, record_payment_change
+        
+        # A exclusão também sai dos totais diários
+        with transaction.atomic():
+            previous = Payment.objects.filter(pk=self.pk).values(*ROLLUP_FIELDS).first()
+            result = super().delete(*args, **kwargs)
+            record_payment_change(previous, None)
+        return result
     
     def __str__(self):
         return f"Pagamento #{self.id} - {self.user.username} - {self.get_status_display()}"
@@ -96,13 +129,145 @@ class Payment(models.Model):
     def get_absolute_url(self):
         return reverse('payments:payment_detail', kwargs={'pk': self.pk})
 
+# Status dos itens das filas em banco (ver payments/queue.py)
+QUEUE_STATUS_CHOICES = [
+    ('pending', 'Pendente'),
+    ('processing', 'Processando'),
+    ('processed', 'Processado'),
+    ('failed', 'Falhou (nova tentativa agendada)'),
+    ('dead', 'Dead-letter'),
+]
+
 class WebhookEvent(models.Model):
-    """Log de eventos de webhook para debug"""
+    """Log e fila de processamento dos eventos de webhook"""
+    STATUS_CHOICES = QUEUE_STATUS_CHOICES
+    
     stripe_event_id = models.CharField(max_length=200, unique=True)
     event_type = models.CharField(max_length=100)
     processed = models.BooleanField(default=False)
     data = models.JSONField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # Campo `created` do evento no Stripe (atraso de entrega + processamento)
+    stripe_created_at = models.DateTimeField(null=True, blank=True)
+    
+    # Fila de processamento assíncrono
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    priority = models.SmallIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    
+    class Meta:
+        indexes = [
+            # Ordem de claim_events: prioridade e depois a ordem do Stripe
+            models.Index(
+                F('status'), F('priority').desc(), Coalesce('stripe_created_at', 'created_at'),
+                name='webhook_queue_stripe_order_idx',
+            ),
+            # Retenção/arquivamento e backlog (processed=False)
+            models.Index(fields=['processed', 'created_at'], name='webhook_processed_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.event_type} - {self.stripe_event_id}"
+
+class StripeCustomer(models.Model):
+    """Mapeamento local entre usuário e Customer do Stripe"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='stripe_customer')
+    stripe_customer_id = models.CharField(max_length=200, blank=True, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.stripe_customer_id or 'sem customer'}"
+
+class ProductSyncTask(models.Model):
+    """Outbox de sincronização de produtos e preços com o Stripe"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='sync_tasks')
+    status = models.CharField(max_length=20, choices=QUEUE_STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='product_sync_queue_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Sync {self.product_id} - {self.get_status_display()}"
+    
+    @classmethod
+    def enqueue(cls, product):
+        """Registra sincronização pendente, a menos que já exista uma aguardando"""
+        if not cls.objects.filter(product=product, status__in=('pending', 'failed')).exists():
+            cls.objects.create(product=product)
+
+class SyncCursor(models.Model):
+    """Posição salva de jobs de sincronização retomáveis (ex.: reconcile_fees)"""
+    name = models.CharField(max_length=100, unique=True)
+    state = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return self.name
+
+class IdempotencyKey(models.Model):
+    """Resposta registrada para um header Idempotency-Key (ver payments/idempotency.py)"""
+    STATUS_CHOICES = [
+        ('processing', 'Em andamento'),
+        ('completed', 'Concluída'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    scope = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='processing')
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True)
+    locked_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'scope', 'key'], name='idempotency_key_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='idempotency_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.scope} - {self.key}"
+
+class PaymentDailyRollup(models.Model):
+    """Totais diários por produto, método e status (mantidos por payments/rollups.py)"""
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_rollups')
+    payment_method_type = models.CharField(max_length=20, choices=Payment.PAYMENT_METHOD_CHOICES)
+    status = models.CharField(max_length=20, choices=Payment.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+    gross = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    fees = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    net = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'product', 'payment_method_type', 'status'], name='payment_rollup_unique'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'date'], name='payment_rollup_status_date_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.event_type} - {self.stripe_event_id}"
\ No newline at end of file
+        return f"{self.date} - {self.product_id} - {self.payment_method_type} - {self.status}"
@@ -0,0 +1,37 @@
+# payments/pagination.py
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(obj):
+    raw = f'{obj.created_at.isoformat()}|{obj.pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Retorna (created_at, pk) ou None para cursores inválidos"""
+    try:
+        created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        created_at = parse_datetime(created_at)
+        return (created_at, int(pk)) if created_at else None
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        return None
+
+
+def keyset_paginate(queryset, cursor=None, page_size=20):
+    """
+    Pagina em ordem (-created_at, -id) a partir do cursor da página anterior.
+    Retorna (itens, cursor da próxima página ou None).
+    """
+    queryset = queryset.order_by('-created_at', '-id')
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        created_at, pk = position
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+    items = list(queryset[:page_size + 1])
+    next_cursor = encode_cursor(items[page_size - 1]) if len(items) > page_size else None
+    return items[:page_size], next_cursor
@@ -0,0 +1,267 @@
+# payments/product_import.py
+"""
+Importação do catálogo a partir de CSV ou NDJSON (comando import_products).
+
+Campos: sku (chave natural), name e price obrigatórios; description e
+active opcionais. Um SKU existente é atualizado, um novo é criado.
+
+As linhas são gravadas em blocos de `chunk_size`, um bloco por transação:
+uma consulta pelos SKUs do bloco, um bulk_create dos novos e um
+bulk_update dos alterados. As operações em massa não passam por
+Product.save, então o próprio bloco enfileira em massa as tarefas do
+outbox ProductSyncTask (produto novo ou preço alterado) e invalida o
+catálogo uma vez. O Stripe é sincronizado pelo outbox (sync_product), que
+o comando drena com concorrência limitada.
+
+Após cada bloco a posição é salva em SyncCursor: repetida com o mesmo
+arquivo, uma importação interrompida continua da linha seguinte, e as
+tarefas de sincronização pendentes ou com falha continuam no outbox.
+Linhas inválidas são contadas e ignoradas.
+"""
+import csv
+import gzip
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import F, Q
+
+from .catalog import bump_catalog_version_on_commit
+from .models import Product, ProductSyncTask, SyncCursor
+from .product_sync import claim_sync_tasks, process_sync_tasks
+from .queue import run_pool
+
+CURSOR_NAME = 'import_products'
+FORMATS = ('csv', 'ndjson')
+REQUIRED_FIELDS = ('sku', 'name', 'price')
+UPDATE_FIELDS = ('name', 'description', 'price', 'active')
+DEFAULT_CHUNK_SIZE = 500
+MAX_REPORTED_ERRORS = 20
+MAX_PRICE = Decimal('99999999.99')
+CENTS = Decimal('0.01')
+TRUE_VALUES = ('1', 'true', 't', 'yes', 'y', 'sim', 's')
+FALSE_VALUES = ('0', 'false', 'f', 'no', 'n', 'nao', 'não')
+
+# Mesma regra de Product.needs_stripe_sync, em SQL
+NEEDS_STRIPE_SYNC = (
+    Q(stripe_product_id='') | Q(stripe_price_id='') | Q(stripe_synced_price__isnull=True)
+    | ~Q(price=F('stripe_synced_price'))
+)
+
+
+class ImportRowError(ValueError):
+    """Linha que não pode ser importada"""
+
+
+@dataclass
+class ImportResult:
+    rows: int = 0
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    invalid: int = 0
+    enqueued: int = 0
+    skipped: int = 0
+    errors: list = field(default_factory=list)
+
+    def add_error(self, line, message):
+        self.invalid += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+def detect_format(path):
+    name = path.lower().removesuffix('.gz')
+    return 'ndjson' if name.endswith(('.ndjson', '.jsonl')) else 'csv'
+
+
+def open_source(path):
+    """Abre o arquivo em texto (.gz descomprimido na leitura)"""
+    if path.lower().endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8-sig', newline='')
+    return open(path, encoding='utf-8-sig', newline='')
+
+
+def source_fingerprint(path):
+    """Identifica o arquivo para a retomada: caminho, tamanho e data de modificação"""
+    stat = os.stat(path)
+    return f'{os.path.abspath(path)}:{stat.st_size}:{int(stat.st_mtime)}'
+
+
+def read_rows(stream, fmt):
+    """(número da linha, registro): dict no CSV, linha JSON no NDJSON"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        missing = [name for name in REQUIRED_FIELDS if name not in (reader.fieldnames or ())]
+        if missing:
+            raise ValueError(f"Colunas obrigatórias ausentes: {', '.join(missing)}")
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(stream, 1):
+        if line.strip():
+            yield number, line
+
+
+def _parse_active(value):
+    if value is None or value == '':
+        return True
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ImportRowError(f'active inválido: {value!r}')
+
+
+def clean_row(record):
+    """Valida e normaliza um registro; levanta ImportRowError"""
+    if isinstance(record, str):
+        try:
+            record = json.loads(record)
+        except json.JSONDecodeError as e:
+            raise ImportRowError(f'JSON inválido: {e}')
+        if not isinstance(record, dict):
+            raise ImportRowError('registro deve ser um objeto JSON')
+
+    sku = str(record.get('sku') or '').strip()
+    name = str(record.get('name') or '').strip()
+    if not sku or not name:
+        raise ImportRowError('sku e name são obrigatórios')
+    if len(sku) > 64 or len(name) > 200:
+        raise ImportRowError('sku (64) ou name (200) acima do tamanho máximo')
+
+    try:
+        price = Decimal(str(record.get('price', '')).strip().replace(',', '.'))
+    except InvalidOperation:
+        raise ImportRowError(f"price inválido: {record.get('price')!r}")
+    if not price.is_finite() or price < 0 or price > MAX_PRICE or price != price.quantize(CENTS):
+        raise ImportRowError(f"price inválido: {record.get('price')!r}")
+
+    return {
+        'sku': sku,
+        'name': name,
+        'description': str(record.get('description') or ''),
+        'price': price.quantize(CENTS),
+        'active': _parse_active(record.get('active')),
+    }
+
+
+def enqueue_sync(skus):
+    """Enfileira a sincronização dos produtos que precisam dela, sem duplicar tarefas aguardando"""
+    ids = set(Product.objects.filter(NEEDS_STRIPE_SYNC, sku__in=skus).values_list('id', flat=True))
+    waiting = set(
+        ProductSyncTask.objects.filter(product_id__in=ids, status__in=('pending', 'failed'))
+        .values_list('product_id', flat=True)
+    )
+    tasks = [ProductSyncTask(product_id=product_id) for product_id in sorted(ids - waiting)]
+    ProductSyncTask.objects.bulk_create(tasks)
+    return len(tasks)
+
+
+def import_chunk(rows):
+    """Grava um bloco ({sku: dados}); retorna (criados, atualizados, inalterados, enfileirados)"""
+    with transaction.atomic():
+        existing = Product.objects.in_bulk(list(rows), field_name='sku')
+        new, changed = [], []
+        for sku, data in rows.items():
+            product = existing.get(sku)
+            if product is None:
+                new.append(Product(**data))
+            elif any(getattr(product, name) != data[name] for name in UPDATE_FIELDS):
+                for name in UPDATE_FIELDS:
+                    setattr(product, name, data[name])
+                changed.append(product)
+
+        Product.objects.bulk_create(new)
+        Product.objects.bulk_update(changed, UPDATE_FIELDS)
+        enqueued = enqueue_sync(list(rows)) if new or changed else 0
+        if new or changed:
+            bump_catalog_version_on_commit()
+    return len(new), len(changed), len(rows) - len(new) - len(changed), enqueued
+
+
+def import_products(stream, fmt='csv', source=None, chunk_size=DEFAULT_CHUNK_SIZE, resume=True, on_chunk=None):
+    """
+    Importa os registros de `stream`. Com `source` (ver source_fingerprint)
+    a posição é salva a cada bloco e, com resume=True, uma importação
+    interrompida do mesmo arquivo pula as linhas já gravadas.
+    Retorna um ImportResult.
+    """
+    cursor = None
+    start_after = 0
+    if source:
+        cursor, _ = SyncCursor.objects.get_or_create(name=CURSOR_NAME)
+        if resume and cursor.state.get('source') == source and not cursor.state.get('done'):
+            start_after = cursor.state.get('line', 0)
+
+    result = ImportResult()
+    chunk = {}
+    last_line = start_after
+
+    def flush():
+        if chunk:
+            created, updated, unchanged, enqueued = import_chunk(chunk)
+            result.created += created
+            result.updated += updated
+            result.unchanged += unchanged
+            result.enqueued += enqueued
+            chunk.clear()
+        if cursor:
+            cursor.state = {'source': source, 'line': last_line, 'done': False}
+            cursor.save(update_fields=['state', 'updated_at'])
+        if on_chunk:
+            on_chunk(result)
+
+    for line, record in read_rows(stream, fmt):
+        if line <= start_after:
+            result.skipped += 1
+            continue
+        result.rows += 1
+        last_line = line
+        try:
+            data = clean_row(record)
+        except ImportRowError as e:
+            result.add_error(line, str(e))
+            continue
+        # SKU repetido no mesmo bloco: vale a última linha
+        chunk[data['sku']] = data
+        if len(chunk) >= chunk_size:
+            flush()
+    flush()
+
+    if cursor:
+        cursor.state = {'source': source, 'line': last_line, 'done': True}
+        cursor.save(update_fields=['state', 'updated_at'])
+    return result
+
+
+def sync_pending_products(concurrency, batch_size=None, on_progress=None):
+    """
+    Drena o outbox ProductSyncTask com até `concurrency` chamadas
+    simultâneas ao Stripe. Tarefas com falha ficam agendadas para o worker
+    sync_stripe_products. Retorna quantas foram processadas.
+    """
+    lock = threading.Lock()
+    done = 0
+
+    def process(tasks):
+        nonlocal done
+        process_sync_tasks(tasks)
+        with lock:
+            done += len(tasks)
+            current = done
+        if on_progress:
+            on_progress(current)
+
+    return run_pool(
+        claim=lambda: claim_sync_tasks(batch_size),
+        process=process,
+        concurrency=concurrency,
+        once=True,
+    )
@@ -0,0 +1,96 @@
+# payments/product_sync.py
+"""
+Sincronização de produtos e preços com o Stripe a partir do outbox
+ProductSyncTask, consumido pelo comando `sync_stripe_products`.
+"""
+import logging
+from decimal import Decimal
+
+from django.conf import settings
+from django.utils import timezone
+
+from .catalog import bump_catalog_version
+from .models import Product, ProductSyncTask
+from .queue import claim_batch, mark_failed
+from .stripe_client import get_client
+
+logger = logging.getLogger(__name__)
+
+
+def sync_product(product, idempotency_prefix):
+    """
+    Cria o produto e/ou um novo preço no Stripe conforme necessário.
+    Preços no Stripe são imutáveis: uma alteração de preço cria um novo
+    Price e desativa o anterior.
+    """
+    client = get_client()
+    changes = {}
+
+    if not product.stripe_product_id:
+        stripe_product = client.Product.create(
+            name=product.name,
+            description=product.description,
+            metadata={'django_id': str(product.id)},
+            idempotency_key=f'{idempotency_prefix}-product',
+        )
+        changes['stripe_product_id'] = product.stripe_product_id = stripe_product.id
+        # Grava já o produto para que uma falha no preço não o recrie
+        Product.objects.filter(pk=product.pk).update(stripe_product_id=stripe_product.id)
+        logger.info(f"Produto criado no Stripe: {stripe_product.id}")
+
+    price = Decimal(str(product.price))
+    if product.needs_stripe_sync():
+        previous_price_id = product.stripe_price_id
+        stripe_price = client.Price.create(
+            product=product.stripe_product_id,
+            unit_amount=int(price * 100),  # Em centavos
+            currency='brl',
+            idempotency_key=f'{idempotency_prefix}-price-{int(price * 100)}',
+        )
+        changes['stripe_price_id'] = stripe_price.id
+        changes['stripe_synced_price'] = price
+        # update() em vez de save() para não reenfileirar a sincronização
+        Product.objects.filter(pk=product.pk).update(
+            stripe_price_id=stripe_price.id, stripe_synced_price=price
+        )
+        if previous_price_id:
+            client.Price.modify(previous_price_id, active=False)
+        logger.info(f"Preço {stripe_price.id} criado no Stripe para o produto {product.id}")
+
+    return changes
+
+
+def process_sync_tasks(tasks):
+    """Processa um grupo de tarefas reservadas pelo worker"""
+    changed = False
+    for task in tasks:
+        try:
+            product = Product.objects.get(pk=task.product_id)
+            changed |= bool(sync_product(product, idempotency_prefix=f'product-sync-{task.pk}'))
+        except Exception as e:
+            logger.error(f"Erro ao sincronizar produto {task.product_id} com o Stripe: {e}")
+            mark_failed(
+                task, e,
+                max_attempts=settings.STRIPE_SYNC_MAX_ATTEMPTS,
+                base_seconds=settings.STRIPE_SYNC_RETRY_BASE_SECONDS,
+                max_seconds=settings.STRIPE_SYNC_RETRY_MAX_SECONDS,
+            )
+            continue
+
+        ProductSyncTask.objects.filter(pk=task.pk).update(
+            status='processed', processed_at=timezone.now(), locked_by='', locked_at=None, last_error=''
+        )
+
+    if changed:
+        # IDs do Stripe fazem parte do payload do catálogo
+        bump_catalog_version()
+
+
+def claim_sync_tasks(batch_size=None):
+    """Reserva tarefas pendentes; cada uma vira um grupo para rodar em paralelo"""
+    tasks = claim_batch(
+        ProductSyncTask.objects.all(),
+        limit=batch_size or settings.STRIPE_SYNC_BATCH_SIZE,
+        lock_timeout=settings.STRIPE_SYNC_LOCK_TIMEOUT_SECONDS,
+    )
+    return [[task] for task in tasks]
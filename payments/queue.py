@@ -0,0 +1,118 @@
+# payments/queue.py
+"""
+Utilitários de fila em banco usados pelos workers em background.
+
+Os modelos enfileirados precisam dos campos status, attempts,
+next_attempt_at, locked_by, locked_at e last_error.
+"""
+import logging
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+CLAIMABLE_STATUSES = ('pending', 'failed')
+
+
+def _claimable_filter(now, lock_timeout):
+    ready = Q(status__in=CLAIMABLE_STATUSES) & (
+        Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now)
+    )
+    # Itens presos em "processing" por um worker que morreu voltam para a fila
+    stale = Q(status='processing', locked_at__lt=now - timedelta(seconds=lock_timeout))
+    return ready | stale
+
+
+def claim_batch(queryset, limit, lock_timeout, order_by=('created_at',)):
+    """
+    Reserva até `limit` itens prontos para processamento.
+
+    A reserva é um UPDATE condicional com um token único, portanto vários
+    workers (threads ou processos) podem disputar a mesma fila sem receber
+    o mesmo item.
+    """
+    now = timezone.now()
+    claimable = _claimable_filter(now, lock_timeout)
+    ids = list(
+        queryset.filter(claimable).order_by(*order_by).values_list('id', flat=True)[:limit]
+    )
+    if not ids:
+        return []
+
+    token = uuid.uuid4().hex
+    queryset.filter(claimable, id__in=ids).update(
+        status='processing',
+        locked_by=token,
+        locked_at=now,
+        attempts=F('attempts') + 1,
+    )
+    return list(queryset.filter(locked_by=token, status='processing').order_by(*order_by))
+
+
+def retry_delay(attempts, base_seconds, max_seconds):
+    """Backoff exponencial com jitter para a tentativa `attempts`"""
+    delay = min(max_seconds, base_seconds * (2 ** max(attempts - 1, 0)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def mark_failed(item, error, max_attempts, base_seconds, max_seconds):
+    """Agenda nova tentativa ou move o item para dead-letter"""
+    item.last_error = str(error)[:2000]
+    item.locked_by = ''
+    item.locked_at = None
+    if item.attempts >= max_attempts:
+        item.status = 'dead'
+        item.next_attempt_at = None
+        logger.error(f"{item} movido para dead-letter após {item.attempts} tentativas: {error}")
+    else:
+        item.status = 'failed'
+        item.next_attempt_at = timezone.now() + timedelta(
+            seconds=retry_delay(item.attempts, base_seconds, max_seconds)
+        )
+        logger.warning(f"{item} falhou (tentativa {item.attempts}), nova tentativa em {item.next_attempt_at}: {error}")
+    item.save(update_fields=['status', 'next_attempt_at', 'locked_by', 'locked_at', 'last_error'])
+
+
+def _run_task(task, item):
+    try:
+        return task(item)
+    finally:
+        close_old_connections()
+
+
+def run_pool(claim, process, concurrency=1, poll_interval=1.0, once=False):
+    """
+    Laço principal dos workers: reserva lotes com `claim()` e processa cada
+    lote com `process(items)`, que recebe uma lista de itens.
+
+    `process` é chamado em paralelo para cada grupo devolvido por
+    `claim()`; com concurrency=1 tudo roda na thread atual.
+    Retorna o total de itens processados.
+    """
+    total = 0
+    executor = ThreadPoolExecutor(max_workers=concurrency) if concurrency > 1 else None
+    try:
+        while True:
+            groups = claim()
+            if not groups:
+                if once:
+                    return total
+                time.sleep(poll_interval)
+                continue
+
+            if executor:
+                list(executor.map(lambda group: _run_task(process, group), groups))
+            else:
+                for group in groups:
+                    process(group)
+            total += sum(len(group) for group in groups)
+    finally:
+        if executor:
+            executor.shutdown(wait=True)
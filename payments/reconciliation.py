@@ -0,0 +1,124 @@
+# payments/reconciliation.py
+"""
+Reconciliação das taxas do Stripe (stripe_fee/net_amount) a partir das
+balance transactions, em lote e de forma retomável.
+"""
+import logging
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Payment, SyncCursor
+from .rollups import ROLLUP_FIELDS, apply_deltas, payment_deltas
+from .stripe_client import get_client
+
+logger = logging.getLogger(__name__)
+
+CURSOR_NAME = 'reconcile_fees'
+
+
+# Tipos de balance transaction de uma cobrança; reembolsos, disputas e
+# repasses também carregam o payment_intent na origem e ficam de fora
+CHARGE_TYPES = ('charge', 'payment')
+
+
+def _source_ids(balance_transaction):
+    """
+    Retorna (charge_id, payment_intent_id) da origem da balance transaction,
+    ou (None, None) quando ela não é uma cobrança
+    """
+    if balance_transaction.get('type') not in CHARGE_TYPES:
+        return None, None
+    source = balance_transaction.get('source')
+    if isinstance(source, dict):
+        if source.get('object', 'charge') != 'charge':
+            return None, None
+        intent = source.get('payment_intent')
+        if isinstance(intent, dict):
+            intent = intent.get('id')
+        return source.get('id'), intent
+    return source, None
+
+
+def apply_fees(balance_transactions):
+    """
+    Atualiza taxas dos pagamentos correspondentes a um bloco de balance
+    transactions, casando pela cobrança ou pelo PaymentIntent.
+    Retorna o número de pagamentos atualizados.
+    """
+    by_charge = {}
+    by_intent = {}
+    for balance_transaction in balance_transactions:
+        charge_id, intent_id = _source_ids(balance_transaction)
+        if charge_id:
+            by_charge[charge_id] = balance_transaction
+        if intent_id:
+            by_intent[intent_id] = (charge_id, balance_transaction)
+
+    if not by_charge and not by_intent:
+        return 0
+
+    payments = Payment.objects.filter(
+        Q(stripe_charge_id__in=by_charge.keys()) | Q(stripe_payment_intent_id__in=by_intent.keys())
+    ).only('id', 'stripe_charge_id', 'stripe_payment_intent_id', *ROLLUP_FIELDS)
+
+    changed = []
+    rollup_changes = []
+    for payment in payments:
+        before = {field: getattr(payment, field) for field in ROLLUP_FIELDS}
+        balance_transaction = by_charge.get(payment.stripe_charge_id)
+        if balance_transaction is None:
+            charge_id, balance_transaction = by_intent[payment.stripe_payment_intent_id]
+            payment.stripe_charge_id = charge_id or payment.stripe_charge_id
+        payment.stripe_fee = Decimal(str(balance_transaction['fee'])) / 100
+        payment.net_amount = Decimal(str(balance_transaction['net'])) / 100
+        changed.append(payment)
+        rollup_changes.append((before, {field: getattr(payment, field) for field in ROLLUP_FIELDS}))
+
+    with transaction.atomic():
+        Payment.objects.bulk_update(changed, ['stripe_charge_id', 'stripe_fee', 'net_amount'])
+        apply_deltas(payment_deltas(rollup_changes))
+    return len(changed)
+
+
+def reconcile_fees(created_gte, created_lt, chunk_size=500, resume=True, on_chunk=None):
+    """
+    Percorre as balance transactions da janela [created_gte, created_lt)
+    com paginação automática e aplica as taxas em blocos de `chunk_size`.
+
+    A posição é salva após cada bloco; com resume=True uma execução
+    interrompida continua de onde parou, desde que a janela seja a mesma.
+    Retorna (balance transactions lidas, pagamentos atualizados).
+    """
+    window = {'gte': int(created_gte.timestamp()), 'lt': int(created_lt.timestamp())}
+    cursor, _ = SyncCursor.objects.get_or_create(name=CURSOR_NAME)
+
+    params = {'created': window, 'limit': 100, 'expand': ['data.source']}
+    if resume and cursor.state.get('window') == window and cursor.state.get('starting_after'):
+        params['starting_after'] = cursor.state['starting_after']
+        logger.info(f"Retomando reconciliação após {params['starting_after']}")
+
+    scanned = updated = 0
+    chunk = []
+
+    def flush():
+        nonlocal updated
+        updated += apply_fees(chunk)
+        cursor.state = {'window': window, 'starting_after': chunk[-1]['id'], 'done': False}
+        cursor.save(update_fields=['state', 'updated_at'])
+        if on_chunk:
+            on_chunk(scanned, updated)
+        chunk.clear()
+
+    for balance_transaction in get_client().BalanceTransaction.list(**params).auto_paging_iter():
+        scanned += 1
+        chunk.append(balance_transaction)
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+
+    cursor.state = {'window': window, 'done': True}
+    cursor.save(update_fields=['state', 'updated_at'])
+    return scanned, updated
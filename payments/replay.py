@@ -0,0 +1,123 @@
+# payments/replay.py
+"""
+Recuperação de eventos do Stripe após indisponibilidade.
+
+- backfill_events: percorre o Event.list do Stripe a partir do último
+  evento processado (página a página, via cliente compartilhado), grava
+  na fila apenas os eventos que ainda não estão em WebhookEvent e drena a
+  fila com os handlers normais, em lotes e com concorrência limitada.
+- requeue_events: devolve à fila, em massa, eventos com falha
+  (failed/dead) ou quaisquer eventos selecionados, zerando as tentativas
+  (exceto os que um worker está processando).
+
+Eventos fora de ordem são seguros: as transições de status dos
+pagamentos são guardadas por ALLOWED_TRANSITIONS.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import WebhookEvent
+from .queue import run_pool
+from .stripe_client import get_client
+from .webhooks import HANDLERS, claim_events, enqueue_events, process_events
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 100
+# Margem antes do último evento processado: eventos entregues fora de ordem
+REPLAY_OVERLAP = timedelta(minutes=10)
+
+
+def default_since():
+    """Ponto de partida do backfill: último evento processado menos REPLAY_OVERLAP"""
+    last = WebhookEvent.objects.filter(processed=True).aggregate(
+        stripe=Max('stripe_created_at'), local=Max('created_at'),
+    )
+    point = last['stripe'] or last['local']
+    return point - REPLAY_OVERLAP if point else None
+
+
+def iter_event_pages(since, types=None, page_size=PAGE_SIZE):
+    """Páginas de eventos do Stripe criados a partir de `since` (mais recentes primeiro)"""
+    client = get_client()
+    params = {'created': {'gte': int(since.timestamp())}, 'limit': page_size}
+    if types:
+        params['types'] = list(types)
+    while True:
+        page = client.Event.list(**params)
+        events = list(page['data'])
+        if events:
+            yield events
+        if not events or not page.get('has_more'):
+            return
+        params['starting_after'] = events[-1]['id']
+
+
+def import_events(events):
+    """Enfileira os eventos ainda não gravados; retorna quantos foram enfileirados"""
+    known = set(
+        WebhookEvent.objects.filter(stripe_event_id__in=[event['id'] for event in events])
+        .values_list('stripe_event_id', flat=True)
+    )
+    new_events = sorted((event for event in events if event['id'] not in known), key=lambda event: event['created'])
+    if new_events:
+        enqueue_events(new_events)
+    return len(new_events)
+
+
+def drain_queue(concurrency=None, batch_size=None):
+    """Processa a fila até esvaziar (eventos com retry agendado ficam para o worker)"""
+    return run_pool(
+        claim=lambda: claim_events(batch_size or settings.STRIPE_WEBHOOK_BATCH_SIZE),
+        process=process_events,
+        concurrency=concurrency or settings.STRIPE_WEBHOOK_WORKERS,
+        once=True,
+    )
+
+
+def backfill_events(since, types=None, process=True, concurrency=None, batch_size=None, on_page=None):
+    """
+    Busca no Stripe os eventos desde `since` (por padrão só os tipos com
+    handler) e processa os que faltam. Retorna (lidos, enfileirados, processados).
+    """
+    types = sorted(types or HANDLERS)
+    fetched = imported = 0
+    for events in iter_event_pages(since, types):
+        fetched += len(events)
+        imported += import_events(events)
+        if on_page:
+            on_page(fetched, imported)
+    logger.info("Backfill desde %s: %s evento(s) lido(s), %s novo(s)", since, fetched, imported)
+
+    processed = drain_queue(concurrency, batch_size) if process and imported else 0
+    return fetched, imported, processed
+
+
+def requeue_events(queryset):
+    """
+    Devolve os eventos à fila como pendentes, com tentativas zeradas;
+    retorna quantos. Eventos em processamento por um worker vivo (trava
+    mais nova que STRIPE_WEBHOOK_LOCK_TIMEOUT_SECONDS) ficam de fora, para
+    não serem reservados e aplicados por dois workers ao mesmo tempo.
+    """
+    lock_threshold = timezone.now() - timedelta(seconds=settings.STRIPE_WEBHOOK_LOCK_TIMEOUT_SECONDS)
+    return queryset.exclude(status='processing', locked_at__gte=lock_threshold).update(
+        processed=False,
+        status='pending',
+        attempts=0,
+        next_attempt_at=None,
+        locked_by='',
+        locked_at=None,
+        last_error='',
+    )
+
+
+def requeue_failed_events(event_types=None):
+    queryset = WebhookEvent.objects.filter(status__in=('failed', 'dead'))
+    if event_types:
+        queryset = queryset.filter(event_type__in=event_types)
+    return requeue_events(queryset)
@@ -0,0 +1,188 @@
+# payments/rollups.py
+"""
+Totais diários de pagamentos (PaymentDailyRollup) mantidos de forma incremental.
+
+Cada pagamento contribui para a linha (dia de criação, produto, método,
+status) com count=1, gross=amount, fees=stripe_fee e net=net_amount
+(amount enquanto a taxa não foi reconciliada). Toda mudança em um
+pagamento vira um delta: sai da linha antiga e entra na nova, aplicado
+com UPDATE ... SET count = count + N na mesma transação da mudança.
+
+Pontos de atualização: Payment.save (criação e edições), Payment.delete,
+transition_payments (webhooks e sincronização com o Stripe) e apply_fees
+(reconciliação). Alterações feitas fora deles (ex.: exclusões em massa,
+que não passam por Payment.delete) são corrigidas com
+`python manage.py rebuild_payment_rollups`.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import Payment, PaymentDailyRollup
+
+ROLLUP_FIELDS = (
+    'created_at', 'product_id', 'payment_method_type', 'status', 'amount', 'stripe_fee', 'net_amount',
+)
+ZERO = Decimal('0')
+CENTS = Decimal('0.01')
+
+
+def _decimal(value):
+    return ZERO if value is None else Decimal(str(value))
+
+
+def _contribution(payment):
+    """(chave, [count, gross, fees, net]) de um pagamento (dict com ROLLUP_FIELDS)"""
+    key = (
+        timezone.localtime(payment['created_at']).date(),
+        payment['product_id'],
+        payment['payment_method_type'],
+        payment['status'],
+    )
+    amount = _decimal(payment['amount'])
+    net = amount if payment['net_amount'] is None else _decimal(payment['net_amount'])
+    return key, [1, amount, _decimal(payment['stripe_fee']), net]
+
+
+def payment_deltas(changes):
+    """Soma os deltas de uma sequência de (antes, depois); None = não existia / deixou de existir"""
+    deltas = defaultdict(lambda: [0, ZERO, ZERO, ZERO])
+    for before, after in changes:
+        for payment, sign in ((before, -1), (after, 1)):
+            if payment is None:
+                continue
+            key, values = _contribution(payment)
+            deltas[key] = [total + sign * value for total, value in zip(deltas[key], values)]
+    return {key: values for key, values in deltas.items() if any(values)}
+
+
+def apply_deltas(deltas):
+    """
+    Aplica os deltas com incrementos atômicos (uma linha nova é criada antes,
+    se preciso). As linhas são travadas sempre na ordem das chaves, para que
+    duas transações com as mesmas linhas não entrem em deadlock.
+    """
+    if not deltas:
+        return
+    deltas = sorted(deltas.items())
+    with transaction.atomic():
+        PaymentDailyRollup.objects.bulk_create(
+            [PaymentDailyRollup(date=date, product_id=product_id, payment_method_type=method, status=status)
+             for (date, product_id, method, status), _ in deltas],
+            ignore_conflicts=True,
+        )
+        for (date, product_id, method, status), (count, gross, fees, net) in deltas:
+            PaymentDailyRollup.objects.filter(
+                date=date, product_id=product_id, payment_method_type=method, status=status,
+            ).update(
+                count=F('count') + count,
+                gross=F('gross') + gross,
+                fees=F('fees') + fees,
+                net=F('net') + net,
+            )
+
+
+def record_payment_change(before, after):
+    apply_deltas(payment_deltas([(before, after)]))
+
+
+def record_status_change(payments, status):
+    """Move os pagamentos (dicts com ROLLUP_FIELDS, status antigo) para `status`"""
+    apply_deltas(payment_deltas((payment, {**payment, 'status': status}) for payment in payments))
+
+
+def rebuild_rollups(since=None, until=None):
+    """
+    Recalcula os totais a partir de Payment para os dias em [since, until)
+    (datas; None = sem limite). Retorna o número de linhas gravadas.
+    """
+    payments = Payment.objects.annotate(day=TruncDate('created_at'))
+    rollups = PaymentDailyRollup.objects.all()
+    if since:
+        payments = payments.filter(day__gte=since)
+        rollups = rollups.filter(date__gte=since)
+    if until:
+        payments = payments.filter(day__lt=until)
+        rollups = rollups.filter(date__lt=until)
+
+    money = DecimalField(max_digits=14, decimal_places=2)
+    rows = (
+        payments.order_by()
+        .values('day', 'product_id', 'payment_method_type', 'status')
+        .annotate(
+            total=Count('id'),
+            gross_sum=Sum('amount'),
+            fees_sum=Coalesce(Sum('stripe_fee'), Value(ZERO), output_field=money),
+            net_sum=Sum(Coalesce('net_amount', 'amount'), output_field=money),
+        )
+    )
+    with transaction.atomic():
+        rollups.delete()
+        created = PaymentDailyRollup.objects.bulk_create(
+            [PaymentDailyRollup(
+                date=row['day'], product_id=row['product_id'], payment_method_type=row['payment_method_type'],
+                status=row['status'], count=row['total'], gross=row['gross_sum'], fees=row['fees_sum'],
+                net=row['net_sum'],
+            ) for row in rows.iterator()],
+            batch_size=1000,
+        )
+    return len(created)
+
+
+def _money(value):
+    return str(_decimal(value).quantize(CENTS))
+
+
+def revenue_summary(since, until, statuses=('succeeded',), top=5):
+    """
+    Receita no período [since, until) (datas) a partir dos totais diários:
+    série por dia, mix de métodos, produtos mais vendidos e contagem por
+    status. O custo depende do número de dias, não de pagamentos.
+    """
+    period = PaymentDailyRollup.objects.filter(date__gte=since, date__lt=until)
+    revenue = period.filter(status__in=statuses)
+    totals = {
+        'total_count': Sum('count'), 'total_gross': Sum('gross'), 'total_fees': Sum('fees'), 'total_net': Sum('net'),
+    }
+
+    overall = revenue.aggregate(**totals)
+    daily = revenue.values('date').annotate(**totals).order_by('date')
+    methods = revenue.values('payment_method_type').annotate(**totals).order_by('-total_gross')
+    products = (
+        revenue.values('product_id', 'product__name').annotate(**totals).order_by('-total_gross', 'product_id')[:top]
+    )
+    by_status = period.values('status').annotate(total_count=Sum('count')).order_by('-total_count')
+
+    gross_total = overall['total_gross'] or ZERO
+
+    def row(values):
+        return {
+            'count': values['total_count'] or 0,
+            'gross': _money(values['total_gross']),
+            'fees': _money(values['total_fees']),
+            'net': _money(values['total_net']),
+        }
+
+    return {
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'statuses': list(statuses),
+        'totals': row(overall),
+        'daily': [{'date': item['date'].isoformat(), **row(item)} for item in daily],
+        'payment_methods': [
+            {
+                'payment_method': item['payment_method_type'],
+                **row(item),
+                'share': round(float(item['total_gross'] / gross_total), 4) if gross_total else 0,
+            }
+            for item in methods
+        ],
+        'top_products': [
+            {'product_id': item['product_id'], 'name': item['product__name'], **row(item)} for item in products
+        ],
+        'by_status': {item['status']: item['total_count'] for item in by_status},
+    }
@@ -12,7 +12,7 @@ class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = [
-            'id', 'name', 'description', 'price', 
+            'id', 'sku', 'name', 'description', 'price', 
             'stripe_product_id', 'stripe_price_id', 
             'active', 'created_at'
         ]
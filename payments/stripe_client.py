@@ -0,0 +1,236 @@
+# payments/stripe_client.py
+"""
+Cliente Stripe compartilhado.
+
+Todas as chamadas ao Stripe passam por `get_client()` (ou
+`get_async_client()` em views assíncronas), que configura uma única vez
+por processo a chave da API e um pool HTTP keep-alive compartilhado
+entre as threads do worker:
+
+    client = get_client()
+    intent = client.PaymentIntent.create(amount=1000, currency='brl')
+
+    aclient = get_async_client()
+    intent = await aclient.PaymentIntent.retrieve('pi_...')
+
+Respostas 429 (rate limit e lock_timeout) são repetidas em `call` com
+backoff exponencial com jitter, respeitando o Retry-After do Stripe,
+enquanto a espera total couber em STRIPE_RATE_LIMIT_MAX_WAIT. Cada
+operação passa por um circuit breaker (payments/circuit_breaker.py) que
+falha rápido com CircuitOpenError enquanto o Stripe estiver fora do ar.
+"""
+import importlib
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from stripe_sandbox import timing
+from stripe_sandbox.metrics import STRIPE_RETRIES, observe_stripe_call
+
+from .circuit_breaker import CircuitBreakerRegistry
+
+logger = logging.getLogger(__name__)
+
+# O stripe 7.8 deixa os subpacotes (stripe.apps, stripe.checkout, ...) como
+# None após `import stripe`, e a conversão das respostas reais falha ao
+# montar o mapa de objetos. Importá-los explicitamente corrige os atributos.
+for _namespace in ('apps', 'billing_portal', 'checkout', 'climate', 'financial_connections',
+                   'identity', 'issuing', 'radar', 'reporting', 'sigma', 'tax', 'terminal',
+                   'test_helpers', 'treasury'):
+    importlib.import_module(f'stripe.{_namespace}')
+
+_lock = threading.Lock()
+_client = None
+
+RETRYABLE_CODES = ('rate_limit', 'lock_timeout')
+
+
+def _error_code(error):
+    return getattr(error, 'code', None) or getattr(getattr(error, 'error', None), 'code', None)
+
+
+def is_rate_limited(error):
+    """429 do Stripe: rate limit da conta ou lock_timeout em um objeto concorrido"""
+    return isinstance(error, stripe.error.RateLimitError) or (
+        isinstance(error, stripe.error.StripeError) and _error_code(error) in RETRYABLE_CODES
+    )
+
+
+def retry_after(error):
+    """Retry-After (segundos) da resposta de erro do Stripe, ou None"""
+    headers = getattr(error, 'headers', None) or {}
+    value = next((value for name, value in headers.items() if name.lower() == 'retry-after'), None)
+    try:
+        return max(float(value), 0.0) if value is not None else None
+    except ValueError:
+        return None
+
+
+class _Resource:
+    """Proxy de um recurso do Stripe (Customer, PaymentIntent, ...)"""
+
+    def __init__(self, client, name):
+        self._client = client
+        self._name = name
+
+    def __getattr__(self, method):
+        operation = f'{self._name}.{method}'
+
+        def call(*args, **kwargs):
+            func = getattr(getattr(stripe, self._name), method)
+            return self._client.call(operation, func, *args, **kwargs)
+
+        call.__name__ = operation
+        return call
+
+
+class _AsyncResource(_Resource):
+    """Proxy assíncrono: a chamada HTTP roda em uma thread fora do event loop"""
+
+    def __getattr__(self, method):
+        call = super().__getattr__(method)
+        return sync_to_async(call, thread_sensitive=False)
+
+
+class StripeClient:
+    """Configuração do Stripe com pool de conexões compartilhado"""
+
+    resource_class = _Resource
+
+    def __init__(self, api_key, api_base, pool_size, connect_timeout, read_timeout, max_network_retries,
+                 rate_limit_retries=0, rate_limit_base_delay=0.5, rate_limit_max_wait=0, circuit_breaker=None):
+        self.breakers = CircuitBreakerRegistry(circuit_breaker) if circuit_breaker is not None else None
+        self.rate_limit_retries = rate_limit_retries
+        self.rate_limit_base_delay = rate_limit_base_delay
+        self.rate_limit_max_wait = rate_limit_max_wait
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.http_client = stripe.http_client.RequestsClient(
+            timeout=(connect_timeout, read_timeout),
+            session=self.session,
+        )
+
+        # A biblioteca stripe 7.x usa configuração global por processo
+        stripe.api_key = api_key
+        stripe.api_base = api_base
+        stripe.max_network_retries = max_network_retries
+        stripe.default_http_client = self.http_client
+
+    def __getattr__(self, name):
+        if not name[:1].isupper():
+            raise AttributeError(name)
+        return self.resource_class(self, name)
+
+    def call(self, operation, func, *args, **kwargs):
+        """
+        Ponto único de execução das chamadas ao Stripe (circuit breaker,
+        métricas, Server-Timing e retry de 429)
+        """
+        breaker = self.breakers.get(operation) if self.breakers else None
+        attempt, waited = 0, 0.0
+        while True:
+            if breaker:
+                breaker.before_call()
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if breaker:
+                    breaker.record(e, time.perf_counter() - started)
+                observe_stripe_call(operation, started, error=e)
+                delay = self._retry_delay(e, attempt, waited)
+                if delay is None:
+                    raise
+                reason = _error_code(e) or 'rate_limit'
+            else:
+                if breaker:
+                    breaker.record(duration=time.perf_counter() - started)
+                observe_stripe_call(operation, started)
+                return result
+            finally:
+                timing.record('stripe', started)
+
+            STRIPE_RETRIES.labels(operation, reason).inc()
+            logger.warning("%s: 429 do Stripe (%s), nova tentativa em %.2fs", operation, reason, delay)
+            time.sleep(delay)
+            attempt += 1
+            waited += delay
+
+    def _retry_delay(self, error, attempt, waited):
+        """Espera antes da próxima tentativa, ou None quando o erro não deve ser repetido"""
+        if attempt >= self.rate_limit_retries or not is_rate_limited(error):
+            return None
+        backoff = self.rate_limit_base_delay * 2 ** attempt
+        # Jitter: clientes limitados ao mesmo tempo não voltam juntos
+        delay = max(random.uniform(backoff / 2, backoff), retry_after(error) or 0.0)
+        if waited + delay > self.rate_limit_max_wait:
+            return None
+        return delay
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncStripeClient:
+    """Variante assíncrona que compartilha o pool do cliente síncrono"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        if not name[:1].isupper():
+            raise AttributeError(name)
+        return _AsyncResource(self._client, name)
+
+
+def _build_client():
+    return StripeClient(
+        api_key=settings.STRIPE_SECRET_KEY,
+        api_base=settings.STRIPE_API_BASE,
+        pool_size=settings.STRIPE_HTTP_POOL_SIZE,
+        connect_timeout=settings.STRIPE_CONNECT_TIMEOUT,
+        read_timeout=settings.STRIPE_READ_TIMEOUT,
+        max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+        rate_limit_retries=settings.STRIPE_RATE_LIMIT_RETRIES,
+        rate_limit_base_delay=settings.STRIPE_RATE_LIMIT_BASE_DELAY,
+        rate_limit_max_wait=settings.STRIPE_RATE_LIMIT_MAX_WAIT,
+        circuit_breaker=settings.STRIPE_CIRCUIT_BREAKER if settings.STRIPE_CIRCUIT_BREAKER_ENABLED else None,
+    )
+
+
+def get_client():
+    """Retorna o cliente Stripe do processo, criando-o na primeira chamada"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = _build_client()
+    return _client
+
+
+def get_async_client():
+    return AsyncStripeClient(get_client())
+
+
+def reset_client():
+    """Descarta o cliente atual (ex.: após fork ou mudança de settings)"""
+    global _client, _lock
+    # Conexões herdadas do processo pai não podem ser compartilhadas
+    _lock = threading.Lock()
+    _client = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_client)
@@ -1,3 +1,1433 @@
-from django.test import TestCase
+import io
+import json
+import logging
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import stripe
+from asgiref.sync import async_to_sync
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.template import engines
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from stripe_sandbox.db_router import PRIMARY_PIN_COOKIE, ReplicaRoutingMiddleware, use_read_replica
+from prometheus_client import REGISTRY
+
+from stripe_sandbox.log import AsyncStreamHandler, JsonFormatter, SamplingFilter
+from stripe_sandbox.metrics import start_metrics_server
+from stripe_sandbox.timing import ServerTimingMiddleware
+from stripe_sandbox.warmup import warmup_connections, warmup_imports
+
+from .benchmark import percentile
+from .catalog import get_catalog_state, get_product_or_404
+from .checkout import _submit, reserve_payment
+from .circuit_breaker import CircuitOpenError
+from .customers import get_or_create_customer_id
+from .fake_stripe import FakeStripeServer
+from .idempotency import IdempotencyError, request_fingerprint, run_idempotent
+from .intents import get_payment_intent, get_stripe_data, intent_cache_key
+from .models import (
+    IdempotencyKey, Payment, PaymentDailyRollup, Product, ProductSyncTask, StripeCustomer, SyncCursor, WebhookEvent
+)
+from .pagination import keyset_paginate
+from .reconciliation import apply_fees, reconcile_fees
+from .replay import requeue_events
+from .rollups import ROLLUP_FIELDS, record_status_change
+from .product_import import import_products
+from .product_sync import claim_sync_tasks, process_sync_tasks
+from .stripe_client import StripeClient, get_async_client, get_client, reset_client
+from .throttling import RateLimited, check_rate
+from .webhook_archive import read_segment
+from .webhooks import HANDLERS, apply_batch, claim_events, enqueue_events, process_events
+
+
+class StripeCustomerMappingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('cliente', email='cliente@example.com')
+
+    @mock.patch('stripe.Customer')
+    def test_cria_customer_uma_vez_e_reutiliza_mapeamento(self, customer_api):
+        customer_api.list.return_value = mock.Mock(data=[])
+        customer_api.create.return_value = mock.Mock(id='cus_123')
+
+        self.assertEqual(get_or_create_customer_id(self.user), 'cus_123')
+        self.assertEqual(get_or_create_customer_id(self.user), 'cus_123')
+
+        customer_api.create.assert_called_once()
+        customer_api.list.assert_not_called()
+        self.assertEqual(StripeCustomer.objects.get(user=self.user).stripe_customer_id, 'cus_123')
+
+    @override_settings(STRIPE_CUSTOMER_EMAIL_LOOKUP=True)
+    @mock.patch('stripe.Customer')
+    def test_reaproveita_customer_legado_por_email(self, customer_api):
+        customer_api.list.return_value = mock.Mock(data=[mock.Mock(id='cus_legado')])
+
+        self.assertEqual(get_or_create_customer_id(self.user), 'cus_legado')
+        customer_api.create.assert_not_called()
+
+    @mock.patch('stripe.Customer')
+    def test_backfill_mapeia_por_metadata_e_email(self, customer_api):
+        outro = User.objects.create_user('outro', email='Outro@example.com')
+        customer_api.list.return_value.auto_paging_iter.return_value = iter([
+            {'id': 'cus_meta', 'email': 'x@example.com', 'metadata': {'django_user_id': str(self.user.id)}},
+            {'id': 'cus_email', 'email': 'outro@example.com', 'metadata': {}},
+            {'id': 'cus_orfao', 'email': 'ninguem@example.com', 'metadata': {}},
+        ])
+
+        call_command('sync_stripe_customers', stdout=mock.Mock())
+
+        mapping = dict(StripeCustomer.objects.values_list('user_id', 'stripe_customer_id'))
+        self.assertEqual(mapping, {self.user.id: 'cus_meta', outro.id: 'cus_email'})
+
+
+def make_payment(user, product=None, **kwargs):
+    if product is None:
+        product = Product.objects.create(
+            name='Curso', description='Curso', price='100.00', stripe_product_id='prod_x'
+        )
+    defaults = {'stripe_payment_intent_id': 'pi_1', 'amount': product.price}
+    defaults.update(kwargs)
+    return Payment.objects.create(user=user, product=product, **defaults)
+
+
+def make_event(event_id, event_type, intent_id='pi_1'):
+    return {
+        'id': event_id,
+        'type': event_type,
+        'data': {'object': {'id': intent_id, 'object': 'payment_intent'}},
+    }
+
+
+class WebhookQueueTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('cliente', email='cliente@example.com')
+        self.payment = make_payment(self.user)
+
+    def post_event(self, event):
+        with mock.patch('payments.views.stripe.Webhook.construct_event', return_value=event):
+            return self.client.post(
+                reverse('payments:stripe_webhook'), data='{}',
+                content_type='application/json', HTTP_STRIPE_SIGNATURE='t=1,v1=x'
+            )
+
+    @override_settings(STRIPE_WEBHOOK_ASYNC=True)
+    def test_modo_assincrono_apenas_grava_evento(self):
+        event = make_event('evt_1', 'payment_intent.canceled')
+
+        self.assertEqual(self.post_event(event).status_code, 200)
+        self.assertEqual(self.post_event(event).status_code, 200)
+
+        webhook_event = WebhookEvent.objects.get()
+        self.assertEqual(webhook_event.status, 'pending')
+        self.assertEqual(webhook_event.priority, 5)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'pending')
+
+    def test_modo_sincrono_processa_na_requisicao(self):
+        self.assertEqual(self.post_event(make_event('evt_1', 'payment_intent.canceled')).status_code, 200)
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'canceled')
+        self.assertEqual(WebhookEvent.objects.get().status, 'processed')
+
+    def test_worker_processa_por_prioridade(self):
+        WebhookEvent.objects.create(stripe_event_id='evt_low', event_type='payment_intent.processing',
+                                    data=make_event('evt_low', 'x')['data'], priority=1)
+        WebhookEvent.objects.create(stripe_event_id='evt_high', event_type='payment_intent.canceled',
+                                    data=make_event('evt_high', 'x')['data'], priority=5)
+
+        groups = claim_events(batch_size=10)
+        self.assertEqual([group[0].stripe_event_id for group in groups], ['evt_high', 'evt_low'])
+        self.assertEqual(claim_events(batch_size=10), [])
+
+        # Reservas antigas voltam para a fila e o comando esvazia tudo
+        WebhookEvent.objects.update(status='pending', locked_by='')
+        call_command('process_webhooks', once=True, concurrency=1, stdout=mock.Mock())
+        self.assertFalse(WebhookEvent.objects.exclude(status='processed').exists())
+
+    def test_backfill_e_aplicado_na_ordem_do_stripe(self):
+        # Event.list devolve do mais novo para o mais antigo
+        enqueue_events([
+            {**make_event('evt_novo', 'payment_intent.succeeded'), 'created': 1_700_000_100},
+            {**make_event('evt_antigo', 'payment_intent.succeeded'), 'created': 1_700_000_000},
+        ])
+
+        events = claim_events(batch_size=10)[0]
+        self.assertEqual([event.stripe_event_id for event in events], ['evt_antigo', 'evt_novo'])
+
+    @override_settings(STRIPE_WEBHOOK_MAX_ATTEMPTS=2)
+    def test_falhas_agendam_retry_e_depois_dead_letter(self):
+        WebhookEvent.objects.create(stripe_event_id='evt_1', event_type='payment_intent.canceled',
+                                    data=make_event('evt_1', 'x')['data'])
+
+        with mock.patch('payments.webhooks.dispatch_event', side_effect=RuntimeError('boom')):
+            process_events(claim_events()[0])
+            event = WebhookEvent.objects.get()
+            self.assertEqual(event.status, 'failed')
+            self.assertGreater(event.next_attempt_at, timezone.now())
+            self.assertEqual(claim_events(), [])
+
+            WebhookEvent.objects.update(next_attempt_at=timezone.now())
+            process_events(claim_events()[0])
+
+        event = WebhookEvent.objects.get()
+        self.assertEqual(event.status, 'dead')
+        self.assertEqual(event.attempts, 2)
+        self.assertIn('boom', event.last_error)
+
+
+class WebhookTransitionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('cliente', email='cliente@example.com')
+        self.payment = make_payment(self.user)
+
+    def queue_event(self, event_id, event_type, intent_id='pi_1'):
+        return WebhookEvent.objects.create(
+            stripe_event_id=event_id, event_type=event_type,
+            data=make_event(event_id, event_type, intent_id)['data'],
+        )
+
+    def test_handlers_registrados(self):
+        self.assertIn('payment_intent.succeeded', HANDLERS)
+        self.assertIn('payment_intent.processing', HANDLERS)
+
+    def test_transicao_em_lote_tem_numero_fixo_de_queries(self):
+        make_payment(self.user, product=self.payment.product, stripe_payment_intent_id='pi_2')
+        # SELECT ... FOR UPDATE, um UPDATE dos pagamentos e um incremento por linha de totais
+        # (saída de pending e entrada em processing), mais savepoints
+        with self.assertNumQueries(9):
+            HANDLERS['payment_intent.processing']([{'id': 'pi_1'}, {'id': 'pi_2'}])
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'processing')
+
+    def test_nova_tentativa_apos_recusa_sai_de_failed(self):
+        HANDLERS['payment_intent.payment_failed']([{'id': 'pi_1'}])
+        HANDLERS['payment_intent.requires_action']([{'id': 'pi_1'}])
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'requires_action')
+
+        HANDLERS['payment_intent.payment_failed']([{'id': 'pi_1'}])
+        HANDLERS['payment_intent.processing']([{'id': 'pi_1'}])
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'processing')
+
+    def test_evento_fora_de_ordem_nao_sobrescreve_status(self):
+        HANDLERS['payment_intent.succeeded']([{'id': 'pi_1'}])
+        HANDLERS['payment_intent.processing']([{'id': 'pi_1'}])
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'succeeded')
+        self.assertIsNotNone(self.payment.paid_at)
+
+    def test_lote_do_mesmo_tipo_em_uma_transacao(self):
+        make_payment(self.user, product=self.payment.product, stripe_payment_intent_id='pi_2')
+        events = [
+            self.queue_event('evt_1', 'payment_intent.canceled', 'pi_1'),
+            self.queue_event('evt_2', 'payment_intent.canceled', 'pi_2'),
+        ]
+
+        apply_batch('payment_intent.canceled', events)
+
+        self.assertEqual(
+            set(Payment.objects.values_list('status', flat=True)), {'canceled'}
+        )
+        self.assertFalse(WebhookEvent.objects.filter(processed=False).exists())
+
+    def test_worker_agrupa_eventos_por_tipo(self):
+        self.queue_event('evt_1', 'payment_intent.canceled', 'pi_1')
+        self.queue_event('evt_2', 'payment_intent.canceled', 'pi_2')
+        self.queue_event('evt_3', 'payment_intent.processing', 'pi_3')
+
+        groups = claim_events(batch_size=10)
+
+        self.assertEqual(sorted(len(group) for group in groups), [1, 2])
+
+
+@override_settings(STRIPE_SECRET_KEY='sk_test_x', STRIPE_HTTP_POOL_SIZE=7, STRIPE_READ_TIMEOUT=9)
+class StripeClientTests(TestCase):
+    def setUp(self):
+        reset_client()
+        self.addCleanup(reset_client)
+
+    def test_cliente_unico_com_pool_compartilhado(self):
+        client = get_client()
+
+        self.assertIs(get_client(), client)
+        self.assertIs(stripe.default_http_client, client.http_client)
+        self.assertEqual(stripe.api_key, 'sk_test_x')
+        self.assertEqual(client.session.get_adapter('https://api.stripe.com')._pool_maxsize, 7)
+        self.assertEqual(client.http_client._timeout[1], 9)
+
+    @mock.patch('stripe.PaymentIntent')
+    def test_proxy_sincrono_e_assincrono(self, intent_api):
+        intent_api.retrieve.return_value = {'id': 'pi_1'}
+
+        self.assertEqual(get_client().PaymentIntent.retrieve('pi_1'), {'id': 'pi_1'})
+        result = async_to_sync(get_async_client().PaymentIntent.retrieve)('pi_1')
+
+        self.assertEqual(result, {'id': 'pi_1'})
+        self.assertEqual(intent_api.retrieve.call_count, 2)
+
+    @override_settings(STRIPE_RATE_LIMIT_RETRIES=3, STRIPE_RATE_LIMIT_BASE_DELAY=0.5, STRIPE_RATE_LIMIT_MAX_WAIT=5)
+    @mock.patch('payments.stripe_client.time.sleep')
+    @mock.patch('stripe.PaymentIntent')
+    def test_429_repetido_com_backoff_respeitando_retry_after(self, intent_api, sleep):
+        lock_timeout = stripe.error.RateLimitError('lock', headers={'Retry-After': '2'})
+        intent_api.create.side_effect = [lock_timeout, stripe.error.RateLimitError('limite'), {'id': 'pi_1'}]
+
+        self.assertEqual(get_client().PaymentIntent.create(amount=100), {'id': 'pi_1'})
+
+        first, second = (call.args[0] for call in sleep.call_args_list)
+        self.assertEqual(first, 2.0)
+        self.assertTrue(0.5 <= second <= 1.0)
+
+    @override_settings(STRIPE_RATE_LIMIT_RETRIES=3, STRIPE_RATE_LIMIT_MAX_WAIT=5)
+    @mock.patch('payments.stripe_client.time.sleep')
+    @mock.patch('stripe.PaymentIntent')
+    def test_429_desiste_quando_retry_after_excede_a_espera_maxima(self, intent_api, sleep):
+        intent_api.create.side_effect = stripe.error.RateLimitError('limite', headers={'Retry-After': '30'})
+
+        with self.assertRaises(stripe.error.RateLimitError):
+            get_client().PaymentIntent.create(amount=100)
+        self.assertEqual(intent_api.create.call_count, 1)
+        sleep.assert_not_called()
+
+    @mock.patch('payments.stripe_client.time.sleep')
+    @mock.patch('stripe.PaymentIntent')
+    def test_outros_erros_nao_sao_repetidos(self, intent_api, sleep):
+        intent_api.create.side_effect = stripe.error.CardError('recusado', 'card', 'card_declined')
+
+        with self.assertRaises(stripe.error.CardError):
+            get_client().PaymentIntent.create(amount=100)
+        self.assertEqual(intent_api.create.call_count, 1)
+
+
+@override_settings(
+    STRIPE_RATE_LIMIT_RETRIES=0,
+    STRIPE_CIRCUIT_BREAKER={'default': {'failures': 2, 'reset_timeout': 30, 'slow_call_seconds': 10}},
+)
+@mock.patch('payments.circuit_breaker.time.monotonic', return_value=1000.0)
+@mock.patch('stripe.PaymentIntent')
+class StripeCircuitBreakerTests(TestCase):
+    def setUp(self):
+        reset_client()
+        self.addCleanup(reset_client)
+
+    def retrieve(self):
+        return get_client().PaymentIntent.retrieve('pi_1')
+
+    def test_abre_apos_falhas_e_testa_com_uma_chamada_apos_o_timeout(self, intent_api, monotonic):
+        intent_api.retrieve.side_effect = stripe.error.APIConnectionError('timeout')
+        for _ in range(2):
+            with self.assertRaises(stripe.error.APIConnectionError):
+                self.retrieve()
+
+        with self.assertRaises(CircuitOpenError) as opened:
+            self.retrieve()
+        self.assertEqual(intent_api.retrieve.call_count, 2)
+        self.assertEqual(opened.exception.retry_after, 30)
+
+        monotonic.return_value = 1031.0
+        intent_api.retrieve.side_effect = None
+        intent_api.retrieve.return_value = {'id': 'pi_1'}
+        self.assertEqual(self.retrieve(), {'id': 'pi_1'})
+        self.assertEqual(
+            get_client().breakers.snapshot(), {'PaymentIntent.retrieve': {'state': 'closed', 'failures': 0}}
+        )
+
+    def test_teste_com_falha_reabre_e_erros_de_negocio_nao_contam(self, intent_api, monotonic):
+        intent_api.retrieve.side_effect = stripe.error.InvalidRequestError('não existe', 'id')
+        for _ in range(3):
+            with self.assertRaises(stripe.error.InvalidRequestError):
+                self.retrieve()
+        self.assertEqual(get_client().breakers.get('PaymentIntent.retrieve').state, 'closed')
+
+        intent_api.retrieve.side_effect = stripe.error.APIError('erro', http_status=503)
+        for _ in range(2):
+            with self.assertRaises(stripe.error.APIError):
+                self.retrieve()
+        monotonic.return_value = 1031.0
+        with self.assertRaises(stripe.error.APIError):
+            self.retrieve()
+
+        self.assertEqual(get_client().breakers.snapshot()['PaymentIntent.retrieve']['state'], 'open')
+        with self.assertRaises(CircuitOpenError):
+            self.retrieve()
+        self.assertEqual(intent_api.retrieve.call_count, 6)
+
+
+@override_settings(STRIPE_RATE_LIMITS={'customer': {'global': '4/min'}})
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.clock = mock.patch('payments.throttling.time').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def admitted(self, attempts):
+        results = []
+        for _ in range(attempts):
+            try:
+                check_rate('customer')
+                results.append(True)
+            except RateLimited:
+                results.append(False)
+        return results
+
+    def test_requisicoes_simultaneas_nao_passam_do_limite(self):
+        self.clock.time.return_value = 1_000_020.0
+        # Todas as threads leem o cache antes de qualquer uma gravar
+        barrier = threading.Barrier(20, timeout=5)
+        get_many = LocMemCache.get_many
+
+        def read_together(backend, keys, **kwargs):
+            values = get_many(backend, keys, **kwargs)
+            barrier.wait()
+            return values
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.extend(self.admitted(1))) for _ in range(20)]
+        with mock.patch.object(LocMemCache, 'get_many', read_together):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(results.count(True), 4)
+
+    def test_janela_anterior_pesa_pelo_tempo_que_ainda_cobre(self):
+        self.clock.time.return_value = 1_000_020.0
+        self.assertEqual(self.admitted(5), [True] * 4 + [False])
+
+        # Na metade da janela seguinte, as 4 anteriores ainda contam como 2
+        self.clock.time.return_value = 1_000_110.0
+        self.assertEqual(self.admitted(3), [True, True, False])
+
+
+class CheckoutPipelineTests(TestCase):
+    def test_preparacao_roda_em_outra_thread_fora_de_transacao(self):
+        with mock.patch('payments.checkout.connection') as conn:
+            conn.in_atomic_block = False
+            in_thread = _submit(lambda: threading.current_thread().name).result(timeout=5)
+            conn.in_atomic_block = True
+            inline = _submit(lambda: threading.current_thread().name).result()
+
+        self.assertTrue(in_thread.startswith('checkout'))
+        self.assertEqual(inline, threading.current_thread().name)
+
+    @mock.patch('stripe.PaymentIntent')
+    def test_falha_no_stripe_exclui_a_reserva(self, intent_api):
+        intent_api.create.side_effect = stripe.error.APIError('erro', http_status=500)
+        user = User.objects.create_user('cliente', email='cliente@example.com')
+        StripeCustomer.objects.create(user=user, stripe_customer_id='cus_1')
+        product = Product.objects.create(name='Curso', description='Curso', price='100.00', stripe_product_id='prod_x')
+        self.client.force_login(user)
+
+        response = self.client.post(
+            reverse('payments:checkout', kwargs={'product_id': product.id}),
+            '{"payment_method": "boleto"}', content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Payment.objects.exists())
+        self.assertFalse(PaymentDailyRollup.objects.exclude(count=0).exists())
+        self.assertEqual(intent_api.create.call_args.kwargs['metadata']['user_email'], 'cliente@example.com')
+
+    @mock.patch('stripe.PaymentIntent')
+    def test_checkout_cobra_o_preco_do_banco_e_nao_o_do_catalogo(self, intent_api):
+        intent_api.create.return_value = mock.Mock(id='pi_1', client_secret='s', status='requires_payment_method')
+        user = User.objects.create_user('cliente', email='cliente@example.com')
+        StripeCustomer.objects.create(user=user, stripe_customer_id='cus_1')
+        product = Product.objects.create(name='Curso', description='Curso', price='100.00', stripe_product_id='prod_x')
+        cache.clear()
+        get_product_or_404(product.pk)
+        # Outro worker alterou o preço; o catálogo em cache deste ainda tem o antigo
+        Product.objects.filter(pk=product.pk).update(price='120.00')
+        self.client.force_login(user)
+
+        response = self.client.post(
+            reverse('payments:checkout', kwargs={'product_id': product.id}),
+            '{"payment_method": "card"}', content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(intent_api.create.call_args.kwargs['amount'], 12000)
+        self.assertEqual(Payment.objects.get().amount, Decimal('120.00'))
+
+    def test_reserva_com_a_mesma_chave_e_outro_metodo_e_recusada(self):
+        user = User.objects.create_user('cliente')
+        product = Product.objects.create(name='Curso', description='Curso', price='100.00', stripe_product_id='prod_x')
+        reserve_payment(user, product, 'card', 'checkout-abc')
+
+        with self.assertRaises(IdempotencyError) as error:
+            reserve_payment(user, product, 'pix', 'checkout-abc')
+
+        self.assertEqual(error.exception.status, 422)
+        self.assertEqual(Payment.objects.get().payment_method_type, 'card')
+
+    @override_settings(IDEMPOTENCY_KEY_TTL_HOURS=24)
+    def test_reservas_sem_intent_expiradas_sao_removidas(self):
+        user = User.objects.create_user('cliente')
+        product = Product.objects.create(name='Curso', description='Curso', price='100.00', stripe_product_id='prod_x')
+        stale = reserve_payment(user, product, 'card', 'checkout-antigo')
+        recent = reserve_payment(user, product, 'card', 'checkout-recente')
+        paid = make_payment(user, product=product)
+        old = timezone.now() - timedelta(hours=25)
+        Payment.objects.filter(pk__in=[stale.pk, paid.pk]).update(created_at=old)
+        call_command('rebuild_payment_rollups', stdout=io.StringIO())
+
+        output = io.StringIO()
+        call_command('prune_idempotency_keys', stdout=output)
+
+        self.assertIn('1 reservas removidas', output.getvalue())
+        self.assertEqual(set(Payment.objects.values_list('pk', flat=True)), {recent.pk, paid.pk})
+        totals = PaymentDailyRollup.objects.filter(date=timezone.localtime(old).date()).values_list('count', flat=True)
+        self.assertEqual(sum(totals), 1)
+
+class CheckoutPoolTests(TransactionTestCase):
+    """Fora de transação de teste: o customer é resolvido em uma thread do pool"""
+
+    def setUp(self):
+        cache.clear()
+        reset_client()
+        self.addCleanup(reset_client)
+
+    @mock.patch('stripe.Customer')
+    @mock.patch('stripe.PaymentIntent')
+    def test_customer_criado_no_pool_entra_no_server_timing(self, intent_api, customer_api):
+        intent_api.create.return_value = mock.Mock(id='pi_1', client_secret='s', status='requires_payment_method')
+        threads = []
+        customer_api.create.side_effect = lambda **kwargs: (
+            threads.append(threading.current_thread().name) or mock.Mock(id='cus_novo')
+        )
+        user = User.objects.create_user('cliente', email='cliente@example.com')
+        product = Product.objects.create(name='Curso', description='Curso', price='100.00', stripe_product_id='prod_x')
+        self.client.force_login(user)
+
+        # O SQLite em memória trava a tabela entre conexões: aqui o customer
+        # só é gravado depois da reserva (no PostgreSQL as duas escritas se sobrepõem)
+        reserved = threading.Event()
+
+        def reserve(*args):
+            try:
+                return reserve_payment(*args)
+            finally:
+                reserved.set()
+
+        def create_customer(user):
+            reserved.wait(timeout=5)
+            return get_or_create_customer_id(user)
+
+        with mock.patch('payments.checkout.reserve_payment', reserve), \
+                mock.patch('payments.checkout.get_or_create_customer_id', create_customer):
+            response = self.client.post(
+                reverse('payments:checkout', kwargs={'product_id': product.id}),
+                '{"payment_method": "card"}', content_type='application/json',
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(threads[0].startswith('checkout'))
+        payment = Payment.objects.get()
+        self.assertEqual((payment.stripe_payment_intent_id, payment.stripe_customer_id), ('pi_1', 'cus_novo'))
+        self.assertEqual(StripeCustomer.objects.get(user=user).stripe_customer_id, 'cus_novo')
+        self.assertIn('stripe;dur=', response['Server-Timing'])
+        self.assertIn('desc="2 chamadas"', response['Server-Timing'])
+
+
+class ProductSyncOutboxTests(TestCase):
+    @mock.patch('stripe.Product')
+    def test_save_nao_chama_stripe_e_enfileira_sincronizacao(self, product_api):
+        product = Product.objects.create(name='Curso', description='Curso', price='100.00')
+        product.save()
+
+        product_api.create.assert_not_called()
+        self.assertEqual(ProductSyncTask.objects.filter(product=product, status='pending').count(), 1)
+
+    def test_falha_ao_enfileirar_desfaz_o_produto(self):
+        with mock.patch.object(ProductSyncTask, 'enqueue', side_effect=DatabaseError('sem outbox')), \
+                self.assertRaises(DatabaseError):
+            Product.objects.create(name='Curso', description='Curso', price='100.00')
+
+        self.assertFalse(Product.objects.exists())
+
+    @mock.patch('stripe.Price')
+    @mock.patch('stripe.Product')
+    def test_worker_cria_produto_e_preco(self, product_api, price_api):
+        product_api.create.return_value = mock.Mock(id='prod_1')
+        price_api.create.return_value = mock.Mock(id='price_1')
+        product = Product.objects.create(name='Curso', description='Curso', price='100.00')
+
+        call_command('sync_stripe_products', once=True, concurrency=1, stdout=mock.Mock())
+
+        product.refresh_from_db()
+        self.assertEqual((product.stripe_product_id, product.stripe_price_id), ('prod_1', 'price_1'))
+        self.assertFalse(product.needs_stripe_sync())
+        self.assertEqual(price_api.create.call_args.kwargs['unit_amount'], 10000)
+        self.assertEqual(ProductSyncTask.objects.get().status, 'processed')
+
+    @mock.patch('stripe.Price')
+    def test_mudanca_de_preco_cria_novo_price_e_desativa_o_anterior(self, price_api):
+        price_api.create.return_value = mock.Mock(id='price_2')
+        product = Product.objects.create(
+            name='Curso', description='Curso', price='100.00',
+            stripe_product_id='prod_1', stripe_price_id='price_1', stripe_synced_price='100.00',
+        )
+        self.assertFalse(ProductSyncTask.objects.exists())
+
+        product.price = '120.00'
+        product.save()
+        process_sync_tasks(claim_sync_tasks()[0])
+
+        product.refresh_from_db()
+        self.assertEqual(product.stripe_price_id, 'price_2')
+        price_api.modify.assert_called_once_with('price_1', active=False)
+
+    @mock.patch('stripe.Product')
+    def test_falha_agenda_nova_tentativa(self, product_api):
+        product_api.create.side_effect = stripe.error.APIConnectionError('timeout')
+        Product.objects.create(name='Curso', description='Curso', price='100.00')
+
+        process_sync_tasks(claim_sync_tasks()[0])
+
+        task = ProductSyncTask.objects.get()
+        self.assertEqual(task.status, 'failed')
+        self.assertIsNotNone(task.next_attempt_at)
+
+
+class ProductImportTests(TestCase):
+    def _csv(self, text):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / 'produtos.csv'
+        path.write_text(text, encoding='utf-8')
+        return str(path)
+
+    def test_upsert_por_sku_enfileira_so_novos_e_precos_alterados(self):
+        Product.objects.create(
+            sku='A1', name='Antigo', description='', price='10.00',
+            stripe_product_id='prod_1', stripe_price_id='price_1', stripe_synced_price='10.00',
+        )
+        Product.objects.create(
+            sku='B2', name='Curso B', description='', price='20.00',
+            stripe_product_id='prod_2', stripe_price_id='price_2', stripe_synced_price='20.00',
+        )
+        ProductSyncTask.objects.all().delete()
+        path = self._csv(
+            'sku,name,description,price,active\n'
+            'A1,Curso A,Novo nome,10.00,sim\n'
+            'B2,Curso B,,25.00,1\n'
+            'C3,Curso C,,30,0\n'
+            'D4,Sem preço,,abc,1\n'
+        )
+        out = io.StringIO()
+
+        call_command('import_products', path, chunk_size=2, no_sync=True, stdout=out, stderr=io.StringIO())
+
+        products = Product.objects.in_bulk(field_name='sku')
+        self.assertEqual(set(products), {'A1', 'B2', 'C3'})
+        self.assertEqual(products['A1'].name, 'Curso A')
+        self.assertEqual(products['B2'].price, Decimal('25.00'))
+        self.assertFalse(products['C3'].active)
+        self.assertEqual(
+            set(ProductSyncTask.objects.values_list('product__sku', flat=True)), {'B2', 'C3'}
+        )
+        self.assertIn('1 inválidas', out.getvalue())
+
+    def test_retoma_depois_da_ultima_linha_gravada(self):
+        path = self._csv('sku,name,price\nA1,Curso A,10\nB2,Curso B,20\n')
+        SyncCursor.objects.create(
+            name='import_products', state={'source': 'arquivo', 'line': 2, 'done': False},
+        )
+
+        with open(path, newline='') as stream:
+            result = import_products(stream, source='arquivo')
+
+        self.assertEqual((result.skipped, result.created), (1, 1))
+        self.assertEqual(list(Product.objects.values_list('sku', flat=True)), ['B2'])
+        self.assertTrue(SyncCursor.objects.get(name='import_products').state['done'])
+
+    @mock.patch('stripe.Price')
+    @mock.patch('stripe.Product')
+    def test_sincroniza_os_importados_com_o_stripe(self, product_api, price_api):
+        product_api.create.return_value = mock.Mock(id='prod_1')
+        price_api.create.return_value = mock.Mock(id='price_1')
+        path = self._csv('sku,name,price\nA1,Curso A,10\n')
+
+        call_command('import_products', path, concurrency=1, stdout=io.StringIO())
+
+        product = Product.objects.get(sku='A1')
+        self.assertEqual((product.stripe_product_id, product.stripe_price_id), ('prod_1', 'price_1'))
+        self.assertEqual(ProductSyncTask.objects.get().status, 'processed')
+
+
+class KeysetPaginationTests(TestCase):
+    def test_paginas_seguem_o_cursor(self):
+        user = User.objects.create_user('cliente')
+        product = make_payment(user).product
+        for i in range(2, 6):
+            make_payment(user, product=product, stripe_payment_intent_id=f'pi_{i}')
+        queryset = Payment.objects.filter(user=user)
+
+        first, cursor = keyset_paginate(queryset, page_size=3)
+        second, last_cursor = keyset_paginate(queryset, cursor=cursor, page_size=3)
+
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 2)
+        self.assertIsNone(last_cursor)
+        self.assertEqual({p.pk for p in first} | {p.pk for p in second}, set(queryset.values_list('pk', flat=True)))
+
+    def test_cursor_invalido_volta_para_o_inicio(self):
+        user = User.objects.create_user('cliente')
+        make_payment(user)
+
+        items, _ = keyset_paginate(Payment.objects.all(), cursor='lixo', page_size=10)
+        self.assertEqual(len(items), 1)
+
+
+class PaymentIntentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('cliente')
+        self.payment = make_payment(self.user)
+
+    def make_stale(self):
+        Payment.objects.filter(pk=self.payment.pk).update(updated_at=timezone.now() - timedelta(minutes=5))
+        self.payment.refresh_from_db()
+
+    @mock.patch('stripe.PaymentIntent')
+    def test_pagamento_recente_ou_final_usa_estado_local(self, intent_api):
+        self.assertIsNone(get_stripe_data(self.payment))
+
+        Payment.objects.filter(pk=self.payment.pk).update(status='succeeded')
+        self.make_stale()
+        self.assertIsNone(get_stripe_data(self.payment))
+
+        intent_api.retrieve.assert_not_called()
+
+    @mock.patch('stripe.PaymentIntent')
+    def test_pagamento_defasado_consulta_stripe_uma_vez_e_sincroniza(self, intent_api):
+        intent_api.retrieve.return_value.to_dict_recursive.return_value = {'id': 'pi_1', 'status': 'processing'}
+        self.make_stale()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            data = get_stripe_data(self.payment)
+
+        self.assertEqual(data['status'], 'processing')
+        self.assertEqual(self.payment.status, 'processing')
+        # Webhook/atualização local invalida o cache
+        self.assertIsNone(cache.get(intent_cache_key('pi_1')))
+
+    @mock.patch('stripe.PaymentIntent')
+    def test_requisicoes_simultaneas_compartilham_uma_chamada(self, intent_api):
+        def slow_retrieve(intent_id):
+            time.sleep(0.1)
+            return mock.Mock(to_dict_recursive=mock.Mock(return_value={'id': intent_id, 'status': 'processing'}))
+        intent_api.retrieve.side_effect = slow_retrieve
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(get_payment_intent('pi_1')))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 5)
+        self.assertEqual(intent_api.retrieve.call_count, 1)
+
+
+class FeeReconciliationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('cliente')
+        self.by_charge = make_payment(self.user, stripe_payment_intent_id='pi_1', stripe_charge_id='ch_1')
+        self.by_intent = make_payment(self.user, product=self.by_charge.product, stripe_payment_intent_id='pi_2')
+        self.window = (timezone.now() - timedelta(days=1), timezone.now())
+
+    def balance_transactions(self):
+        return [
+            {'id': 'txn_1', 'type': 'charge', 'fee': 399, 'net': 9601,
+             'source': {'id': 'ch_1', 'object': 'charge', 'payment_intent': 'pi_1'}},
+            {'id': 'txn_2', 'type': 'charge', 'fee': 150, 'net': 9850,
+             'source': {'id': 'ch_2', 'object': 'charge', 'payment_intent': 'pi_2'}},
+            {'id': 'txn_3', 'type': 'payout', 'fee': 0, 'net': -100, 'source': 'po_1'},
+        ]
+
+    def test_reembolso_nao_e_aplicado_como_taxa_da_cobranca(self):
+        refund = {'id': 'txn_4', 'type': 'refund', 'fee': 0, 'net': -10000,
+                  'source': {'id': 're_1', 'object': 'refund', 'payment_intent': 'pi_2'}}
+
+        self.assertEqual(apply_fees([refund]), 0)
+        self.by_intent.refresh_from_db()
+        self.assertEqual((self.by_intent.stripe_charge_id, self.by_intent.net_amount), ('', None))
+
+    @mock.patch('stripe.BalanceTransaction')
+    def test_casa_por_cobranca_ou_intent_e_atualiza_em_lote(self, balance_api):
+        balance_api.list.return_value.auto_paging_iter.return_value = iter(self.balance_transactions())
+
+        scanned, updated = reconcile_fees(*self.window, chunk_size=2)
+
+        self.assertEqual((scanned, updated), (3, 2))
+        self.by_charge.refresh_from_db()
+        self.by_intent.refresh_from_db()
+        self.assertEqual(str(self.by_charge.stripe_fee), '3.99')
+        self.assertEqual(str(self.by_intent.net_amount), '98.50')
+        self.assertEqual(self.by_intent.stripe_charge_id, 'ch_2')
+        self.assertTrue(SyncCursor.objects.get(name='reconcile_fees').state['done'])
+
+    @mock.patch('stripe.BalanceTransaction')
+    def test_retoma_do_cursor_salvo(self, balance_api):
+        def failing_iter():
+            yield from self.balance_transactions()[:2]
+            raise stripe.error.APIConnectionError('queda')
+        balance_api.list.return_value.auto_paging_iter.return_value = failing_iter()
+
+        with self.assertRaises(stripe.error.APIConnectionError):
+            reconcile_fees(*self.window, chunk_size=1)
+
+        balance_api.list.return_value.auto_paging_iter.return_value = iter(self.balance_transactions()[2:])
+        reconcile_fees(*self.window, chunk_size=1)
+        self.assertEqual(balance_api.list.call_args.kwargs['starting_after'], 'txn_2')
+
+    def test_webhook_de_sucesso_grava_cobranca_sem_chamar_stripe(self):
+        with mock.patch('stripe.BalanceTransaction') as balance_api:
+            HANDLERS['payment_intent.succeeded']([{'id': 'pi_2', 'latest_charge': 'ch_9'}])
+            balance_api.retrieve.assert_not_called()
+
+        self.by_intent.refresh_from_db()
+        self.assertEqual((self.by_intent.status, self.by_intent.stripe_charge_id), ('succeeded', 'ch_9'))
+        self.by_charge.refresh_from_db()
+        self.assertEqual(self.by_charge.stripe_charge_id, 'ch_1')
+
+
+class FakeStripeServerTests(TestCase):
+    def setUp(self):
+        self.server = FakeStripeServer(seed=1).start()
+        self.addCleanup(self.server.stop)
+        settings_override = override_settings(
+            STRIPE_API_BASE=self.server.url, STRIPE_SECRET_KEY='sk_test_fake', STRIPE_MAX_NETWORK_RETRIES=0,
+            STRIPE_RATE_LIMIT_RETRIES=0,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        reset_client()
+        self.addCleanup(reset_client)
+        cache.clear()
+
+    def test_checkout_pix_de_ponta_a_ponta(self):
+        user = User.objects.create_user('cliente', email='cliente@example.com')
+        product = Product.objects.create(
+            name='Curso', description='Curso', price='100.00',
+            stripe_product_id='prod_1', stripe_price_id='price_1', stripe_synced_price='100.00',
+        )
+        self.client.force_login(user)
+
+        response = self.client.post(
+            reverse('payments:checkout', kwargs={'product_id': product.id}),
+            '{"payment_method": "pix"}', content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['requires_action'])
+        payment = Payment.objects.get(pk=response.json()['payment_id'])
+        intent = self.server.state.get(payment.stripe_payment_intent_id)
+        self.assertEqual(intent['amount'], 10000)
+        self.assertTrue(intent['return_url'].endswith(f'/success/{payment.id}/'))
+        self.assertEqual(payment.stripe_customer_id, user.stripe_customer.stripe_customer_id)
+
+    def test_checkout_pix_em_uma_chamada_ao_stripe(self):
+        user = User.objects.create_user('cliente', email='cliente@example.com')
+        product = Product.objects.create(
+            name='Curso', description='Curso', price='100.00',
+            stripe_product_id='prod_1', stripe_price_id='price_1', stripe_synced_price='100.00',
+        )
+        self.client.force_login(user)
+        url = reverse('payments:checkout', kwargs={'product_id': product.id})
+
+        with mock.patch.object(StripeClient, 'call', autospec=True, side_effect=StripeClient.call) as call:
+            first = self.client.post(url, '{"payment_method": "pix"}', content_type='application/json')
+            operations = [args.args[1] for args in call.call_args_list]
+            second = self.client.post(url, '{"payment_method": "pix"}', content_type='application/json')
+
+        self.assertEqual(operations, ['Customer.create', 'PaymentIntent.create'])
+        self.assertEqual([args.args[1] for args in call.call_args_list[2:]], ['PaymentIntent.create'])
+        payment = Payment.objects.get(pk=second.json()['payment_id'])
+        intent = self.server.state.get(payment.stripe_payment_intent_id)
+        self.assertEqual(intent['status'], 'requires_action')
+        self.assertEqual(intent['metadata']['payment_id'], str(payment.id))
+        self.assertTrue(intent['return_url'].endswith(f'/success/{payment.id}/'))
+        self.assertNotEqual(first.json()['payment_id'], payment.id)
+
+    def test_idempotency_key_repete_a_resposta(self):
+        first = get_client().Customer.create(email='a@example.com', idempotency_key='k1')
+        second = get_client().Customer.create(email='a@example.com', idempotency_key='k1')
+
+        self.assertEqual(first.id, second.id)
+        self.assertEqual(len(self.server.state.of_type('customer')), 1)
+
+    def test_rate_limit_e_erros_simulados(self):
+        self.server.rate_limit_rate = 1.0
+        with self.assertRaises(stripe.error.RateLimitError):
+            get_client().Customer.list(limit=1)
+
+        self.server.rate_limit_rate, self.server.error_rate = 0.0, 1.0
+        with self.assertRaises(stripe.error.APIError):
+            get_client().Customer.list(limit=1)
+
+    def test_reconciliacao_contra_o_servidor_fake(self):
+        payment = make_payment(User.objects.create_user('cliente'), stripe_payment_intent_id='pi_1')
+        self.server.add_balance_transaction('ch_1', 'pi_1', amount=10000, fee=399)
+
+        scanned, updated = reconcile_fees(timezone.now() - timedelta(days=1), timezone.now() + timedelta(minutes=1))
+
+        self.assertEqual((scanned, updated), (1, 1))
+        payment.refresh_from_db()
+        self.assertEqual((payment.stripe_charge_id, str(payment.stripe_fee)), ('ch_1', '3.99'))
+
+    def test_percentis(self):
+        values = sorted(range(1, 101))
+        self.assertEqual((percentile(values, 50), percentile(values, 95), percentile(values, 99)), (50, 95, 99))
+        self.assertEqual(percentile([], 99), 0.0)
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('cliente', email='cliente@example.com')
+        StripeCustomer.objects.create(user=self.user, stripe_customer_id='cus_1')
+        self.product = Product.objects.create(
+            name='Curso', description='Curso', price='100.00',
+            stripe_product_id='prod_1', stripe_price_id='price_1', stripe_synced_price='100.00',
+        )
+        self.client.force_login(self.user)
+        self.url = reverse('payments:checkout', kwargs={'product_id': self.product.id})
+
+    def post(self, body='{"payment_method": "card"}', key='chave-1'):
+        return self.client.post(self.url, body, content_type='application/json', HTTP_IDEMPOTENCY_KEY=key)
+
+    @mock.patch('stripe.PaymentIntent')
+    def test_repeticao_devolve_a_resposta_gravada(self, intent_api):
+        intent_api.create.return_value = mock.Mock(
+            id='pi_1', client_secret='pi_1_secret', status='requires_payment_method'
+        )
+
+        first = self.post()
+        second = self.post()
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(intent_api.create.call_count, 1)
+        self.assertTrue(intent_api.create.call_args.kwargs['idempotency_key'].startswith('checkout-'))
+        self.assertEqual(Payment.objects.count(), 1)
+
+    @mock.patch('stripe.PaymentIntent')
+    def test_corpo_json_que_nao_e_objeto_e_rejeitado(self, intent_api):
+        for body in ('[]', '"x"', '1'):
+            response = self.post(body)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {'error': 'JSON inválido'})
+        intent_api.create.assert_not_called()
+
+    @mock.patch('stripe.PaymentIntent')
+    def test_mesma_chave_com_outro_corpo_e_rejeitada(self, intent_api):
+        intent_api.create.return_value = mock.Mock(id='pi_1', client_secret='s', status='requires_payment_method')
+        self.post()
+
+        response = self.post('{"payment_method": "boleto"}')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(intent_api.create.call_count, 1)
+
+    @mock.patch('stripe.PaymentIntent')
+    def test_erro_libera_a_chave_para_nova_tentativa(self, intent_api):
+        intent_api.create.side_effect = [
+            stripe.error.APIConnectionError('queda'),
+            mock.Mock(id='pi_1', client_secret='s', status='requires_payment_method'),
+        ]
+
+        self.assertEqual(self.post().status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.post().status_code, 200)
+        keys = [call.kwargs['idempotency_key'] for call in intent_api.create.call_args_list]
+        self.assertEqual(keys[0], keys[1])
+        # A retomada reaproveita a reserva: mesmos parâmetros para o Stripe
+        first, second = intent_api.create.call_args_list
+        self.assertEqual(first.kwargs, second.kwargs)
+        payment = Payment.objects.get()
+        self.assertEqual((payment.stripe_payment_intent_id, payment.status), ('pi_1', 'pending'))
+
+    def test_duplicata_em_andamento_aguarda_a_original(self):
+        data = {'product_id': self.product.id, 'payment_method': 'card'}
+        record = IdempotencyKey.objects.create(
+            user=self.user, scope='checkout', key='chave-1',
+            request_hash=request_fingerprint(data), locked_at=timezone.now(),
+        )
+
+        def original_completes(seconds):
+            IdempotencyKey.objects.filter(pk=record.pk).update(
+                status='completed', response_status=200, response_body={'payment_id': 7}
+            )
+
+        func = mock.Mock()
+        with mock.patch('payments.idempotency.time.sleep', side_effect=original_completes):
+            result = run_idempotent(self.user, 'checkout', 'chave-1', data, func)
+
+        self.assertEqual(result, (200, {'payment_id': 7}, True))
+        func.assert_not_called()
+
+    @override_settings(IDEMPOTENCY_LOCK_TIMEOUT_SECONDS=60)
+    def test_chave_presa_de_requisicao_morta_e_retomada(self):
+        data = {'product_id': self.product.id, 'payment_method': 'card'}
+        IdempotencyKey.objects.create(
+            user=self.user, scope='checkout', key='chave-1', request_hash=request_fingerprint(data),
+            locked_at=timezone.now() - timedelta(minutes=5),
+        )
+
+        result = run_idempotent(self.user, 'checkout', 'chave-1', data, lambda stripe_key: (200, {'ok': True}))
+
+        self.assertEqual(result, (200, {'ok': True}, False))
+        self.assertEqual(IdempotencyKey.objects.get().status, 'completed')
+
+
+@override_settings(DATABASE_READ_REPLICA='replica')
+class ReplicaRoutingTests(TestCase):
+    def route(self, view, method='get', cookies=None):
+        """Roda a view pelo middleware e devolve os aliases usados nas leituras"""
+        seen = []
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return view(request, seen)
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        request = getattr(RequestFactory(), method)('/')
+        request.COOKIES.update(cookies or {})
+        return middleware(request), seen
+
+    def test_view_de_leitura_usa_a_replica(self):
+        @use_read_replica
+        def view(request, seen):
+            seen.append(Product.objects.all().db)
+            seen.append(User.objects.all().db)
+            return HttpResponse()
+
+        response, seen = self.route(view)
+
+        self.assertEqual(seen, ['replica', 'default'])
+        self.assertNotIn(PRIMARY_PIN_COOKIE, response.cookies)
+
+    def test_leituras_apos_escrita_vao_para_o_primario(self):
+        @use_read_replica
+        def view(request, seen):
+            seen.append(Product.objects.all().db)
+            Product.objects.create(name='Curso', description='Curso', price='10.00')
+            seen.append(Product.objects.all().db)
+            return HttpResponse()
+
+        response, seen = self.route(view)
+
+        self.assertEqual(seen, ['replica', 'default'])
+        self.assertIn(PRIMARY_PIN_COOKIE, response.cookies)
+
+    def test_post_views_nao_marcadas_e_cliente_fixado_usam_o_primario(self):
+        def unmarked(request, seen):
+            seen.append(Product.objects.all().db)
+            return HttpResponse()
+
+        self.assertEqual(self.route(unmarked)[1], ['default'])
+        self.assertEqual(self.route(use_read_replica(unmarked), method='post')[1], ['default'])
+        self.assertEqual(self.route(use_read_replica(unmarked), cookies={PRIMARY_PIN_COOKIE: '1'})[1], ['default'])
+        # Fora de uma requisição, nada vai para a réplica
+        self.assertEqual(Product.objects.all().db, 'default')
+
+
+class StructuredLoggingTests(TestCase):
+    def make_record(self, level=logging.INFO, msg='Checkout %s em %.0f ms', args=('card', 12.3), **extra):
+        record = logging.LogRecord('payments.views', level, __file__, 1, msg, args, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_json_com_campos_extra_e_formatacao_adiada(self):
+        line = JsonFormatter().format(self.make_record(payment_id=7))
+        data = json.loads(line)
+
+        self.assertEqual(data['message'], 'Checkout card em 12 ms')
+        self.assertEqual((data['level'], data['logger'], data['payment_id']), ('INFO', 'payments.views', 7))
+
+    def test_amostragem_nao_descarta_avisos(self):
+        sampler = SamplingFilter(rate=0)
+
+        self.assertFalse(sampler.filter(self.make_record()))
+        self.assertTrue(sampler.filter(self.make_record(level=logging.WARNING)))
+
+    def test_handler_assincrono_escreve_na_thread_e_conta_descartes(self):
+        stream = io.StringIO()
+        handler = AsyncStreamHandler(stream=stream, maxsize=1)
+        handler.setFormatter(JsonFormatter())
+        handler.listener.stop()  # fila parada para forçar o descarte
+
+        handler.handle(self.make_record())
+        handler.handle(self.make_record())
+        self.assertEqual(handler.dropped, 1)
+        handler._start_listener()
+        handler.flush_and_stop()
+        handler._start_listener()
+        handler.handle(self.make_record(msg='depois', args=()))
+        handler.flush_and_stop()
+
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([line['message'] for line in lines], ['Checkout card em 12 ms', 'depois'])
+        self.assertEqual(lines[1]['dropped_logs'], 1)
+
+    @mock.patch('stripe.PaymentIntent')
+    def test_checkout_gera_uma_linha_de_resumo(self, intent_api):
+        intent_api.create.return_value = mock.Mock(id='pi_1', client_secret='s', status='requires_payment_method')
+        user = User.objects.create_user('cliente', email='cliente@example.com')
+        StripeCustomer.objects.create(user=user, stripe_customer_id='cus_1')
+        product = Product.objects.create(
+            name='Curso', description='Curso', price='100.00',
+            stripe_product_id='prod_1', stripe_price_id='price_1', stripe_synced_price='100.00',
+        )
+        self.client.force_login(user)
+
+        with self.assertLogs('payments', 'INFO') as logs:
+            self.client.post(
+                reverse('payments:checkout', kwargs={'product_id': product.id}),
+                '{"payment_method": "boleto"}', content_type='application/json',
+            )
+
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual((logs.records[0].event, logs.records[0].intent_id), ('checkout', 'pi_1'))
+
+
+def metric(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        reset_client()
+        self.addCleanup(reset_client)
+        self.user = User.objects.create_user('cliente', email='cliente@example.com')
+        self.payment = make_payment(self.user)
+
+    @mock.patch('stripe.Customer')
+    def test_chamadas_ao_stripe_por_operacao_e_resultado(self, customer_api):
+        ok = metric('stripe_api_calls_total', operation='Customer.list', outcome='ok')
+        errors = metric('stripe_api_errors_total', operation='Customer.list', error='APIConnectionError')
+        customer_api.list.side_effect = [{'data': []}, stripe.error.APIConnectionError('rede')]
+
+        get_client().Customer.list(limit=1)
+        with self.assertRaises(stripe.error.APIConnectionError):
+            get_client().Customer.list(limit=1)
+
+        self.assertEqual(metric('stripe_api_calls_total', operation='Customer.list', outcome='ok'), ok + 1)
+        self.assertEqual(
+            metric('stripe_api_errors_total', operation='Customer.list', error='APIConnectionError'), errors + 1
+        )
+
+    def test_webhook_registra_resultado_e_atraso(self):
+        event = make_event('evt_1', 'payment_intent.canceled')
+        event['created'] = int(time.time()) - 30
+        processed = metric('stripe_webhook_events_total', event_type='payment_intent.canceled', outcome='processed')
+        lag = metric('stripe_webhook_lag_seconds_sum', event_type='payment_intent.canceled')
+
+        with mock.patch('payments.views.stripe.Webhook.construct_event', return_value=event):
+            self.client.post(reverse('payments:stripe_webhook'), data='{}',
+                             content_type='application/json', HTTP_STRIPE_SIGNATURE='t=1,v1=x')
+
+        self.assertEqual(
+            metric('stripe_webhook_events_total', event_type='payment_intent.canceled', outcome='processed'),
+            processed + 1,
+        )
+        self.assertGreaterEqual(metric('stripe_webhook_lag_seconds_sum', event_type='payment_intent.canceled'), lag + 30)
+
+    def test_endpoint_expoe_views_e_fila_de_webhooks(self):
+        WebhookEvent.objects.create(stripe_event_id='evt_1', event_type='payment_intent.canceled',
+                                    data=make_event('evt_1', 'x')['data'])
+        self.client.get(reverse('metrics'))
+
+        body = self.client.get(reverse('metrics')).content.decode()
+
+        self.assertIn('django_http_requests_total{method="GET",status="200",view="metrics"}', body)
+        self.assertIn('stripe_webhook_backlog{status="pending"} 1.0', body)
+
+    @override_settings(METRICS_TOKEN='segredo')
+    def test_endpoint_exige_token_quando_configurado(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer segredo')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_TOKEN='', METRICS_REQUIRE_TOKEN=True)
+    def test_sem_token_em_producao_o_endpoint_fica_bloqueado(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+    @override_settings(METRICS_TOKEN='segredo')
+    def test_servidor_do_worker_expoe_as_metricas_de_webhooks(self):
+        server = start_metrics_server(0, addr='127.0.0.1')
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f'http://127.0.0.1:{server.server_port}/metrics'
+
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(url, timeout=5)
+        request = urllib.request.Request(url, headers={'Authorization': 'Bearer segredo'})
+        with urllib.request.urlopen(request, timeout=5) as response:
+            body = response.read().decode()
+
+        self.assertEqual(error.exception.code, 403)
+        self.assertIn('stripe_webhook_events_total', body)
+
+
+class ServerTimingTests(TestCase):
+    def setUp(self):
+        reset_client()
+        self.addCleanup(reset_client)
+
+    def view(self, request):
+        list(Product.objects.all())
+        get_client().PaymentIntent.retrieve('pi_1')
+        return HttpResponse(engines['django'].from_string('<p>{{ total }}</p>').render({'total': 1}))
+
+    @mock.patch('stripe.PaymentIntent')
+    def test_cabecalho_separa_banco_stripe_e_render(self, intent_api):
+        response = ServerTimingMiddleware(self.view)(RequestFactory().get('/'))
+
+        header = response['Server-Timing']
+        self.assertRegex(header, r'db;dur=[\d.]+;desc="1 consultas"')
+        self.assertRegex(header, r'stripe;dur=[\d.]+;desc="1 chamadas"')
+        self.assertRegex(header, r'render;dur=[\d.]+, total;dur=[\d.]+$')
+
+    @override_settings(SLOW_REQUEST_MS=0, SERVER_TIMING_FOOTER=True)
+    @mock.patch('stripe.PaymentIntent')
+    def test_requisicao_lenta_vai_para_o_log_e_rodape_html(self, intent_api):
+        with self.assertLogs('stripe_sandbox.timing', 'WARNING') as logs:
+            response = ServerTimingMiddleware(self.view)(RequestFactory().get('/checkout/'))
+
+        record = logs.records[0]
+        self.assertEqual((record.event, record.db_count, record.stripe_count), ('slow_request', 1, 1))
+        footer = json.loads(response.content.decode().split('<!-- server-timing ')[1].split(' -->')[0])
+        self.assertEqual(footer['stripe_count'], 1)
+
+    @override_settings(SLOW_REQUEST_MS=60000, SERVER_TIMING_LOG_SAMPLE_RATE=0)
+    def test_requisicao_rapida_fora_da_amostra_nao_loga(self):
+        with self.assertNoLogs('stripe_sandbox.timing'):
+            ServerTimingMiddleware(lambda request: HttpResponse('ok'))(RequestFactory().get('/'))
+
+
+class WebhookRetentionTests(TestCase):
+    def post_event(self, event):
+        with mock.patch('payments.views.stripe.Webhook.construct_event', return_value=event):
+            return self.client.post(
+                reverse('payments:stripe_webhook'), data='{}',
+                content_type='application/json', HTTP_STRIPE_SIGNATURE='t=1,v1=x'
+            )
+
+    def test_evento_sem_handler_grava_apenas_referencia(self):
+        event = make_event('evt_1', 'customer.updated')
+        event['data']['object'].update(object='customer', email='cliente@example.com', metadata={'x': '1' * 500})
+
+        self.assertEqual(self.post_event(event).status_code, 200)
+
+        webhook_event = WebhookEvent.objects.get()
+        self.assertEqual(webhook_event.data, {'object': {'id': 'pi_1', 'object': 'customer'}})
+        self.assertEqual((webhook_event.processed, webhook_event.status), (True, 'processed'))
+        self.assertEqual(claim_events(), [])
+
+    @override_settings(STRIPE_WEBHOOK_UNHANDLED_STORAGE='none', STRIPE_WEBHOOK_ASYNC=True)
+    def test_evento_sem_handler_pode_nao_ser_gravado(self):
+        self.assertEqual(self.post_event(make_event('evt_1', 'customer.updated')).status_code, 200)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_arquivamento_move_processados_antigos_para_ndjson(self):
+        def create(event_id, processed, days_ago):
+            event = WebhookEvent.objects.create(stripe_event_id=event_id, event_type='payment_intent.canceled',
+                                                data=make_event(event_id, 'x')['data'], processed=processed)
+            WebhookEvent.objects.filter(id=event.id).update(created_at=timezone.now() - timedelta(days=days_ago))
+
+        for index in range(3):
+            create(f'evt_old_{index}', True, 40)
+        create('evt_recent', True, 1)
+        create('evt_pending', False, 40)
+
+        with tempfile.TemporaryDirectory() as directory:
+            call_command('archive_webhook_events', days=30, output_dir=directory, segment_size=2, stdout=io.StringIO())
+
+            segments = sorted(Path(directory).glob('*.ndjson.gz'))
+            archived = [row['stripe_event_id'] for path in segments for row in read_segment(path)]
+
+        self.assertEqual(len(segments), 2)
+        self.assertEqual(archived, ['evt_old_0', 'evt_old_1', 'evt_old_2'])
+        self.assertEqual(
+            set(WebhookEvent.objects.values_list('stripe_event_id', flat=True)), {'evt_recent', 'evt_pending'}
+        )
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_admin_nao_carrega_payload_na_listagem(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'senha')
+        self.client.force_login(admin_user)
+        event = WebhookEvent.objects.create(stripe_event_id='evt_1', event_type='payment_intent.canceled',
+                                            data=make_event('evt_1', 'x')['data'])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('admin:payments_webhookevent_changelist')).status_code, 200)
+        self.assertFalse(any('"data"' in query['sql'] for query in queries if 'payments_webhookevent' in query['sql']))
+
+        response = self.client.get(reverse('admin:payments_webhookevent_change', args=[event.id]))
+        self.assertContains(response, 'pi_1')
+
+
+class EventReplayTests(TestCase):
+    def setUp(self):
+        reset_client()
+        self.addCleanup(reset_client)
+        self.user = User.objects.create_user('cliente', email='cliente@example.com')
+        self.payment = make_payment(self.user)
+        make_payment(self.user, product=self.payment.product, stripe_payment_intent_id='pi_2')
+
+    def stripe_event(self, event_id, event_type, intent_id, created):
+        return {**make_event(event_id, event_type, intent_id), 'created': created}
+
+    @mock.patch('stripe.Event')
+    def test_backfill_pula_eventos_conhecidos_e_processa_os_demais(self, event_api):
+        now = int(time.time())
+        WebhookEvent.objects.create(stripe_event_id='evt_2', event_type='payment_intent.canceled',
+                                    data=make_event('evt_2', 'x', 'pi_2')['data'], processed=True, status='processed')
+        event_api.list.side_effect = [
+            {'data': [self.stripe_event('evt_3', 'payment_intent.succeeded', 'pi_1', now),
+                      self.stripe_event('evt_2', 'payment_intent.canceled', 'pi_2', now - 10)], 'has_more': True},
+            {'data': [self.stripe_event('evt_1', 'payment_intent.processing', 'pi_1', now - 20)], 'has_more': False},
+        ]
+
+        call_command('replay_stripe_events', since='2026-01-01', concurrency=1, stdout=io.StringIO())
+
+        self.assertEqual(event_api.list.call_args_list[1].kwargs['starting_after'], 'evt_2')
+        self.assertIn('payment_intent.succeeded', event_api.list.call_args_list[0].kwargs['types'])
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'succeeded')
+        self.assertEqual(WebhookEvent.objects.filter(processed=True).count(), 3)
+        self.assertEqual(Payment.objects.get(stripe_payment_intent_id='pi_2').status, 'pending')
+
+    def test_retry_failed_reprocessa_falhas_sem_consultar_o_stripe(self):
+        WebhookEvent.objects.create(stripe_event_id='evt_1', event_type='payment_intent.canceled',
+                                    data=make_event('evt_1', 'x')['data'], status='dead', attempts=8,
+                                    last_error='boom')
+
+        call_command('replay_stripe_events', retry_failed=True, no_fetch=True, concurrency=1, stdout=io.StringIO())
+
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts, event.last_error), ('processed', 1, ''))
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'canceled')
+
+    @override_settings(STRIPE_WEBHOOK_LOCK_TIMEOUT_SECONDS=300)
+    def test_requeue_nao_tira_evento_de_um_worker_vivo(self):
+        data = make_event('evt_1', 'x')['data']
+        fresh = WebhookEvent.objects.create(stripe_event_id='evt_1', event_type='payment_intent.canceled', data=data,
+                                            status='processing', locked_by='worker-1', locked_at=timezone.now())
+        stale = WebhookEvent.objects.create(stripe_event_id='evt_2', event_type='payment_intent.canceled', data=data,
+                                            status='processing', locked_by='worker-2',
+                                            locked_at=timezone.now() - timedelta(minutes=10))
+
+        self.assertEqual(requeue_events(WebhookEvent.objects.all()), 1)
+
+        fresh.refresh_from_db()
+        stale.refresh_from_db()
+        self.assertEqual((fresh.status, fresh.locked_by), ('processing', 'worker-1'))
+        self.assertEqual((stale.status, stale.locked_by), ('pending', ''))
+
+
+class PaymentExportCommandTests(TestCase):
+    def test_comando_grava_arquivo_em_blocos(self):
+        user = User.objects.create_user('cliente', email='cliente@example.com')
+        payment = make_payment(user)
+        for i in range(2, 6):
+            make_payment(user, product=payment.product, stripe_payment_intent_id=f'pi_{i}')
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'payments.ndjson'
+            call_command('export_payments', fmt='ndjson', chunk_size=2, output=str(path), stderr=io.StringIO())
+            lines = path.read_text().splitlines()
+
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[0])['username'], 'cliente')
+
+
+class PaymentRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('cliente', email='cliente@example.com')
+        self.payment = make_payment(self.user, stripe_charge_id='ch_1')
+        make_payment(self.user, product=self.payment.product, stripe_payment_intent_id='pi_2', payment_method_type='pix')
+
+    def rollups(self):
+        return {
+            (row.payment_method_type, row.status): (row.count, row.gross, row.fees, row.net)
+            for row in PaymentDailyRollup.objects.exclude(count=0)
+        }
+
+    def test_transicoes_e_taxas_atualizam_os_totais(self):
+        HANDLERS['payment_intent.succeeded']([{'id': 'pi_1'}, {'id': 'pi_2'}])
+        apply_fees([{'type': 'charge', 'source': 'ch_1', 'fee': 399, 'net': 9601}])
+
+        self.assertEqual(self.rollups(), {
+            ('card', 'succeeded'): (1, Decimal('100.00'), Decimal('3.99'), Decimal('96.01')),
+            ('pix', 'succeeded'): (1, Decimal('100.00'), Decimal('0.00'), Decimal('100.00')),
+        })
+
+    def test_totais_incrementais_batem_com_a_reconstrucao(self):
+        HANDLERS['payment_intent.processing']([{'id': 'pi_1'}])
+        HANDLERS['payment_intent.canceled']([{'id': 'pi_2'}])
+        self.payment.status = 'failed'
+        self.payment.save()
+        incremental = self.rollups()
+
+        call_command('rebuild_payment_rollups', stdout=io.StringIO())
+
+        self.assertEqual(self.rollups(), incremental)
+        self.assertEqual(set(incremental), {('card', 'failed'), ('pix', 'canceled')})
+
+    def test_linhas_de_totais_sao_atualizadas_na_ordem_das_chaves(self):
+        payments = list(Payment.objects.order_by('-payment_method_type').values(*ROLLUP_FIELDS))
+        manager = PaymentDailyRollup.objects
+        with mock.patch.object(manager, 'filter', wraps=manager.filter) as rollup_filter:
+            record_status_change(payments, 'processing')
+
+        updated = [(call.kwargs['payment_method_type'], call.kwargs['status']) for call in rollup_filter.call_args_list]
+        self.assertEqual(updated, [
+            ('card', 'pending'), ('card', 'processing'), ('pix', 'pending'), ('pix', 'processing'),
+        ])
+
+
+@override_settings(WARMUP_STRIPE_CONNECT=False)
+class WarmupTests(TestCase):
+    def test_warmup_nao_falha_e_carrega_o_catalogo(self):
+        cache.clear()
+        with self.assertNoLogs('stripe_sandbox.warmup', level='WARNING'):
+            warmup_imports()
+            warmup_connections()
+
+        version, _ = get_catalog_state()
+        self.assertIsNotNone(cache.get(f'catalog:v{version}'))
+
+    def test_falha_em_uma_etapa_nao_interrompe_o_warmup(self):
+        with mock.patch('payments.catalog.get_catalog', side_effect=RuntimeError('sem banco')), \
+                self.assertLogs('stripe_sandbox.warmup', level='WARNING') as logs:
+            warmup_connections()
+
+        self.assertIn('catálogo falhou: sem banco', logs.output[0])
@@ -0,0 +1,135 @@
+# payments/throttling.py
+"""
+Limites de taxa para as rotas que chamam o Stripe (criação de
+PaymentIntents e de customers), para que um cliente com defeito ou um pico
+de vendas não esgote o rate limit da conta do Stripe para todos.
+
+Cada escopo tem um limite por usuário e/ou um global, definidos em
+STRIPE_RATE_LIMITS no formato 'N/período' (s, min, h). A contagem é por
+janela deslizante: um contador por janela fixa no cache, incrementado com
+cache.incr (atômico no Redis, compartilhado por todos os workers), e a
+janela anterior pesa proporcionalmente ao tempo que ainda cobre.
+
+Os limites da requisição são consumidos em ordem; quando um deles estoura,
+os incrementos já feitos são desfeitos, e quem estoura o próprio limite não
+gasta a cota global dos demais. Sob concorrência a contagem nunca admite
+requisições a mais; um incremento prestes a ser desfeito pode, no máximo,
+recusar outra requisição no limite exato.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+
+from stripe_sandbox.metrics import RATE_LIMITED
+
+PERIODS = {'s': 1, 'sec': 1, 'min': 60, 'm': 60, 'h': 3600, 'hour': 3600}
+
+
+class RateLimited(Exception):
+    """Requisição recusada por limite de taxa; `retry_after` em segundos"""
+
+    def __init__(self, scope, retry_after):
+        super().__init__(f'Limite de requisições excedido ({scope}); tente novamente em {math.ceil(retry_after)}s')
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+def parse_rate(rate):
+    """'10/min' -> (10, 60)"""
+    count, _, period = rate.partition('/')
+    return int(count), PERIODS[period.strip().lower()]
+
+
+class RateWindow:
+    def __init__(self, name, rate):
+        self.name = name
+        self.limit, self.period = parse_rate(rate)
+        # A janela atual ainda é lida como anterior durante o período seguinte
+        self.timeout = 2 * self.period + 1
+
+    def key(self, now, offset=0):
+        """Chave do contador da janela de `now` (offset=-1: a anterior)"""
+        return f'ratelimit:{self.name}:{int(now // self.period) + offset}'
+
+    def retry_after(self, previous, count, elapsed):
+        """Segundos até a estimativa, com esta requisição, voltar a caber no limite"""
+        if count <= self.limit:
+            # Basta a janela anterior pesar menos
+            fraction = 1 - (self.limit - count) / previous - elapsed
+        else:
+            # Na próxima janela a atual (sem esta requisição) passa a ser a anterior
+            fraction = 1 - elapsed + max(0.0, 1 - (self.limit - 1) / (count - 1))
+        # Em milissegundos, para o arredondamento do Retry-After não subir um segundo
+        return max(round(fraction * self.period, 3), 0.001)
+
+    def acquire(self, now, previous):
+        """
+        Conta a requisição na janela atual (`previous`: contagem da janela
+        anterior). Retorna 0 ou, se o limite estourou, a espera em segundos,
+        já com o incremento desfeito.
+        """
+        elapsed = now / self.period % 1
+        count = _incr(self.key(now), self.timeout)
+        if previous * (1 - elapsed) + count <= self.limit:
+            return 0.0
+        self.release(now)
+        return self.retry_after(previous, count, elapsed)
+
+    def release(self, now):
+        """Desfaz o incremento na janela atual"""
+        try:
+            cache.decr(self.key(now))
+        except ValueError:
+            pass
+
+
+def _incr(key, timeout):
+    """Incremento atômico; cria o contador (com expiração) se ainda não existe"""
+    for _ in range(2):
+        if cache.add(key, 1, timeout=timeout):
+            return 1
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # Expirou entre o add e o incr
+            continue
+    return cache.incr(key)
+
+
+def _buckets(scope, user=None):
+    limits = settings.STRIPE_RATE_LIMITS.get(scope) or {}
+    buckets = []
+    if limits.get('user') and user is not None and user.is_authenticated:
+        buckets.append(('user', RateWindow(f'{scope}:user:{user.pk}', limits['user'])))
+    if limits.get('global'):
+        buckets.append(('global', RateWindow(f'{scope}:global', limits['global'])))
+    return buckets
+
+
+def check_rate(scope, user=None):
+    """Conta a requisição em cada limite do escopo ou levanta RateLimited"""
+    buckets = _buckets(scope, user)
+    if not buckets:
+        return
+
+    now = time.time()
+    previous = cache.get_many([bucket.key(now, -1) for _, bucket in buckets])
+    acquired = []
+    for kind, bucket in buckets:
+        wait = bucket.acquire(now, previous.get(bucket.key(now, -1), 0))
+        if wait:
+            for other in acquired:
+                other.release(now)
+            RATE_LIMITED.labels(scope, kind).inc()
+            raise RateLimited(scope, wait)
+        acquired.append(bucket)
+
+
+def rate_limited_response(error):
+    """Resposta 429 com Retry-After para views que não usam o DRF"""
+    response = JsonResponse({'error': str(error), 'retry_after': math.ceil(error.retry_after)}, status=429)
+    response['Retry-After'] = str(math.ceil(error.retry_after))
+    return response
@@ -2,7 +2,7 @@
 import stripe
 import json
 import logging
-from decimal import Decimal
+import time
 from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
@@ -12,15 +12,27 @@ from django.http import JsonResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST, require_http_methods
 from django.contrib import messages
-from django.utils import timezone
-from .models import Product, Payment, WebhookEvent
+from .models import Payment, Product
+from .checkout import create_checkout
+from .webhooks import enqueue_event, is_handled, record_event, process_event, store_unhandled_event
+from .stripe_client import retry_after
+from .throttling import RateLimited, check_rate, rate_limited_response
+from .circuit_breaker import CircuitOpenError, circuit_open_response
+from .catalog import get_active_products, get_product_or_404
+from .pagination import keyset_paginate
+from .intents import get_stripe_data
+from stripe_sandbox.db_router import use_read_replica
+from stripe_sandbox.metrics import WEBHOOK_EVENTS
+from .idempotency import IdempotencyError, run_idempotent
 
 logger = logging.getLogger(__name__)
-stripe.api_key = settings.STRIPE_SECRET_KEY
 
+HISTORY_PAGE_SIZE = 20
+
+@use_read_replica
 def index(request):
     """Página inicial com produtos"""
-    products = Product.objects.filter(active=True)
+    products = get_active_products()
     return render(request, 'payments/index.html', {'products': products})
 
 def auto_login(request):
@@ -42,162 +54,101 @@ def auto_login(request):
     messages.success(request, f'Login automático como {user.username}')
     return redirect('payments:index')
 
+@use_read_replica
 @login_required
 def product_detail(request, pk):
     """Detalhes do produto"""
-    product = get_object_or_404(Product, pk=pk, active=True)
+    product = get_product_or_404(pk)
     return render(request, 'payments/product_detail.html', {'product': product})
 
+def _create_checkout_payment(request, product, data, stripe_idempotency_key=None):
+    """Cria o PaymentIntent e o Payment do checkout; retorna (status, payload)"""
+    started = time.perf_counter()
+    payment_method = data.get('payment_method', 'card')
+    if payment_method not in ('pix', 'boleto'):
+        payment_method = 'card'  # Método desconhecido segue como cartão
+    # Só quando um intent vai ser criado: repetições idempotentes não chegam aqui
+    check_rate('payment_intent', request.user)
+    try:
+        logger.debug("Iniciando checkout para método: %s, produto: %s", payment_method, product.id)
+        
+        # Reserva do pagamento, customer e intent (uma chamada ao Stripe) - ver payments/checkout.py
+        payment, intent = create_checkout(
+            request.user, product, payment_method, request.build_absolute_uri, stripe_idempotency_key,
+        )
+        logger.debug("Payment Intent criado: %s, status: %s", intent.id, intent.status)
+        
+        response_data = {
+            'client_secret': intent.client_secret,
+            'payment_id': payment.id,
+            'payment_method': payment_method
+        }
+        
+        # Para PIX, incluir informações adicionais
+        if payment_method == 'pix' and intent.status == 'requires_action':
+            response_data['requires_action'] = True
+            response_data['next_action'] = intent.next_action
+        
+        # Para Boleto, client_secret é suficiente (frontend vai confirmar)
+        if payment_method == 'boleto':
+            response_data['status'] = intent.status
+        
+        # Uma linha de resumo por checkout; detalhes só em DEBUG
+        logger.info(
+            "Checkout %s: pagamento %s, intent %s (%s) em %.0f ms",
+            payment_method, payment.id, intent.id, intent.status, (time.perf_counter() - started) * 1000,
+            extra={
+                'event': 'checkout', 'payment_id': payment.id, 'intent_id': intent.id,
+                'payment_method': payment_method, 'intent_status': intent.status, 'user_id': request.user.id,
+            },
+        )
+        return 200, response_data
+        
+    except (IdempotencyError, RateLimited, CircuitOpenError):
+        raise
+    except stripe.error.RateLimitError as e:
+        # Retries esgotados no cliente: o navegador deve aguardar, não desistir
+        raise RateLimited('stripe', retry_after(e) or 1) from e
+    except stripe.error.StripeError as e:
+        logger.error(
+            "Checkout %s falhou no Stripe: %s", payment_method, e,
+            extra={'event': 'checkout', 'payment_method': payment_method, 'stripe_code': getattr(e, 'code', None)},
+        )
+        return 400, {'error': str(e)}
+    except Exception as e:
+        logger.error("Erro inesperado no checkout: %s", e, exc_info=True)
+        return 500, {'error': 'Erro interno do servidor'}
+
 @login_required
 def checkout(request, product_id):
     """Página de checkout com suporte a cartão, PIX e boleto"""
-    product = get_object_or_404(Product, id=product_id, active=True)
+    # Preço cobrado lido do primário, nunca do catálogo em cache
+    product = get_object_or_404(Product.objects.using('default'), pk=product_id, active=True)
     
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
-            payment_method = data.get('payment_method', 'card')
-            
-            logger.info(f"Iniciando checkout para método: {payment_method}, produto: {product.name}")
-            
-            # Cria ou obtém customer do Stripe
-            customer = None
-            try:
-                # Busca customer existente
-                customers = stripe.Customer.list(email=request.user.email, limit=1)
-                if customers.data:
-                    customer = customers.data[0]
-                else:
-                    # Cria novo customer
-                    customer = stripe.Customer.create(
-                        email=request.user.email,
-                        name=request.user.get_full_name() or request.user.username,
-                        metadata={'django_user_id': request.user.id}
-                    )
-                    logger.info(f"Customer criado: {customer.id}")
-            
-            except stripe.error.StripeError as e:
-                logger.error(f"Erro ao criar customer: {e}")
-                return JsonResponse({'error': str(e)}, status=400)
-            
-            # Configuração específica para cada método de pagamento
-            if payment_method == 'pix':
-                # PIX requer configurações específicas
-                intent_data = {
-                    'amount': int(product.price * 100),  # Em centavos
-                    'currency': 'brl',
-                    'payment_method_types': ['pix'],
-                    'customer': customer.id if customer else None,
-                    'payment_method_options': {
-                        'pix': {
-                            'expires_after_seconds': 86400  # 24 horas para expirar
-                        }
-                    },
-                    'confirmation_method': 'automatic',
-                    'confirm': True,  # Confirma automaticamente
-                    'return_url': request.build_absolute_uri(f'/success/{0}/'),  # Será atualizado
-                    'metadata': {
-                        'product_id': product.id,
-                        'user_id': request.user.id,
-                        'django_payment_method': payment_method
-                    }
-                }
-            elif payment_method == 'boleto':
-                logger.info("=== CONFIGURANDO BOLETO COM AUTOMATIC ===")
-                logger.info(f"User: {request.user.username}, Email: {request.user.email}")
-                logger.info(f"Product: {product.name}, Price: {product.price}")
-                
-                # CORREÇÃO DEFINITIVA: SEMPRE usar automatic para boleto
-                intent_data = {
-                    'amount': int(product.price * 100),  # Em centavos
-                    'currency': 'brl',
-                    'payment_method_types': ['boleto'],
-                    'customer': customer.id if customer else None,
-                    'payment_method_options': {
-                        'boleto': {
-                            'expires_after_days': 3
-                        }
-                    },
-                    # FUNDAMENTAL: usar automatic para permitir confirmação no frontend
-                    'confirmation_method': 'automatic',
-                    'metadata': {
-                        'product_id': str(product.id),
-                        'user_id': str(request.user.id),
-                        'django_payment_method': payment_method,
-                        'user_email': request.user.email
-                    }
-                }
-                
-                logger.info(f"Intent data para boleto: {intent_data}")
-                logger.info("=== BOLETO CONFIGURADO COM AUTOMATIC ===")
-            else:
-                # Configuração para cartão (padrão)
-                intent_data = {
-                    'amount': int(product.price * 100),
-                    'currency': 'brl',
-                    'payment_method_types': ['card'],
-                    'customer': customer.id if customer else None,
-                    # TAMBÉM garantir automatic para cartão
-                    'confirmation_method': 'automatic',
-                    'metadata': {
-                        'product_id': product.id,
-                        'user_id': request.user.id,
-                        'django_payment_method': payment_method
-                    }
-                }
-            
-            # Cria Payment Intent
-            logger.info("Criando Payment Intent...")
-            intent = stripe.PaymentIntent.create(**intent_data)
-            logger.info(f"Payment Intent criado com sucesso: {intent.id}, status: {intent.status}")
-            logger.info(f"Confirmation method: {intent.confirmation_method}")  # LOG PARA VERIFICAR
-            
-            # Salva pagamento no banco
-            payment = Payment.objects.create(
-                user=request.user,
-                product=product,
-                stripe_payment_intent_id=intent.id,
-                stripe_customer_id=customer.id if customer else '',
-                amount=product.price,
-                payment_method_type=payment_method,
-                status='pending'
+            if not isinstance(data, dict):
+                raise ValueError('O corpo deve ser um objeto JSON')
+            status, payload, replayed = run_idempotent(
+                request.user, 'checkout', request.headers.get('Idempotency-Key'),
+                {'product_id': product.id, **data},
+                lambda stripe_key: _create_checkout_payment(request, product, data, stripe_key),
             )
-            
-            # Atualiza return_url com o ID do pagamento real para PIX
-            if payment_method == 'pix':
-                stripe.PaymentIntent.modify(
-                    intent.id,
-                    return_url=request.build_absolute_uri(f'/success/{payment.id}/')
-                )
-            
-            logger.info(f"Payment Intent criado: {intent.id} para usuário {request.user.username}")
-            
-            response_data = {
-                'client_secret': intent.client_secret,
-                'payment_id': payment.id,
-                'payment_method': payment_method
-            }
-            
-            # Para PIX, incluir informações adicionais
-            if payment_method == 'pix' and intent.status == 'requires_action':
-                response_data['requires_action'] = True
-                response_data['next_action'] = intent.next_action
-            
-            # Para Boleto, client_secret é suficiente (frontend vai confirmar)
-            if payment_method == 'boleto':
-                response_data['status'] = intent.status
-            
-            logger.info(f"Response data: {response_data}")
-            return JsonResponse(response_data)
-            
-        except stripe.error.StripeError as e:
-            logger.error(f"Erro Stripe: {e}")
-            logger.error(f"Detalhes do erro: {e.user_message if hasattr(e, 'user_message') else 'N/A'}")
-            return JsonResponse({'error': str(e)}, status=400)
-        except Exception as e:
-            logger.error(f"Erro inesperado: {e}")
-            logger.error(f"Traceback: ", exc_info=True)
-            return JsonResponse({'error': 'Erro interno do servidor'}, status=500)
+        except IdempotencyError as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+        except RateLimited as e:
+            return rate_limited_response(e)
+        except CircuitOpenError as e:
+            # Stripe fora do ar: falha na hora em vez de prender o worker
+            return circuit_open_response(e)
+        except ValueError:
+            return JsonResponse({'error': 'JSON inválido'}, status=400)
+        
+        response = JsonResponse(payload, status=status)
+        if replayed:
+            response['Idempotent-Replayed'] = 'true'
+        return response
     
     # GET request - mostra página de checkout
     context = {
@@ -211,41 +162,56 @@ def payment_success(request, payment_id):
     """Página de sucesso"""
     payment = get_object_or_404(Payment, id=payment_id, user=request.user)
     
-    # Verifica status no Stripe para garantir que está atualizado
+    # Consulta o Stripe (via cache) apenas se o status local puder estar defasado;
+    # sem o Stripe a página usa o estado local do Payment
+    stripe_unavailable = False
     try:
-        intent = stripe.PaymentIntent.retrieve(payment.stripe_payment_intent_id)
-        if intent.status != payment.status:
-            payment.status = intent.status
-            if intent.status == 'succeeded':
-                payment.paid_at = timezone.now()
-            payment.save()
-            logger.info(f"Status do pagamento {payment.id} atualizado para {intent.status}")
+        get_stripe_data(payment)
+    except CircuitOpenError:
+        stripe_unavailable = True
     except stripe.error.StripeError as e:
+        stripe_unavailable = True
         logger.error(f"Erro ao verificar pagamento: {e}")
     
-    return render(request, 'payments/success.html', {'payment': payment})
+    return render(request, 'payments/success.html', {
+        'payment': payment,
+        'stripe_unavailable': stripe_unavailable,
+    })
 
+@use_read_replica
 @login_required
 def payment_history(request):
     """Histórico de pagamentos"""
-    payments = Payment.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'payments/history.html', {'payments': payments})
+    payments, next_cursor = keyset_paginate(
+        Payment.objects.filter(user=request.user).select_related('product'),
+        cursor=request.GET.get('cursor'),
+        page_size=HISTORY_PAGE_SIZE,
+    )
+    return render(request, 'payments/history.html', {
+        'payments': payments,
+        'next_cursor': next_cursor,
+    })
 
 @login_required
 def payment_detail(request, pk):
     """Detalhes de um pagamento específico"""
     payment = get_object_or_404(Payment, pk=pk, user=request.user)
     
-    # Busca dados atualizados no Stripe
+    # Dados do Stripe via cache; status finais são servidos do estado local
     stripe_data = None
+    stripe_unavailable = False
     try:
-        stripe_data = stripe.PaymentIntent.retrieve(payment.stripe_payment_intent_id)
+        stripe_data = get_stripe_data(payment)
+    except CircuitOpenError:
+        stripe_unavailable = True
     except stripe.error.StripeError as e:
+        stripe_unavailable = True
         logger.error(f"Erro ao buscar dados do Stripe: {e}")
     
     return render(request, 'payments/payment_detail.html', {
         'payment': payment,
-        'stripe_data': stripe_data
+        'stripe_data': stripe_data,
+        'stripe_unavailable': stripe_unavailable,
     })
 
 @csrf_exempt
@@ -266,109 +232,27 @@ def stripe_webhook(request):
         logger.error("Assinatura inválida no webhook")
         return HttpResponse(status=400)
     
+    # Tipos sem handler não passam pela fila nem guardam o payload completo
+    if not is_handled(event['type']):
+        store_unhandled_event(event)
+        return HttpResponse(status=200)
+    
+    # Modo assíncrono: apenas grava o evento; o worker process_webhooks processa
+    if settings.STRIPE_WEBHOOK_ASYNC:
+        enqueue_event(event)
+        return HttpResponse(status=200)
+    
     # Log do evento
-    webhook_event, created = WebhookEvent.objects.get_or_create(
-        stripe_event_id=event['id'],
-        defaults={
-            'event_type': event['type'],
-            'data': event['data'],
-            'processed': False
-        }
-    )
+    webhook_event, created = record_event(event)
     
     if not created and webhook_event.processed:
-        logger.info(f"Evento já processado: {event['id']}")
+        logger.debug("Evento já processado: %s", event['id'])
+        WEBHOOK_EVENTS.labels(webhook_event.event_type, 'duplicate').inc()
         return HttpResponse(status=200)
     
-    logger.info(f"Processando webhook: {event['type']} - {event['id']}")
-    
-    # Processa eventos (incluindo novos eventos para PIX e Boleto)
     try:
-        if event['type'] == 'payment_intent.succeeded':
-            handle_payment_succeeded(event['data']['object'])
-        elif event['type'] == 'payment_intent.payment_failed':
-            handle_payment_failed(event['data']['object'])
-        elif event['type'] == 'payment_intent.requires_action':
-            handle_payment_requires_action(event['data']['object'])
-        elif event['type'] == 'payment_intent.canceled':
-            handle_payment_canceled(event['data']['object'])
-        elif event['type'] == 'payment_intent.processing':
-            handle_payment_processing(event['data']['object'])
-        else:
-            logger.info(f"Evento não tratado: {event['type']}")
-        
-        webhook_event.processed = True
-        webhook_event.save()
-        
-    except Exception as e:
-        logger.error(f"Erro ao processar webhook: {e}")
+        process_event(webhook_event)
+    except Exception:
         return HttpResponse(status=500)
     
     return HttpResponse(status=200)
-
-def handle_payment_succeeded(payment_intent):
-    """Processa pagamento aprovado"""
-    try:
-        payment = Payment.objects.get(stripe_payment_intent_id=payment_intent['id'])
-        payment.status = 'succeeded'
-        payment.paid_at = timezone.now()
-        
-        # Extrai informações financeiras
-        if 'charges' in payment_intent and payment_intent['charges']['data']:
-            charge = payment_intent['charges']['data'][0]
-            balance_transaction_id = charge.get('balance_transaction')
-            
-            if balance_transaction_id:
-                # Busca detalhes da transação para obter taxas
-                try:
-                    balance_transaction = stripe.BalanceTransaction.retrieve(balance_transaction_id)
-                    payment.stripe_fee = Decimal(str(balance_transaction['fee'])) / 100
-                    payment.net_amount = Decimal(str(balance_transaction['net'])) / 100
-                except stripe.error.StripeError as e:
-                    logger.error(f"Erro ao buscar balance transaction: {e}")
-        
-        payment.save()
-        logger.info(f"Pagamento {payment.id} marcado como aprovado")
-        
-    except Payment.DoesNotExist:
-        logger.error(f"Pagamento não encontrado para intent: {payment_intent['id']}")
-
-def handle_payment_failed(payment_intent):
-    """Processa pagamento falhou"""
-    try:
-        payment = Payment.objects.get(stripe_payment_intent_id=payment_intent['id'])
-        payment.status = 'failed'
-        payment.save()
-        logger.info(f"Pagamento {payment.id} marcado como falhou")
-    except Payment.DoesNotExist:
-        logger.error(f"Pagamento não encontrado para intent: {payment_intent['id']}")
-
-def handle_payment_requires_action(payment_intent):
-    """Processa pagamento que requer ação"""
-    try:
-        payment = Payment.objects.get(stripe_payment_intent_id=payment_intent['id'])
-        payment.status = 'requires_action'
-        payment.save()
-        logger.info(f"Pagamento {payment.id} requer ação")
-    except Payment.DoesNotExist:
-        logger.error(f"Pagamento não encontrado para intent: {payment_intent['id']}")
-
-def handle_payment_canceled(payment_intent):
-    """Processa pagamento cancelado"""
-    try:
-        payment = Payment.objects.get(stripe_payment_intent_id=payment_intent['id'])
-        payment.status = 'canceled'
-        payment.save()
-        logger.info(f"Pagamento {payment.id} cancelado")
-    except Payment.DoesNotExist:
-        logger.error(f"Pagamento não encontrado para intent: {payment_intent['id']}")
-
-def handle_payment_processing(payment_intent):
-    """Processa pagamento em andamento (comum para PIX e Boleto)"""
-    try:
-        payment = Payment.objects.get(stripe_payment_intent_id=payment_intent['id'])
-        payment.status = 'processing'
-        payment.save()
-        logger.info(f"Pagamento {payment.id} marcado como processando")
-    except Payment.DoesNotExist:
-        logger.error(f"Pagamento não encontrado para intent: {payment_intent['id']}")
\ No newline at end of file
@@ -0,0 +1,93 @@
+# payments/webhook_archive.py
+"""
+Arquivamento dos eventos de webhook processados.
+
+Os eventos com mais de N dias saem da tabela para segmentos NDJSON
+comprimidos (um evento por linha), em ordem de id:
+
+    webhook-events-<first_id>-<last_id>.ndjson.gz
+
+Cada segmento é gravado em um arquivo temporário, sincronizado em disco e
+renomeado; só então as linhas correspondentes são excluídas. Uma execução
+interrompida deixa no máximo um arquivo .tmp, e os eventos continuam na
+tabela para a próxima execução.
+"""
+import gzip
+import json
+import logging
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FIELDS = (
+    'id', 'stripe_event_id', 'event_type', 'status', 'attempts', 'data',
+    'stripe_created_at', 'created_at', 'processed_at',
+)
+DELETE_CHUNK_SIZE = 500
+
+
+def archivable_events(days):
+    cutoff = timezone.now() - timedelta(days=days)
+    return WebhookEvent.objects.filter(processed=True, created_at__lt=cutoff)
+
+
+def _write_segment(directory, rows):
+    name = f"webhook-events-{rows[0]['id']:012d}-{rows[-1]['id']:012d}.ndjson.gz"
+    path = directory / name
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as segment:
+            for row in rows:
+                segment.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False).encode() + b'\n')
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+
+def archive_events(days, directory, segment_size=10000, dry_run=False, on_segment=None):
+    """
+    Move os eventos processados há mais de `days` dias para segmentos de até
+    `segment_size` eventos em `directory`. Retorna (eventos, segmentos).
+    """
+    queryset = archivable_events(days)
+    if dry_run:
+        return queryset.count(), 0
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    archived = segments = 0
+    last_id = 0
+    while True:
+        rows = list(
+            queryset.filter(id__gt=last_id).order_by('id').values(*ARCHIVE_FIELDS)[:segment_size]
+        )
+        if not rows:
+            break
+        path = _write_segment(directory, rows)
+        ids = [row['id'] for row in rows]
+        # Em blocos: limite de parâmetros por consulta no SQLite
+        for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+            WebhookEvent.objects.filter(id__in=ids[start:start + DELETE_CHUNK_SIZE]).delete()
+
+        last_id = ids[-1]
+        archived += len(rows)
+        segments += 1
+        logger.info("%s evento(s) arquivado(s) em %s", len(rows), path.name)
+        if on_segment:
+            on_segment(path, len(rows))
+    return archived, segments
+
+
+def read_segment(path):
+    """Eventos de um segmento arquivado (dicts, na ordem de gravação)"""
+    with gzip.open(path, 'rt', encoding='utf-8') as segment:
+        for line in segment:
+            yield json.loads(line)
@@ -0,0 +1,330 @@
+# payments/webhooks.py
+"""
+Ingestão e processamento de eventos de webhook do Stripe.
+
+A view `stripe_webhook` grava o evento e, no modo assíncrono
+(STRIPE_WEBHOOK_ASYNC), responde imediatamente; o comando
+`process_webhooks` consome a fila com um pool de workers.
+
+Os handlers ficam em um registro por tipo de evento e recebem sempre uma
+lista de objetos, para que um lote de eventos do mesmo tipo seja aplicado
+com um único UPDATE.
+"""
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from stripe_sandbox.metrics import observe_webhook_events
+
+from .intents import invalidate_payment_intents
+from .models import Payment, WebhookEvent
+from .queue import claim_batch, mark_failed
+from .rollups import ROLLUP_FIELDS, record_status_change
+
+logger = logging.getLogger(__name__)
+
+# event_type -> handler(objects)
+HANDLERS = {}
+
+# Status de destino -> status a partir dos quais a transição é aceita.
+# Eventos fora de ordem (ex.: processing depois de succeeded) são ignorados.
+# 'failed' não é final: após uma recusa o cliente pode tentar de novo com o
+# mesmo PaymentIntent, que volta a processing ou requires_action.
+ALLOWED_TRANSITIONS = {
+    'processing': ('pending', 'requires_action', 'failed'),
+    'requires_action': ('pending', 'processing', 'failed'),
+    'failed': ('pending', 'processing', 'requires_action'),
+    'succeeded': ('pending', 'processing', 'requires_action', 'failed'),
+    'canceled': ('pending', 'processing', 'requires_action', 'failed'),
+}
+
+
+def register(event_type):
+    """Registra o handler de um tipo de evento"""
+    def decorator(handler):
+        HANDLERS[event_type] = handler
+        return handler
+    return decorator
+
+
+def transition_payments(intent_ids, status, **extra_fields):
+    """
+    Aplica a transição de status com um único UPDATE guardado pelos
+    status predecessores permitidos e move os pagamentos entre as linhas
+    de PaymentDailyRollup. Retorna o número de pagamentos alterados.
+    """
+    intent_ids = list(intent_ids)
+    with transaction.atomic():
+        # Status anteriores (travados até o commit) para os deltas dos totais diários
+        payments = list(
+            Payment.objects.select_for_update()
+            .filter(stripe_payment_intent_id__in=intent_ids, status__in=ALLOWED_TRANSITIONS[status])
+            .values('id', *ROLLUP_FIELDS)
+        )
+        updated = 0
+        if payments:
+            updated = Payment.objects.filter(
+                id__in=[payment['id'] for payment in payments],
+                status__in=ALLOWED_TRANSITIONS[status],
+            ).update(status=status, updated_at=timezone.now(), **extra_fields)
+            record_status_change(payments, status)
+
+    if updated:
+        invalidate_payment_intents(intent_ids)
+        logger.debug("%s pagamento(s) marcado(s) como %s", updated, status)
+    if updated < len(set(intent_ids)):
+        logger.warning(
+            "%s intent(s) ignorado(s) para %s (pagamento não encontrado ou já em status posterior)",
+            len(set(intent_ids)) - updated, status,
+        )
+    return updated
+
+
+def event_priority(event_type):
+    return settings.STRIPE_WEBHOOK_PRIORITIES.get(event_type, 0)
+
+
+def event_created_at(event):
+    created = event.get('created')
+    return datetime.fromtimestamp(created, tz=dt_timezone.utc) if created else None
+
+
+def is_handled(event_type):
+    return event_type in HANDLERS
+
+
+def minimal_data(data):
+    """Só a referência ao objeto (id e tipo), sem o payload completo"""
+    obj = data.get('object') or {}
+    return {'object': {key: obj[key] for key in ('id', 'object') if key in obj}}
+
+
+def store_unhandled_event(event):
+    """
+    Registra um evento sem handler já como processado, conforme
+    STRIPE_WEBHOOK_UNHANDLED_STORAGE: 'full' (payload completo), 'minimal'
+    (só a referência ao objeto) ou 'none' (não grava).
+    """
+    storage = settings.STRIPE_WEBHOOK_UNHANDLED_STORAGE
+    webhook_event = WebhookEvent(
+        stripe_event_id=event['id'],
+        event_type=event['type'],
+        data=event['data'] if storage == 'full' else minimal_data(event['data']),
+        stripe_created_at=event_created_at(event),
+        processed=True,
+        status='processed',
+        processed_at=timezone.now(),
+    )
+    if storage != 'none':
+        WebhookEvent.objects.bulk_create([webhook_event], ignore_conflicts=True)
+    observe_webhook_events([webhook_event], 'unhandled')
+
+
+def queued_event(event):
+    """WebhookEvent (não salvo) pendente para o evento do Stripe"""
+    return WebhookEvent(
+        stripe_event_id=event['id'],
+        event_type=event['type'],
+        data=event['data'],
+        priority=event_priority(event['type']),
+        stripe_created_at=event_created_at(event),
+    )
+
+
+def enqueue_events(events):
+    """Grava eventos para processamento posterior (um único INSERT, duplicatas ignoradas)"""
+    WebhookEvent.objects.bulk_create([queued_event(event) for event in events], ignore_conflicts=True)
+
+
+def enqueue_event(event):
+    enqueue_events([event])
+
+
+def record_event(event):
+    """Grava (ou recupera) o evento para processamento imediato"""
+    return WebhookEvent.objects.get_or_create(
+        stripe_event_id=event['id'],
+        defaults={
+            'event_type': event['type'],
+            'data': event['data'],
+            'priority': event_priority(event['type']),
+            'stripe_created_at': event_created_at(event),
+            'processed': False
+        }
+    )
+
+
+def dispatch_event(event_type, objects):
+    """Executa o handler registrado para o tipo de evento"""
+    handler = HANDLERS.get(event_type)
+    if handler is None:
+        logger.debug("Evento não tratado: %s", event_type)
+        return
+    handler(objects)
+
+
+def mark_processed(webhook_events):
+    WebhookEvent.objects.filter(id__in=[event.id for event in webhook_events]).update(
+        processed=True,
+        status='processed',
+        processed_at=timezone.now(),
+        locked_by='',
+        locked_at=None,
+        last_error='',
+    )
+
+
+def mark_event_failed(webhook_event, error):
+    mark_failed(
+        webhook_event, error,
+        max_attempts=settings.STRIPE_WEBHOOK_MAX_ATTEMPTS,
+        base_seconds=settings.STRIPE_WEBHOOK_RETRY_BASE_SECONDS,
+        max_seconds=settings.STRIPE_WEBHOOK_RETRY_MAX_SECONDS,
+    )
+
+
+def webhook_outcome(event_type):
+    return 'processed' if event_type in HANDLERS else 'unhandled'
+
+
+def process_event(webhook_event):
+    """Processa um evento gravado; em caso de erro agenda nova tentativa e propaga a exceção"""
+    started = time.perf_counter()
+    log_extra = {
+        'event': 'webhook', 'event_type': webhook_event.event_type, 'stripe_event_id': webhook_event.stripe_event_id,
+    }
+    try:
+        dispatch_event(webhook_event.event_type, [webhook_event.data['object']])
+    except Exception as e:
+        logger.error("Erro ao processar webhook %s: %s", webhook_event.stripe_event_id, e, extra=log_extra)
+        mark_event_failed(webhook_event, e)
+        observe_webhook_events([webhook_event], 'failed')
+        raise
+    mark_processed([webhook_event])
+    observe_webhook_events([webhook_event], webhook_outcome(webhook_event.event_type))
+    # Uma linha de resumo por webhook
+    logger.info(
+        "Webhook %s %s processado em %.0f ms",
+        webhook_event.event_type, webhook_event.stripe_event_id, (time.perf_counter() - started) * 1000,
+        extra=log_extra,
+    )
+
+
+def apply_batch(event_type, webhook_events):
+    """Aplica um lote de eventos do mesmo tipo em uma única transação"""
+    started = time.perf_counter()
+    with transaction.atomic():
+        dispatch_event(event_type, [event.data['object'] for event in webhook_events])
+        mark_processed(webhook_events)
+    observe_webhook_events(webhook_events, webhook_outcome(event_type))
+    logger.info(
+        "Lote de %s evento(s) %s aplicado em %.0f ms",
+        len(webhook_events), event_type, (time.perf_counter() - started) * 1000,
+        extra={'event': 'webhook_batch', 'event_type': event_type, 'batch_size': len(webhook_events)},
+    )
+
+
+def process_events(webhook_events):
+    """
+    Processa um grupo de eventos do mesmo tipo reservados pelo worker.
+    Se o lote falhar, cada evento é reprocessado isoladamente para que
+    apenas os problemáticos entrem em retry.
+    """
+    if len(webhook_events) > 1:
+        try:
+            apply_batch(webhook_events[0].event_type, webhook_events)
+            return
+        except Exception as e:
+            logger.warning("Lote %s falhou, processando individualmente: %s", webhook_events[0].event_type, e)
+
+    for webhook_event in webhook_events:
+        try:
+            process_event(webhook_event)
+        except Exception:
+            # Falha já registrada; segue para o próximo evento
+            pass
+
+
+def claim_events(batch_size=None):
+    """
+    Reserva o próximo lote de eventos, agrupado por tipo. A ordem é a do
+    Stripe (`created` do evento): o backfill grava os eventos na ordem do
+    Event.list, do mais novo para o mais antigo.
+    """
+    events = claim_batch(
+        WebhookEvent.objects.all(),
+        limit=batch_size or settings.STRIPE_WEBHOOK_BATCH_SIZE,
+        lock_timeout=settings.STRIPE_WEBHOOK_LOCK_TIMEOUT_SECONDS,
+        order_by=('-priority', Coalesce('stripe_created_at', 'created_at'), 'id'),
+    )
+    groups = defaultdict(list)
+    for event in events:
+        groups[event.event_type].append(event)
+    return list(groups.values())
+
+
+def charge_id_from_intent(payment_intent):
+    """ID da cobrança do intent (latest_charge ou, em versões antigas da API, charges)"""
+    latest_charge = payment_intent.get('latest_charge')
+    if isinstance(latest_charge, dict):
+        return latest_charge.get('id')
+    if latest_charge:
+        return latest_charge
+    charges = (payment_intent.get('charges') or {}).get('data') or []
+    return charges[0].get('id') if charges else None
+
+
+@register('payment_intent.succeeded')
+def handle_payment_succeeded(payment_intents):
+    """
+    Processa pagamentos aprovados. As taxas do Stripe não são buscadas aqui:
+    o comando reconcile_fees as preenche em lote a partir da cobrança gravada.
+    """
+    charges = {
+        payment_intent['id']: charge_id
+        for payment_intent in payment_intents
+        if (charge_id := charge_id_from_intent(payment_intent))
+    }
+    extra_fields = {'paid_at': timezone.now()}
+    if charges:
+        extra_fields['stripe_charge_id'] = Case(
+            *[When(stripe_payment_intent_id=intent_id, then=Value(charge_id))
+              for intent_id, charge_id in charges.items()],
+            default=F('stripe_charge_id'),
+        )
+    transition_payments(
+        [payment_intent['id'] for payment_intent in payment_intents],
+        'succeeded',
+        **extra_fields,
+    )
+
+
+@register('payment_intent.payment_failed')
+def handle_payment_failed(payment_intents):
+    """Processa pagamentos que falharam"""
+    transition_payments([payment_intent['id'] for payment_intent in payment_intents], 'failed')
+
+
+@register('payment_intent.requires_action')
+def handle_payment_requires_action(payment_intents):
+    """Processa pagamentos que requerem ação"""
+    transition_payments([payment_intent['id'] for payment_intent in payment_intents], 'requires_action')
+
+
+@register('payment_intent.canceled')
+def handle_payment_canceled(payment_intents):
+    """Processa pagamentos cancelados"""
+    transition_payments([payment_intent['id'] for payment_intent in payment_intents], 'canceled')
+
+
+@register('payment_intent.processing')
+def handle_payment_processing(payment_intents):
+    """Processa pagamentos em andamento (comum para PIX e Boleto)"""
+    transition_payments([payment_intent['id'] for payment_intent in payment_intents], 'processing')
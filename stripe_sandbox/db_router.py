@@ -0,0 +1,91 @@
+# stripe_sandbox/db_router.py
+"""
+Roteamento de leituras para a réplica (alias DATABASE_READ_REPLICA).
+
+Só usam a réplica as requisições GET/HEAD de views marcadas com
+`use_read_replica` (listagens e detalhes de catálogo, listagens de
+pagamentos, histórico) e as changelists do admin. Todo o resto lê do
+primário, assim como:
+
+- qualquer leitura depois de uma escrita na mesma requisição;
+- requisições do mesmo cliente nos DATABASE_REPLICA_PIN_SECONDS seguintes
+  a uma escrita (cookie), para que ele veja o que acabou de gravar;
+- sessões, usuários e tokens, que não podem sofrer atraso de replicação.
+"""
+from contextvars import ContextVar
+
+from django.conf import settings
+
+PRIMARY_PIN_COOKIE = 'db_primary'
+PRIMARY_ONLY_APPS = {'sessions', 'auth', 'authtoken', 'contenttypes'}
+
+_use_replica = ContextVar('use_replica', default=False)
+_wrote = ContextVar('wrote', default=False)
+
+
+def use_read_replica(view):
+    """Marca uma view de leitura como elegível para a réplica"""
+    view.use_read_replica = True
+    return view
+
+
+def _view_allows_replica(request, view_func):
+    if getattr(view_func, 'use_read_replica', False):
+        return True
+    if getattr(getattr(view_func, 'view_class', None), 'use_read_replica', False):
+        return True
+    match = request.resolver_match
+    return bool(match and match.namespace == 'admin' and (match.url_name or '').endswith('_changelist'))
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replica = settings.DATABASE_READ_REPLICA
+        if not replica or not _use_replica.get() or _wrote.get():
+            return 'default'
+        if model._meta.app_label in PRIMARY_ONLY_APPS:
+            return 'default'
+        return replica
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Réplica e primário têm os mesmos dados
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+class ReplicaRoutingMiddleware:
+    """Liga a réplica durante views de leitura elegíveis e fixa o primário após escritas"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        replica_token = _use_replica.set(False)
+        wrote_token = _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            if _wrote.get():
+                response.set_cookie(
+                    PRIMARY_PIN_COOKIE, '1',
+                    max_age=settings.DATABASE_REPLICA_PIN_SECONDS, httponly=True, samesite='Lax',
+                )
+            return response
+        finally:
+            _use_replica.reset(replica_token)
+            _wrote.reset(wrote_token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (
+            settings.DATABASE_READ_REPLICA
+            and request.method in ('GET', 'HEAD')
+            and PRIMARY_PIN_COOKIE not in request.COOKIES
+            and _view_allows_replica(request, view_func)
+        ):
+            _use_replica.set(True)
+        return None
@@ -0,0 +1,115 @@
+# stripe_sandbox/log.py
+"""
+Logging sem bloquear as requisições.
+
+- AsyncStreamHandler: o worker apenas enfileira o LogRecord; formatação
+  (inclusive a interpolação dos argumentos %s) e escrita no stdout ficam
+  com uma thread de escrita. Com a fila cheia o registro é descartado e
+  a contagem aparece no próximo registro gravado (campo dropped_logs),
+  em vez de travar o worker por backpressure do stdout.
+- JsonFormatter: uma linha JSON por registro, com os campos de `extra`.
+- SamplingFilter: mantém só uma fração dos registros de baixo nível de
+  loggers muito verbosos; WARNING e acima sempre passam.
+
+Como a formatação é adiada, os argumentos do log não devem ser
+alterados depois da chamada (passe valores, não dicts que vão mudar).
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Atributos padrão do LogRecord; o restante veio de `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            'time': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+            'thread': record.thread,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info:
+            payload['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Deixa passar `rate` (0 a 1) dos registros até `max_level`"""
+
+    def __init__(self, rate=1.0, max_level='INFO'):
+        super().__init__()
+        self.rate = float(rate)
+        self.max_level = logging.getLevelName(max_level) if isinstance(max_level, str) else max_level
+
+    def filter(self, record):
+        if record.levelno > self.max_level or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        # Bloqueante: com a fila cheia, espera a thread liberar espaço
+        self.queue.put(self._sentinel)
+
+
+class AsyncStreamHandler(QueueHandler):
+    """Handler de stream com fila e thread de escrita própria"""
+
+    def __init__(self, stream=None, maxsize=10000):
+        self.maxsize = maxsize
+        self.target = logging.StreamHandler(stream or sys.stdout)
+        self.dropped = 0
+        super().__init__(queue.Queue(maxsize))
+        self._start_listener()
+        atexit.register(self.flush_and_stop)
+        if hasattr(os, 'register_at_fork'):
+            # Threads não sobrevivem ao fork: cada worker recria a sua
+            os.register_at_fork(after_in_child=self._restart_after_fork)
+
+    def _start_listener(self):
+        self.listener = _Listener(self.queue, self.target)
+        self.listener.start()
+
+    def _restart_after_fork(self):
+        self.queue = queue.Queue(self.maxsize)
+        self._start_listener()
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Nada de format() aqui: a thread de escrita formata
+        if self.dropped:
+            record.dropped_logs, self.dropped = self.dropped, 0
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush_and_stop(self):
+        """Escreve o que estiver na fila e para a thread (usado no atexit e nos testes)"""
+        if self.listener._thread is not None:
+            self.listener.stop()
+        self.target.flush()
+
+    def close(self):
+        self.flush_and_stop()
+        super().close()
@@ -0,0 +1,193 @@
+# stripe_sandbox/metrics.py
+"""
+Métricas no formato do Prometheus, expostas em /metrics.
+
+- Requisições: latência e contagem por view, método e status
+  (MetricsMiddleware).
+- Stripe: chamadas, latência e erros por operação (Customer.list,
+  PaymentIntent.create, ...), registrados em StripeClient.call, e
+  novas tentativas após 429/lock_timeout e transições/recusas dos
+  circuit breakers.
+- Limites de taxa: requisições recusadas por escopo e bucket
+  (payments/throttling.py).
+- Webhooks: atraso entre o `created` do evento no Stripe e o fim do
+  processamento, resultado por tipo de evento e fila pendente (calculada
+  no momento da coleta).
+
+Com vários workers do gunicorn, PROMETHEUS_MULTIPROC_DIR deve estar
+definido antes de o processo importar prometheus_client (ver
+gunicorn.conf.py); cada processo grava seus valores nesse diretório e a
+view agrega todos eles.
+
+Processos fora do gunicorn (o worker process_webhooks, onde os webhooks
+são processados no modo assíncrono) não passam por /metrics: expõem as
+próprias métricas com start_metrics_server, em outra porta.
+
+Acesso: com METRICS_TOKEN, `Authorization: Bearer <token>`; sem token,
+as métricas só são servidas com METRICS_REQUIRE_TOKEN desligado (padrão
+fora de produção).
+"""
+import os
+import threading
+import time
+from wsgiref.simple_server import make_server
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils import timezone
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, make_wsgi_app,
+    multiprocess,
+)
+from prometheus_client.exposition import ThreadingWSGIServer, _SilentHandler
+from prometheus_client.core import GaugeMetricFamily
+
+REQUEST_LATENCY = Histogram(
+    'django_http_request_duration_seconds', 'Latência das requisições por view',
+    ['view', 'method'],
+)
+REQUESTS = Counter(
+    'django_http_requests_total', 'Requisições por view, método e status',
+    ['view', 'method', 'status'],
+)
+
+STRIPE_LATENCY = Histogram(
+    'stripe_api_call_duration_seconds', 'Latência das chamadas ao Stripe por operação',
+    ['operation'],
+)
+STRIPE_CALLS = Counter(
+    'stripe_api_calls_total', 'Chamadas ao Stripe por operação e resultado',
+    ['operation', 'outcome'],
+)
+STRIPE_ERRORS = Counter(
+    'stripe_api_errors_total', 'Erros nas chamadas ao Stripe por operação e tipo',
+    ['operation', 'error'],
+)
+STRIPE_RETRIES = Counter(
+    'stripe_api_retries_total', 'Novas tentativas de chamadas ao Stripe por operação e motivo',
+    ['operation', 'reason'],
+)
+STRIPE_CIRCUIT_EVENTS = Counter(
+    'stripe_circuit_breaker_events_total',
+    'Transições (closed, open, half_open) e chamadas recusadas (rejected) dos circuit breakers do Stripe',
+    ['operation', 'event'],
+)
+
+RATE_LIMITED = Counter(
+    'rate_limited_requests_total', 'Requisições recusadas por limite de taxa',
+    ['scope', 'bucket'],
+)
+
+WEBHOOK_LAG = Histogram(
+    'stripe_webhook_lag_seconds', 'Tempo entre a criação do evento no Stripe e o fim do processamento',
+    ['event_type'],
+    buckets=(0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 21600),
+)
+WEBHOOK_EVENTS = Counter(
+    'stripe_webhook_events_total', 'Eventos de webhook por tipo e resultado',
+    ['event_type', 'outcome'],
+)
+
+
+def observe_stripe_call(operation, started, error=None):
+    STRIPE_LATENCY.labels(operation).observe(time.perf_counter() - started)
+    STRIPE_CALLS.labels(operation, 'error' if error else 'ok').inc()
+    if error is not None:
+        STRIPE_ERRORS.labels(operation, type(error).__name__).inc()
+
+
+def observe_webhook_events(webhook_events, outcome):
+    """Conta o resultado e, para os processados, o atraso desde o `created` do Stripe"""
+    now = timezone.now()
+    for event in webhook_events:
+        WEBHOOK_EVENTS.labels(event.event_type, outcome).inc()
+        if outcome != 'failed' and event.stripe_created_at:
+            WEBHOOK_LAG.labels(event.event_type).observe(max((now - event.stripe_created_at).total_seconds(), 0))
+
+
+class WebhookBacklogCollector:
+    """Fila de webhooks pendentes, consultada no banco a cada coleta"""
+
+    def collect(self):
+        from django.db.models import Count, Min
+
+        from payments.models import WebhookEvent
+
+        pending = GaugeMetricFamily(
+            'stripe_webhook_backlog', 'Eventos de webhook ainda não processados', labels=['status'],
+        )
+        oldest = GaugeMetricFamily(
+            'stripe_webhook_backlog_oldest_seconds', 'Idade do evento pendente mais antigo',
+        )
+        rows = (
+            WebhookEvent.objects.filter(processed=False)
+            .values('status').annotate(total=Count('id'), oldest=Min('created_at'))
+        )
+        oldest_at = None
+        for row in rows:
+            pending.add_metric([row['status']], row['total'])
+            oldest_at = min(filter(None, [oldest_at, row['oldest']]), default=None)
+        oldest.add_metric([], (timezone.now() - oldest_at).total_seconds() if oldest_at else 0)
+        yield pending
+        yield oldest
+
+
+def _registry():
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+_backlog_registry = CollectorRegistry(auto_describe=False)
+_backlog_registry.register(WebhookBacklogCollector())
+
+
+def _authorized(authorization):
+    token = settings.METRICS_TOKEN
+    if not token:
+        return not settings.METRICS_REQUIRE_TOKEN
+    return authorization == f'Bearer {token}'
+
+
+def metrics_view(request):
+    """Exposição no formato texto do Prometheus (ver _authorized)"""
+    if not _authorized(request.headers.get('Authorization')):
+        return HttpResponseForbidden()
+    output = generate_latest(_registry()) + generate_latest(_backlog_registry)
+    return HttpResponse(output, content_type=CONTENT_TYPE_LATEST)
+
+
+def start_metrics_server(port, addr='0.0.0.0'):
+    """
+    Servidor HTTP de métricas em uma thread daemon, para processos fora do
+    gunicorn; mesmas regras de acesso de /metrics. Retorna o servidor.
+    """
+    app = make_wsgi_app(_registry())
+
+    def protected(environ, start_response):
+        if not _authorized(environ.get('HTTP_AUTHORIZATION')):
+            start_response('403 Forbidden', [('Content-Type', 'text/plain')])
+            return [b'']
+        return app(environ, start_response)
+
+    server = make_server(addr, port, protected, ThreadingWSGIServer, handler_class=_SilentHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+
+class MetricsMiddleware:
+    """Latência e status por view; o rótulo é o nome da rota, nunca o caminho"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else '<unresolved>'
+        REQUEST_LATENCY.labels(view, request.method).observe(time.perf_counter() - started)
+        REQUESTS.labels(view, request.method, str(response.status_code)).inc()
+        return response
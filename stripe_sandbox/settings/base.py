@@ -1,6 +1,8 @@
 import os
 from pathlib import Path
 
+import dj_database_url
+
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 
 SECRET_KEY = os.getenv('SECRET_KEY', 'django-insecure-change-in-production')
@@ -30,6 +32,8 @@ LOCAL_APPS = [
 INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 
 MIDDLEWARE = [
+    'stripe_sandbox.metrics.MetricsMiddleware',
+    'stripe_sandbox.timing.ServerTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -37,6 +41,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'stripe_sandbox.db_router.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -45,7 +50,9 @@ ROOT_URLCONF = 'stripe_sandbox.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates com tempo de renderização no Server-Timing
+        'BACKEND': 'stripe_sandbox.timing.TimedDjangoTemplates',
+        'NAME': 'django',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -61,14 +68,63 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'stripe_sandbox.wsgi.application'
 
-# Database (será sobrescrito nos settings específicos)
+# Database: DATABASE_URL (PostgreSQL em produção; SQLite local por padrão)
+# com conexões persistentes verificadas antes do reuso
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '600'))
+
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': dj_database_url.config(
+        default=f"sqlite:///{BASE_DIR / 'db.sqlite3'}",
+        conn_max_age=DB_CONN_MAX_AGE,
+        conn_health_checks=True,
+    ),
 }
 
+# Réplica de leitura opcional (ver stripe_sandbox/db_router.py). Para testar
+# localmente com dois aliases: DATABASE_REPLICA_URL=sqlite:///db.sqlite3
+DATABASE_READ_REPLICA = None
+if os.getenv('DATABASE_REPLICA_URL'):
+    DATABASE_READ_REPLICA = 'replica'
+    DATABASES['replica'] = dj_database_url.parse(
+        os.getenv('DATABASE_REPLICA_URL'),
+        conn_max_age=DB_CONN_MAX_AGE,
+        conn_health_checks=True,
+    )
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+DATABASE_ROUTERS = ['stripe_sandbox.db_router.ReplicaRouter']
+# Após uma escrita, o cliente lê do primário por este tempo
+DATABASE_REPLICA_PIN_SECONDS = int(os.getenv('DATABASE_REPLICA_PIN_SECONDS', '5'))
+
+# Cache compartilhado entre os workers (Redis, obrigatório em produção; memória
+# local, por processo, só no desenvolvimento)
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Autenticação fora do banco em regime: usuário da sessão e tokens da API em
+# cache (invalidados ao salvar/excluir User ou Token; AUTH_CACHE_TIMEOUT limita
+# a defasagem entre processos quando o cache é local). Sessões em cache+banco
+# quando há Redis; SESSION_ENGINE permite escolher outro backend.
+AUTHENTICATION_BACKENDS = ['api.authentication.CachedModelBackend']
+AUTH_CACHE_TIMEOUT = int(os.getenv('AUTH_CACHE_TIMEOUT', '300'))
+SESSION_ENGINE = os.getenv(
+    'SESSION_ENGINE',
+    'django.contrib.sessions.backends.cached_db' if os.getenv('REDIS_URL') else 'django.contrib.sessions.backends.db',
+)
+
+# Catálogo de produtos em cache (invalidado por versão a cada alteração de Product)
+CATALOG_CACHE_TIMEOUT = int(os.getenv('CATALOG_CACHE_TIMEOUT', '86400'))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -101,7 +157,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -123,7 +179,135 @@ STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY', '')
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', '')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET', '')
 
-# Logging
+# Cliente HTTP do Stripe: um pool keep-alive por processo, dimensionado
+# pelo número de threads do worker do gunicorn
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', 'https://api.stripe.com')
+STRIPE_HTTP_POOL_SIZE = int(os.getenv('STRIPE_HTTP_POOL_SIZE', os.getenv('GUNICORN_THREADS', '4')))
+STRIPE_CONNECT_TIMEOUT = float(os.getenv('STRIPE_CONNECT_TIMEOUT', '5'))
+STRIPE_READ_TIMEOUT = float(os.getenv('STRIPE_READ_TIMEOUT', '30'))
+STRIPE_MAX_NETWORK_RETRIES = int(os.getenv('STRIPE_MAX_NETWORK_RETRIES', '2'))
+# 429 (rate limit / lock_timeout): novas tentativas com backoff exponencial
+# e jitter, respeitando Retry-After, enquanto a espera total couber em
+# STRIPE_RATE_LIMIT_MAX_WAIT segundos
+STRIPE_RATE_LIMIT_RETRIES = int(os.getenv('STRIPE_RATE_LIMIT_RETRIES', '3'))
+STRIPE_RATE_LIMIT_BASE_DELAY = float(os.getenv('STRIPE_RATE_LIMIT_BASE_DELAY', '0.5'))
+STRIPE_RATE_LIMIT_MAX_WAIT = float(os.getenv('STRIPE_RATE_LIMIT_MAX_WAIT', '5'))
+
+# Circuit breaker por operação (payments/circuit_breaker.py): abre após
+# `failures` falhas seguidas (conexão, timeout, 5xx ou chamada mais lenta que
+# `slow_call_seconds`) e testa o Stripe de novo após `reset_timeout` segundos
+STRIPE_CIRCUIT_BREAKER_ENABLED = os.getenv('STRIPE_CIRCUIT_BREAKER_ENABLED', 'True').lower() == 'true'
+STRIPE_CIRCUIT_BREAKER = {
+    'default': {
+        'failures': int(os.getenv('STRIPE_CIRCUIT_FAILURES', '5')),
+        'reset_timeout': float(os.getenv('STRIPE_CIRCUIT_RESET_TIMEOUT', '30')),
+        'slow_call_seconds': float(os.getenv('STRIPE_CIRCUIT_SLOW_CALL_SECONDS', '10')),
+    },
+    # Rotas interativas: desistir antes, voltar a testar antes
+    'PaymentIntent.create': {'failures': 3, 'reset_timeout': 15},
+    'PaymentIntent.retrieve': {'failures': 3, 'reset_timeout': 15},
+    'Customer.create': {'failures': 3, 'reset_timeout': 15},
+}
+
+# Limites de taxa (payments/throttling.py) das rotas que criam PaymentIntents
+# e customers no Stripe, em 'N/s|min|h' por usuário e global; vazio desliga
+STRIPE_RATE_LIMITS = {
+    'payment_intent': {
+        'user': os.getenv('RATE_LIMIT_PAYMENT_INTENT_USER', '10/min'),
+        'global': os.getenv('RATE_LIMIT_PAYMENT_INTENT_GLOBAL', '50/s'),
+    },
+    'customer': {
+        'global': os.getenv('RATE_LIMIT_CUSTOMER_GLOBAL', '10/s'),
+    },
+}
+
+# Checkout (payments/checkout.py): threads por processo para a preparação em
+# paralelo (customer no Stripe enquanto o pagamento é reservado). A busca de
+# customers legados por email custa uma chamada a mais no primeiro checkout
+# de cada usuário; desnecessária depois de `sync_stripe_customers`.
+CHECKOUT_PREPARE_THREADS = int(os.getenv('CHECKOUT_PREPARE_THREADS', os.getenv('GUNICORN_THREADS', '4')))
+STRIPE_CUSTOMER_EMAIL_LOOKUP = os.getenv('STRIPE_CUSTOMER_EMAIL_LOOKUP', 'False').lower() == 'true'
+
+# Páginas de pagamento: o Stripe só é consultado para pagamentos não finais
+# sem atualização local há mais de PAYMENT_STATUS_REFRESH_AFTER segundos
+PAYMENT_INTENT_CACHE_TTL = int(os.getenv('PAYMENT_INTENT_CACHE_TTL', '15'))
+PAYMENT_STATUS_REFRESH_AFTER = int(os.getenv('PAYMENT_STATUS_REFRESH_AFTER', '10'))
+
+# Idempotency-Key na criação de pagamentos: respostas guardadas por
+# IDEMPOTENCY_KEY_TTL_HOURS; duplicatas em andamento aguardam até
+# IDEMPOTENCY_WAIT_TIMEOUT segundos; uma chave presa há mais de
+# IDEMPOTENCY_LOCK_TIMEOUT_SECONDS (requisição morta) pode ser retomada
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv('IDEMPOTENCY_WAIT_TIMEOUT', '10'))
+IDEMPOTENCY_LOCK_TIMEOUT_SECONDS = int(os.getenv('IDEMPOTENCY_LOCK_TIMEOUT_SECONDS', '60'))
+
+# Webhooks: no modo assíncrono a view apenas valida, grava e confirma o evento;
+# o processamento fica com `python manage.py process_webhooks`
+STRIPE_WEBHOOK_ASYNC = os.getenv('STRIPE_WEBHOOK_ASYNC', 'False').lower() == 'true'
+STRIPE_WEBHOOK_WORKERS = int(os.getenv('STRIPE_WEBHOOK_WORKERS', '4'))
+STRIPE_WEBHOOK_BATCH_SIZE = int(os.getenv('STRIPE_WEBHOOK_BATCH_SIZE', '50'))
+STRIPE_WEBHOOK_MAX_ATTEMPTS = int(os.getenv('STRIPE_WEBHOOK_MAX_ATTEMPTS', '8'))
+STRIPE_WEBHOOK_RETRY_BASE_SECONDS = int(os.getenv('STRIPE_WEBHOOK_RETRY_BASE_SECONDS', '10'))
+STRIPE_WEBHOOK_RETRY_MAX_SECONDS = int(os.getenv('STRIPE_WEBHOOK_RETRY_MAX_SECONDS', '3600'))
+STRIPE_WEBHOOK_LOCK_TIMEOUT_SECONDS = int(os.getenv('STRIPE_WEBHOOK_LOCK_TIMEOUT_SECONDS', '300'))
+# Eventos com prioridade maior são processados primeiro (padrão 0)
+STRIPE_WEBHOOK_PRIORITIES = {
+    'payment_intent.succeeded': 10,
+    'payment_intent.payment_failed': 10,
+    'payment_intent.canceled': 5,
+    'payment_intent.processing': 1,
+    'payment_intent.requires_action': 1,
+}
+
+# Eventos sem handler: 'minimal' grava só a referência ao objeto, 'full' o
+# payload completo e 'none' apenas confirma o recebimento
+STRIPE_WEBHOOK_UNHANDLED_STORAGE = os.getenv('STRIPE_WEBHOOK_UNHANDLED_STORAGE', 'minimal')
+# `python manage.py archive_webhook_events` move os eventos processados há
+# mais de STRIPE_WEBHOOK_RETENTION_DAYS dias para arquivos NDJSON gzip
+STRIPE_WEBHOOK_RETENTION_DAYS = int(os.getenv('STRIPE_WEBHOOK_RETENTION_DAYS', '30'))
+STRIPE_WEBHOOK_ARCHIVE_DIR = os.getenv('STRIPE_WEBHOOK_ARCHIVE_DIR', str(BASE_DIR / 'archive' / 'webhooks'))
+
+# Outbox de sincronização de produtos: `python manage.py sync_stripe_products`
+STRIPE_SYNC_WORKERS = int(os.getenv('STRIPE_SYNC_WORKERS', '8'))
+STRIPE_SYNC_BATCH_SIZE = int(os.getenv('STRIPE_SYNC_BATCH_SIZE', '100'))
+STRIPE_SYNC_MAX_ATTEMPTS = int(os.getenv('STRIPE_SYNC_MAX_ATTEMPTS', '8'))
+STRIPE_SYNC_RETRY_BASE_SECONDS = int(os.getenv('STRIPE_SYNC_RETRY_BASE_SECONDS', '10'))
+STRIPE_SYNC_RETRY_MAX_SECONDS = int(os.getenv('STRIPE_SYNC_RETRY_MAX_SECONDS', '3600'))
+STRIPE_SYNC_LOCK_TIMEOUT_SECONDS = int(os.getenv('STRIPE_SYNC_LOCK_TIMEOUT_SECONDS', '300'))
+
+# Aquecimento dos workers do gunicorn (stripe_sandbox/warmup.py): abre uma
+# conexão com o Stripe antes do primeiro checkout
+WARMUP_STRIPE_CONNECT = os.getenv('WARMUP_STRIPE_CONNECT', 'True').lower() == 'true'
+
+# Métricas do Prometheus em /metrics (stripe_sandbox/metrics.py). Com
+# METRICS_TOKEN definido, a coleta exige `Authorization: Bearer <token>`;
+# sem ele, METRICS_REQUIRE_TOKEN (ligado em produção) bloqueia a coleta.
+# Sob o gunicorn as métricas dos workers são agregadas via
+# PROMETHEUS_MULTIPROC_DIR (definido em gunicorn.conf.py); o worker
+# process_webhooks as expõe em WEBHOOK_METRICS_PORT (0 desliga).
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_REQUIRE_TOKEN = os.getenv('METRICS_REQUIRE_TOKEN', 'False').lower() == 'true'
+WEBHOOK_METRICS_PORT = int(os.getenv('WEBHOOK_METRICS_PORT', '0'))
+
+# Server-Timing por requisição (db, stripe, render) em stripe_sandbox/timing.py.
+# Requisições a partir de SLOW_REQUEST_MS sempre vão para o log
+# stripe_sandbox.timing; das demais, a fração SERVER_TIMING_LOG_SAMPLE_RATE.
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', '1000'))
+SERVER_TIMING_LOG_SAMPLE_RATE = float(os.getenv('SERVER_TIMING_LOG_SAMPLE_RATE', '0.01'))
+# Comentário JSON com os totais no fim das páginas HTML
+SERVER_TIMING_FOOTER = os.getenv('SERVER_TIMING_FOOTER', 'False').lower() == 'true'
+
+# Logging: registros enfileirados e escritos por uma thread (stripe_sandbox/log.py).
+# Perfil de produção: JSON, nível INFO (uma linha de resumo por checkout e por
+# webhook) e amostragem dos loggers de alto volume listados em LOG_SAMPLED_LOGGERS.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1.0'))
+LOG_SAMPLED_LOGGERS = [
+    name for name in os.getenv('LOG_SAMPLED_LOGGERS', 'payments.intents,payments.catalog').split(',') if name
+]
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -132,23 +316,40 @@ LOGGING = {
             'format': '{levelname} {asctime} {module} {process:d} {thread:d} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'stripe_sandbox.log.JsonFormatter',
+        },
+    },
+    'filters': {
+        'sample': {
+            '()': 'stripe_sandbox.log.SamplingFilter',
+            'rate': LOG_SAMPLE_RATE,
+        },
     },
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
-            'formatter': 'verbose'
+            'class': 'stripe_sandbox.log.AsyncStreamHandler',
+            'formatter': LOG_FORMAT,
+            'maxsize': LOG_QUEUE_SIZE,
         },
     },
     'loggers': {
         'payments': {
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'propagate': True,
         },
         'api': {
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'propagate': True,
         },
+        # Server-Timing (requisições lentas) e aquecimento dos workers
+        'stripe_sandbox': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': True,
+        },
+        **{name: {'filters': ['sample']} for name in LOG_SAMPLED_LOGGERS},
     },
-}
\ No newline at end of file
+}
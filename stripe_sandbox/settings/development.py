@@ -1,4 +1,5 @@
 from .base import *
+import os
 
 DEBUG = True
 
@@ -14,16 +15,16 @@ CORS_ALLOWED_ORIGINS = [
 CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOW_ALL_ORIGINS = DEBUG  # Apenas em desenvolvimento
 
-# Database SQLite para desenvolvimento
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
-}
+# Database: SQLite por padrão (DATABASE_URL/DATABASE_REPLICA_URL em base.py)
 
 # Adicionar browsable API em desenvolvimento
 REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = [
     'rest_framework.renderers.JSONRenderer',
     'rest_framework.renderers.BrowsableAPIRenderer',
-]
\ No newline at end of file
+]
+# Logs legíveis e detalhados no desenvolvimento
+LOGGING['handlers']['console']['formatter'] = os.getenv('LOG_FORMAT', 'verbose')
+for _logger in ('payments', 'api'):
+    LOGGING['loggers'][_logger]['level'] = os.getenv('LOG_LEVEL', 'DEBUG')
+# Totais de tempo (db, stripe, render) no fim de cada página HTML
+SERVER_TIMING_FOOTER = os.getenv('SERVER_TIMING_FOOTER', 'True').lower() == 'true'
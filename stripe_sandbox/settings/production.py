@@ -1,8 +1,16 @@
 from .base import *
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 DEBUG = False
 
+# Catálogo, limites de taxa e sessões dependem de um cache compartilhado
+# entre os workers: com LocMemCache cada processo teria a sua versão do
+# catálogo e continuaria vendendo pelo preço antigo
+if not os.getenv('REDIS_URL'):
+    raise ImproperlyConfigured('REDIS_URL é obrigatório em produção (cache compartilhado entre os workers)')
+
 ALLOWED_HOSTS = [
     '.railway.app',
     '.vercel.app',
@@ -10,13 +18,11 @@ ALLOWED_HOSTS = [
     '127.0.0.1',
 ]
 
-# Usar SQLite primeiro para o deploy funcionar
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
-}
+# Banco definido por DATABASE_URL (PostgreSQL do Railway) em base.py;
+# sem a variável, cai no SQLite local
+
+# /metrics só com METRICS_TOKEN definido
+METRICS_REQUIRE_TOKEN = os.getenv('METRICS_REQUIRE_TOKEN', 'True').lower() == 'true'
 
 # CORS para produção
 CORS_ALLOWED_ORIGINS = [
@@ -30,10 +36,13 @@ CSRF_TRUSTED_ORIGINS = [
     'https://*.railway.app',
 ]
 
-# Certifique-se de que está nos ALLOWED_HOSTS
+# Certifique-se de que está nos ALLOWED_HOSTS. O Django não aceita '*.'
+# (subdomínios são '.railway.app'); o health check do deploy chega com
+# Host healthcheck.railway.app
 ALLOWED_HOSTS = [
     'stripe-backend-api-production.up.railway.app',
-    '*.railway.app',
+    'healthcheck.railway.app',
+    '.railway.app',
     'localhost',
     '127.0.0.1',
 ]
@@ -0,0 +1,158 @@
+# stripe_sandbox/timing.py
+"""
+Tempo de cada requisição dividido entre banco, Stripe e renderização.
+
+ServerTimingMiddleware abre um coletor por requisição (ContextVar) e
+instala um execute_wrapper em todas as conexões; StripeClient.call e o
+backend de templates TimedDjangoTemplates somam seus tempos no mesmo
+coletor. A resposta recebe o cabeçalho Server-Timing, visível na aba
+Network do navegador:
+
+    Server-Timing: db;dur=4.1;desc="3 consultas", stripe;dur=312.0;desc="2 chamadas", render;dur=8.7, total;dur=331.5
+
+Requisições acima de SLOW_REQUEST_MS vão sempre para o logger
+stripe_sandbox.timing; das demais, apenas a fração
+SERVER_TIMING_LOG_SAMPLE_RATE. Com SERVER_TIMING_FOOTER, páginas HTML
+recebem também um comentário JSON no fim com os totais.
+"""
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('request_timings', default=None)
+
+# Partes exibidas no Server-Timing e como descrever a contagem
+PARTS = (('db', 'consultas'), ('stripe', 'chamadas'), ('render', None))
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.elapsed = None
+
+    def add(self, part, seconds):
+        self.durations[part] += seconds
+        self.counts[part] += 1
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    def summary(self):
+        summary = {'total_ms': round(self.elapsed * 1000, 1)}
+        for part, _ in PARTS:
+            summary[f'{part}_ms'] = round(self.durations[part] * 1000, 1)
+            summary[f'{part}_count'] = self.counts[part]
+        return summary
+
+    def header(self):
+        metrics = []
+        for part, label in PARTS:
+            metric = f'{part};dur={self.durations[part] * 1000:.1f}'
+            if label:
+                metric += f';desc="{self.counts[part]} {label}"'
+            metrics.append(metric)
+        metrics.append(f'total;dur={self.elapsed * 1000:.1f}')
+        return ', '.join(metrics)
+
+
+def record(part, started):
+    """Soma o tempo decorrido desde `started` ao coletor da requisição atual (se houver)"""
+    timings = _current.get()
+    if timings is not None:
+        timings.add(part, time.perf_counter() - started)
+
+
+def _time_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record('db', started)
+
+
+class _TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            record('render', started)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates que mede a renderização (includes contam dentro do template pai)"""
+
+    def from_string(self, template_code):
+        return _TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TimedTemplate(super().get_template(template_name))
+
+
+class ServerTimingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_time_query))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+            timings.finish()
+
+        summary = timings.summary()
+        response['Server-Timing'] = timings.header()
+        if settings.SERVER_TIMING_FOOTER and not response.streaming:
+            self.add_footer(response, summary)
+        self.log(request, response, summary)
+        return response
+
+    def add_footer(self, response, summary):
+        if not response.get('Content-Type', '').startswith('text/html'):
+            return
+        footer = f'\n<!-- server-timing {json.dumps(summary)} -->\n'.encode()
+        response.content += footer
+        if response.has_header('Content-Length'):
+            response['Content-Length'] = str(len(response.content))
+
+    def log(self, request, response, summary):
+        slow = summary['total_ms'] >= settings.SLOW_REQUEST_MS
+        if not slow and random.random() >= settings.SERVER_TIMING_LOG_SAMPLE_RATE:
+            return
+        match = getattr(request, 'resolver_match', None)
+        logger.log(
+            logging.WARNING if slow else logging.INFO,
+            "%s %s %s em %.0f ms (db %.0f ms/%s, stripe %.0f ms/%s, render %.0f ms)",
+            request.method, request.path, response.status_code, summary['total_ms'],
+            summary['db_ms'], summary['db_count'], summary['stripe_ms'], summary['stripe_count'],
+            summary['render_ms'],
+            extra={
+                'event': 'slow_request' if slow else 'request_timing',
+                'view': match.view_name if match else None,
+                'status': response.status_code,
+                **summary,
+            },
+        )
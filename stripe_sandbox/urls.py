@@ -1,8 +1,11 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from .metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('api/v1/', include('api.urls')),
     # Webhook em payments (sem namespace para evitar conflito)
     path('webhook/stripe/', include('payments.urls')),
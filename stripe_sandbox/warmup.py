@@ -0,0 +1,99 @@
+# stripe_sandbox/warmup.py
+"""
+Aquecimento do processo antes de receber tráfego (ver gunicorn.conf.py).
+
+- warmup_imports: importa as views (e com elas o stripe), monta o
+  resolver de URLs e compila os templates. Roda no master quando
+  preload_app está ligado, e os workers herdam tudo pelo fork.
+- warmup_connections: abre o pool HTTP do Stripe (compartilhado pelas
+  threads do worker) e carrega o catálogo no cache. Roda em cada worker
+  depois do fork, porque conexões não podem ser compartilhadas entre
+  processos. Banco e cache não são pré-conectados: as conexões do Django
+  são por thread, e as threads do gthread abrem as suas no primeiro uso.
+
+Falhas são registradas e ignoradas: o aquecimento nunca impede o worker
+de subir.
+"""
+import logging
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+WARMUP_TEMPLATES = (
+    'payments/index.html',
+    'payments/product_detail.html',
+    'payments/checkout.html',
+    'payments/success.html',
+    'payments/history.html',
+    'payments/payment_detail.html',
+)
+
+
+def _step(name, func):
+    started = time.perf_counter()
+    try:
+        func()
+    except Exception as e:
+        logger.warning("Warmup: %s falhou: %s", name, e)
+        return
+    logger.debug("Warmup: %s em %.0f ms", name, (time.perf_counter() - started) * 1000)
+
+
+def _resolve_urls():
+    from django.urls import get_resolver
+
+    # Importa o URLconf e as views de todas as rotas e preenche os caches do resolver
+    get_resolver().reverse_dict
+
+
+def _load_templates():
+    from django.template import TemplateDoesNotExist
+    from django.template.loader import get_template
+
+    for name in WARMUP_TEMPLATES:
+        try:
+            get_template(name)
+        except TemplateDoesNotExist:
+            pass
+
+
+def _import_stripe():
+    from payments import stripe_client  # noqa: F401  (importa stripe e seus subpacotes)
+
+
+def warmup_imports():
+    started = time.perf_counter()
+    _step('stripe', _import_stripe)
+    _step('urls', _resolve_urls)
+    _step('templates', _load_templates)
+    logger.info("Imports aquecidos em %.0f ms", (time.perf_counter() - started) * 1000)
+
+
+def _connect_stripe():
+    from payments.stripe_client import get_client
+
+    client = get_client()
+    if settings.WARMUP_STRIPE_CONNECT:
+        # Abre a conexão TLS do pool; a resposta em si não importa
+        client.session.head(settings.STRIPE_API_BASE, timeout=settings.STRIPE_CONNECT_TIMEOUT)
+
+
+def _load_catalog():
+    from payments.catalog import get_catalog
+
+    get_catalog()
+
+
+def warmup_connections():
+    from django.db import connections
+
+    started = time.perf_counter()
+    _step('stripe', _connect_stripe)
+    _step('catálogo', _load_catalog)
+    # A conexão aberta pelo catálogo é desta thread e nenhuma requisição a reutilizaria
+    for connection in connections.all(initialized_only=True):
+        if not connection.in_atomic_block:
+            connection.close()
+    logger.info("Conexões aquecidas em %.0f ms", (time.perf_counter() - started) * 1000)